@@ -0,0 +1,72 @@
+"""Run the pipeline benchmarks: python -m benchmarks [--scale 1 --scale 10] [--filter name] [--json out.json]
+
+For each benchmark and scale, reports the best and mean wall time over --repeat runs, and the peak memory
+allocated by Python during one extra run (measured with tracemalloc, so memory allocated by verovio's C++
+code isn't included).
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import statistics
+import time
+import tracemalloc
+
+from benchmarks.bench_pipeline import BENCHMARKS
+
+
+def run_benchmark(setup, fn, scale, repeat):
+    times = []
+    # The stages print a lot of progress output, which isn't what we want to measure
+    with contextlib.redirect_stdout(io.StringIO()):
+        args = setup(scale)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn(*args)
+            times.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            fn(*args)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {"best": min(times), "mean": statistics.mean(times), "peak_memory": peak}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the stages of the alignment pipeline")
+    parser.add_argument(
+        "--scale",
+        type=int,
+        action="append",
+        help="Run with the inputs repeated this many times (can be given more than once, default 1, 10 and 100)",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs of each benchmark")
+    parser.add_argument("--filter", "-k", help="Only run benchmarks whose name contains this string")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+    scales = args.scale or [1, 10, 100]
+
+    results = []
+    print(f"{'benchmark':<45} {'scale':>5} {'best (s)':>10} {'mean (s)':>10} {'peak mem (MB)':>14}")
+    for name, setup, fn in BENCHMARKS:
+        if args.filter and args.filter not in name:
+            continue
+        for scale in scales:
+            result = {"name": name, "scale": scale, **run_benchmark(setup, fn, scale, args.repeat)}
+            results.append(result)
+            print(
+                f"{name:<45} {scale:>5} {result['best']:>10.4f} {result['mean']:>10.4f} "
+                f"{result['peak_memory'] / 1024 / 1024:>14.2f}",
+                flush=True,
+            )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""Benchmarks of the stages of the alignment pipeline, using the bundled examples.
+
+Each benchmark has a setup function, which prepares the inputs for a scale factor and isn't timed, and a
+function that runs the stage on those inputs.
+"""
+
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from pyld import jsonld
+from rdflib import RDF, Graph, URIRef
+
+from benchmarks.synthetic import scale_corresp, scale_mei, scale_notes
+from scripts import verovio_midi
+from scripts.convert_to_rdf import (
+    generate_structural_segmentation,
+    graph_to_jsonld,
+    maps_result_to_graph,
+    merge_graph,
+    performance_to_graph,
+    segmentation_to_graph,
+    segmentation_to_turtle,
+)
+from scripts.mei_to_midi import mei_to_midi
+from scripts.trompa_align import generate_maps_result_json
+from scripts.verovio_pool import toolkit_pool
+from scripts.namespace import LDP
+from scripts.timeline_columns import maps_result_to_columns
+from trompaalign.mei import count_notes_in_expansions, get_expansions_from_mei, get_metadata_for_mei
+from trompaalign.solid import get_contents_of_container, jsonld_context, parse_container_ntriples
+
+ROOT = Path(__file__).parent.parent
+EXAMPLE_MEI = ROOT / "examples" / "example.mei"
+EXAMPLE_CORRESPS = sorted((ROOT / "examples" / "example-corresps").glob("*.boe_corresp.txt"))
+BEETHOVEN_MEI = ROOT / "trompaalign" / "test" / "data" / "Beethoven_Op119_Nr08-Breitkopf.mei"
+
+MEI_URI = "https://example.org/score.mei"
+TIMELINE_URI = "https://example.org/timelines/performance"
+SCORE_URI = "https://example.org/scores/score"
+AUDIO_URI = "https://example.org/audio/performance.mp3"
+SEGMENTS_URI = "https://example.org/segments/score"
+
+BENCHMARKS = []
+
+
+def benchmark(name, setup):
+    """Register a benchmark. `setup(scale)` returns the arguments that the benchmark is called with"""
+
+    def register(fn):
+        BENCHMARKS.append((name, setup, fn))
+        return fn
+
+    return register
+
+
+def _read(path):
+    with open(path, "r") as f:
+        return f.read()
+
+
+def _example_notes():
+    return verovio_midi.render_midi_and_notes(_read(EXAMPLE_MEI), None)[1]
+
+
+def _clear_verovio_caches():
+    """Benchmark verovio stages from a cold start, not from the per-process caches"""
+    toolkit_pool.clear()
+    verovio_midi.clear_rendering_cache()
+
+
+def _setup_mei(path):
+    def setup(scale):
+        return (scale_mei(_read(path), scale),)
+
+    return setup
+
+
+def _setup_mei_file(path):
+    def setup(scale):
+        fd, scaled_path = tempfile.mkstemp(suffix=".mei")
+        with os.fdopen(fd, "w") as f:
+            f.write(scale_mei(_read(path), scale))
+        return (scaled_path,)
+
+    return setup
+
+
+def _setup_corresps(scale):
+    notes = _example_notes()
+    corresps = [scale_corresp(_read(path), notes, scale) for path in EXAMPLE_CORRESPS]
+    return corresps, scale_notes(notes, scale)
+
+
+def _setup_maps_results(scale):
+    corresps, notes = _setup_corresps(scale)
+    maps_results = []
+    with tempfile.TemporaryDirectory() as td:
+        for i, corresp in enumerate(corresps):
+            output = os.path.join(td, f"maps{i}.json")
+            generate_maps_result_json(corresp, notes, output)
+            with open(output, "rb") as f:
+                maps_results.append(f.read())
+    return (maps_results,)
+
+
+def _setup_timeline_graph(scale):
+    (maps_results,) = _setup_maps_results(scale)
+    return (maps_result_to_graph(maps_results[0], MEI_URI, TIMELINE_URI, SCORE_URI, AUDIO_URI, False, "benchmark"),)
+
+
+def _setup_segmentation(scale):
+    (mei_file,) = _setup_mei_file(EXAMPLE_MEI)(scale)
+    segmentation = generate_structural_segmentation(mei_file)
+    os.unlink(mei_file)
+    return (segmentation,)
+
+
+for _label, _path in [("example", EXAMPLE_MEI), ("beethoven", BEETHOVEN_MEI)]:
+
+    @benchmark(f"mei_to_midi[{_label}]", _setup_mei(_path))
+    def bench_mei_to_midi(mei_data):
+        _clear_verovio_caches()
+        with tempfile.NamedTemporaryFile(suffix=".mid") as out:
+            mei_to_midi(mei_data, out.name)
+
+    @benchmark(f"generate_notes_from_mei[{_label}]", _setup_mei_file(_path))
+    def bench_generate_notes_from_mei(mei_file):
+        _clear_verovio_caches()
+        verovio_midi.generate_notes_from_mei(mei_file, None)
+
+    @benchmark(f"generate_structural_segmentation[{_label}]", _setup_mei_file(_path))
+    def bench_generate_structural_segmentation(mei_file):
+        generate_structural_segmentation(mei_file)
+
+
+@benchmark("generate_maps_result_json", _setup_corresps)
+def bench_generate_maps_result_json(corresps, notes):
+    with tempfile.TemporaryDirectory() as td:
+        for i, corresp in enumerate(corresps):
+            generate_maps_result_json(corresp, notes, os.path.join(td, f"maps{i}.json"))
+
+
+@benchmark("maps_result_to_graph", _setup_maps_results)
+def bench_maps_result_to_graph(maps_results):
+    for maps_result in maps_results:
+        maps_result_to_graph(maps_result, MEI_URI, TIMELINE_URI, SCORE_URI, AUDIO_URI, True, "benchmark")
+
+
+@benchmark("maps_result_to_columns", _setup_maps_results)
+def bench_maps_result_to_columns(maps_results):
+    for maps_result in maps_results:
+        maps_result_to_columns(maps_result, MEI_URI, TIMELINE_URI).to_json()
+
+
+def _setup_performance_graphs(scale):
+    return (
+        [
+            performance_to_graph(f"{TIMELINE_URI}{i}", f"{TIMELINE_URI}{i}", SCORE_URI, AUDIO_URI, "benchmark")
+            for i in range(100 * scale)
+        ],
+    )
+
+
+@benchmark("merge_graph[add]", _setup_performance_graphs)
+def bench_merge_graph(performance_graphs):
+    graph = Graph()
+    for performance_graph in performance_graphs:
+        merge_graph(graph, performance_graph)
+
+
+@benchmark("merge_graph[serialize and parse]", _setup_performance_graphs)
+def bench_merge_graph_reparse(performance_graphs):
+    # How maps_result_to_graph used to merge the performance into the timeline, for comparison
+    graph = Graph()
+    for performance_graph in performance_graphs:
+        graph.parse(data=performance_graph.serialize(format="n3"), format="n3")
+
+
+CONTAINER_URI = "https://pod.example.org/alice/at.ac.mdw.trompa/midi/"
+
+
+def _setup_container_listing(scale):
+    graph = Graph()
+    container = URIRef(CONTAINER_URI)
+    graph.add((container, RDF.type, LDP.BasicContainer))
+    for i in range(1000 * scale):
+        item = URIRef(f"{CONTAINER_URI}{i}.mid")
+        graph.add((container, LDP.contains, item))
+        graph.add((item, RDF.type, LDP.Resource))
+    return graph.serialize(format="nt"), json.loads(graph.serialize(format="json-ld"))
+
+
+@benchmark("container_listing[ntriples]", _setup_container_listing)
+def bench_container_listing(ntriples, listing_jsonld):
+    parse_container_ntriples(ntriples.splitlines(), CONTAINER_URI)
+
+
+@benchmark("container_listing[jsonld compact]", _setup_container_listing)
+def bench_container_listing_jsonld(ntriples, listing_jsonld):
+    # How containers were listed with get_pod_listing, for comparison
+    get_contents_of_container(jsonld.compact(listing_jsonld, jsonld_context), CONTAINER_URI)
+
+
+@benchmark("graph_to_jsonld", _setup_timeline_graph)
+def bench_graph_to_jsonld(graph: Graph):
+    json.dumps(graph_to_jsonld(graph, mei_uri=MEI_URI, tl_uri=TIMELINE_URI))
+
+
+@benchmark("segmentation_to_graph", _setup_segmentation)
+def bench_segmentation_to_graph(segmentation):
+    segmentation_to_graph(segmentation, SEGMENTS_URI)
+
+
+@benchmark("segmentation_to_turtle", _setup_segmentation)
+def bench_segmentation_to_turtle(segmentation):
+    segmentation_to_turtle(segmentation, SEGMENTS_URI)
+
+
+@benchmark("trompaalign.mei[beethoven]", _setup_mei(BEETHOVEN_MEI))
+def bench_mei_helpers(mei_data):
+    get_metadata_for_mei(mei_data)
+    get_expansions_from_mei(mei_data)
+    count_notes_in_expansions(mei_data)
@@ -0,0 +1,86 @@
+"""Make larger inputs for benchmarks by repeating the bundled examples.
+
+Each generator returns an input equivalent to playing the original `factor` times in a row, with new ids
+for each repetition, so that stages see `factor` times as many notes.
+"""
+
+import copy
+import csv
+import io
+
+from lxml import etree
+
+XML_ID = "{http://www.w3.org/XML/1998/namespace}id"
+MEI_NS = "http://www.music-encoding.org/ns/mei"
+
+
+def _rename_ids(element, suffix):
+    """Add `suffix` to all xml:ids in an element, and to references to them in attributes"""
+    ids = {e.get(XML_ID) for e in element.iter() if isinstance(e.tag, str) and e.get(XML_ID)}
+    for e in element.iter():
+        if not isinstance(e.tag, str):
+            continue
+        for name, value in e.attrib.items():
+            if name == XML_ID:
+                e.set(name, value + suffix)
+            elif "#" in value:
+                refs = [ref + suffix if ref.startswith("#") and ref[1:] in ids else ref for ref in value.split(" ")]
+                e.set(name, " ".join(refs))
+
+
+def scale_mei(mei_data, factor):
+    """Repeat the music of an MEI file `factor` times. The copies of the top-level sections are added after
+    the originals, without the expansions"""
+    if factor == 1:
+        return mei_data
+    tree = etree.parse(io.BytesIO(mei_data.encode("utf-8")))
+    score = tree.find(f".//{{{MEI_NS}}}score")
+    sections = score.findall(f"{{{MEI_NS}}}section")
+    for repetition in range(1, factor):
+        for section in sections:
+            section_copy = copy.deepcopy(section)
+            for expansion in section_copy.findall(f".//{{{MEI_NS}}}expansion"):
+                expansion.getparent().remove(expansion)
+            _rename_ids(section_copy, f"-rep{repetition}")
+            score.append(section_copy)
+    return etree.tostring(tree, xml_declaration=True, encoding="UTF-8").decode("utf-8")
+
+
+def _notes_duration_ms(notes):
+    return max(note["tstamp"] for note in notes) + 1000
+
+
+def scale_notes(notes, factor):
+    """Repeat a verovio note table (see generate_notes_from_mei) `factor` times, one after the other"""
+    duration = _notes_duration_ms(notes)
+    scaled = []
+    for repetition in range(factor):
+        suffix = f"-rep{repetition}" if repetition else ""
+        scaled.extend(
+            {**note, "id": note["id"] + suffix, "tstamp": note["tstamp"] + repetition * duration} for note in notes
+        )
+    return scaled
+
+
+def scale_corresp(corresp, notes, factor):
+    """Repeat a SMAT corresp file `factor` times, so that it matches `scale_notes(notes, factor)`"""
+    lines = corresp.splitlines()
+    header, rows = lines[0], [row.split("\t") for row in lines[1:] if row.strip()]
+    duration = _notes_duration_ms(notes) / 1000
+    align_duration = max(float(row[1]) for row in rows if row[0] != "*") + 1
+    count = len(rows)
+
+    out = io.StringIO()
+    out.write(header + "\n")
+    writer = csv.writer(out, delimiter="\t", lineterminator="\n")
+    for repetition in range(factor):
+        for row in rows:
+            row = list(row)
+            if row[0] != "*":
+                row[0] = str(int(row[0]) + repetition * count)
+                row[1] = f"{float(row[1]) + repetition * align_duration:.6f}"
+            if row[5] != "*":
+                row[5] = str(int(row[5]) + repetition * count)
+                row[6] = f"{float(row[6]) + repetition * duration:.6f}"
+            writer.writerow(row)
+    return out.getvalue()
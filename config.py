@@ -31,8 +31,9 @@ CELERY = {
     "result_backend": REDIS_URL,
     "task_ignore_result": True,
     "task_serializer": "json",
-    "result_serializer": "dataclass-json",
-    "accept_content": ["json", "dataclass-json"],
+    "result_serializer": "dataclass-msgpack",
+    # dataclass-json is still accepted so that results stored before switching to msgpack can be read
+    "accept_content": ["json", "dataclass-json", "dataclass-msgpack"],
     "beat_schedule": {
         "refresh-all-authentication-tokens": {
             "task": "trompaalign.tasks.refresh_all_authentication_tokens",
@@ -43,6 +44,28 @@ CELERY = {
 
 LOCAL_DEV = os.getenv("TR_ALIGN_LOCAL_DEV") == "true"
 
+# refresh-all-authentication-tokens: number of providers to refresh in parallel
+TOKEN_REFRESH_WORKERS = int(os.getenv("TR_ALIGN_TOKEN_REFRESH_WORKERS", "8"))
+# Minimum number of seconds between two token refreshes at the same provider, and a random delay to add to it
+TOKEN_REFRESH_PROVIDER_INTERVAL = float(os.getenv("TR_ALIGN_TOKEN_REFRESH_PROVIDER_INTERVAL", "0.5"))
+TOKEN_REFRESH_JITTER = float(os.getenv("TR_ALIGN_TOKEN_REFRESH_JITTER", "0.5"))
+# Only refresh tokens which expire within this many seconds. The task runs every 12 hours
+TOKEN_REFRESH_EXPIRY_MARGIN = int(os.getenv("TR_ALIGN_TOKEN_REFRESH_EXPIRY_MARGIN", str(13 * 60 * 60)))
+
+# Limits on writes to a single pod host, shared by all workers (see trompaalign.ratelimit)
+# Sustained writes per second, and how many writes can be made in a burst
+POD_WRITE_RATE = float(os.getenv("TR_ALIGN_POD_WRITE_RATE", "5"))
+POD_WRITE_BURST = int(os.getenv("TR_ALIGN_POD_WRITE_BURST", "10"))
+# Maximum number of writes in progress at the same time, and how long a write can hold its slot
+POD_WRITE_CONCURRENCY = int(os.getenv("TR_ALIGN_POD_WRITE_CONCURRENCY", "4"))
+POD_WRITE_LEASE = int(os.getenv("TR_ALIGN_POD_WRITE_LEASE", "300"))
+# Maximum number of seconds to wait for a write slot before writing anyway
+POD_WRITE_MAX_WAIT = float(os.getenv("TR_ALIGN_POD_WRITE_MAX_WAIT", "60"))
+
+# Port of the prometheus exporter started by each celery worker, 0 to not start one.
+# The webserver exposes its metrics at /metrics
+WORKER_METRICS_PORT = int(os.getenv("TR_ALIGN_WORKER_METRICS_PORT", "0"))
+
 
 CLIENT_REGISTRATION_DATA = {
     "client_name": "Clara",
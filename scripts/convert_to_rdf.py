@@ -11,11 +11,20 @@ from rdflib import Graph, URIRef, RDF, SKOS, Literal, BNode
 from rdflib.namespace import DCTERMS, RDFS
 from pyld import jsonld
 
-from scripts.namespace import MO, MELD, TL
+from scripts import jsonld_loader  # noqa: F401 (installs the JSON-LD document loader)
+from scripts.namespace import FRBR, MO, MELD, SO, TL
 
 
-def maps_result_to_graph(maps_result_json, meiUri, tlUri, scoreUri, audioUri, includePerformance, label):
-    maps_result = json.loads(maps_result_json)
+def maps_result_to_graph(
+    maps_result_json, meiUri, tlUri, scoreUri, audioUri, includePerformance, label, instants=None, first_annotation=None
+):
+    """The timeline of a MAPS result (JSON, or the already parsed list of observations).
+
+    If `instants` (a range of indexes into the MAPS result) is given, only those instants and their velocity
+    annotations are included, with the same IRIs as in the whole timeline. `first_annotation` is the number of
+    velocity annotations of the instants before the range, which is counted if it isn't given.
+    """
+    maps_result = json.loads(maps_result_json) if isinstance(maps_result_json, (str, bytes)) else maps_result_json
     rdf = f"""@prefix mo: <http://purl.org/ontology/mo/> .
 @prefix so: <http://www.linkedmusic.org/ontologies/segment/> .
 @prefix frbr: <http://purl.org/vocab/frbr/core#> .
@@ -35,7 +44,18 @@ def maps_result_to_graph(maps_result_json, meiUri, tlUri, scoreUri, audioUri, in
     """
 
     unique_num = 0
-    for ix, obs in enumerate(maps_result):
+    if instants is None:
+        instants = range(len(maps_result))
+    elif first_annotation is None:
+        unique_num = sum(len(_as_list(obs.get("velocity", []))) for obs in maps_result[: instants.start])
+    else:
+        unique_num = first_annotation
+    for ix in instants:
+        obs = maps_result[ix]
+        # Inserted notes have a single xml_id and velocity instead of lists
+        obs["xml_id"] = _as_list(obs["xml_id"])
+        if "velocity" in obs:
+            obs["velocity"] = _as_list(obs["velocity"])
         # FIXME HACK -- currently averages note velocities occuring at the same time
         velocity = """maps:velocity "{0}" ;""".format(mean(obs["velocity"])) if "velocity" in obs else ""
         rdf += """tlUri:{ix} a tl:Instant ;
@@ -74,10 +94,26 @@ def maps_result_to_graph(maps_result_json, meiUri, tlUri, scoreUri, audioUri, in
     graph = Graph()
     graph.parse(data=rdf, format="n3")
     if includePerformance:
-        # TODO: better way of doing this? Docs say to merge you should parse from text twice:
-        #  https://rdflib.readthedocs.io/en/stable/merging.html, but it'd be great to merge nodes
         performance_graph = performance_to_graph(tlUri, tlUri, scoreUri, audioUri, label)
-        graph.parse(data=performance_graph.serialize(format="n3"), format="n3")
+        merge_graph(graph, performance_graph)
+    return graph
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+def merge_graph(graph, other):
+    """Add the triples and namespace prefixes of `other` to `graph`.
+
+    rdflib's docs recommend merging by parsing both graphs from text so that blank nodes are given new ids
+    (https://rdflib.readthedocs.io/en/stable/merging.html). That's only needed for graphs that were parsed
+    separately from documents that use the same blank node labels: blank nodes that we create with BNode()
+    have unique ids, so their triples can be added as they are.
+    """
+    graph += other
+    for prefix, namespace in other.namespaces():
+        graph.bind(prefix, namespace, override=False)
     return graph
 
 
@@ -278,46 +314,75 @@ def score_to_graph(score_uri, seg_uri, performance_resource, mei_uri, mei_copy_u
     return graph
 
 
-def segmentation_to_graph(seg_data, segUri):
-    rdf = """@prefix mo: <http://purl.org/ontology/mo/> .
-@prefix so: <http://www.linkedmusic.org/ontologies/segment/> .
+SEGMENTATION_PREFIXES = """@prefix so: <http://www.linkedmusic.org/ontologies/segment/> .
 @prefix frbr: <http://purl.org/vocab/frbr/core#> .
 @prefix rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#> .
 @prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .
 @prefix meld: <https://meld.linkedmusic.org/terms/> .
-@base <{segUri}> .
 
-<{segUri}> a so:SegmentLine .
-    """.format(segUri=segUri)
+"""
+
+
+def _turtle_iri(uri):
+    # Ids of MEI elements are xml:ids, which can't contain characters that would need escaping in an IRI
+    return "<" + uri + ">"
+
+
+def iter_segmentation_turtle(seg_data, segUri):
+    """Write the structural segmentation from generate_structural_segmentation as Turtle, yielding one
+    chunk of text per section. Each section is a so:Segment with an embodiment listing its notes and measures."""
+    yield SEGMENTATION_PREFIXES
+    yield f"{_turtle_iri(segUri)} a so:SegmentLine .\n\n"
+    segment_line = _turtle_iri(segUri + "#segmentation")
     for ix, seg in enumerate(seg_data):
-        rdf += """<#{segId}> a so:Segment ;
-    so:onSegmentLine <{segUri}#segmentation> ;
-    meld:order "{ix}" ;
-    frbr:embodiment [ a meld:MEIManifestation, rdf:Bag ;
-    rdfs:member <{sectionId}> ;
-    meld:notes {notes} ;
-    meld:measures {measures} ;
-    meld:startsWith {first} ;
-    meld:endsWith {last} ] {endterm}
-    {before}
-    {after}""".format(
-            ix=ix,
-            segUri=segUri,
-            segId=seg,
-            sectionId=segUri + "#" + seg,
-            first="<" + segUri + "#" + seg_data[seg]["first"] + ">",
-            last="<" + segUri + "#" + seg_data[seg]["last"] + ">",
-            # take this segment's map object for notes / measures built up in generate_structural_segmentation
-            # convert it to a list
-            # iterate through it decorating URI's with comma-separated <>
-            # remove the last comma (for valid turtle)
-            notes="".join(["<" + segUri + "#" + n + ">, " for n in seg_data[seg]["notes"]]).rpartition(", ")[0],
-            measures="".join(["<" + segUri + "#" + n + ">, " for n in seg_data[seg]["measures"]]).rpartition(", ")[0],
-            endterm=".",
-            before="",
-            after="",
+        section = seg_data[seg]
+        section_iri = _turtle_iri(segUri + "#" + seg)
+        notes = ", ".join(_turtle_iri(segUri + "#" + n) for n in section["notes"])
+        measures = ", ".join(_turtle_iri(segUri + "#" + m) for m in section["measures"])
+        yield (
+            f"{section_iri} a so:Segment ;\n"
+            f"    so:onSegmentLine {segment_line} ;\n"
+            f'    meld:order "{ix}" ;\n'
+            f"    frbr:embodiment [ a meld:MEIManifestation, rdf:Bag ;\n"
+            f"        rdfs:member {section_iri} ;\n"
+            f"        meld:notes {notes} ;\n"
+            f"        meld:measures {measures} ;\n"
+            f"        meld:startsWith {_turtle_iri(segUri + '#' + section['first'])} ;\n"
+            f"        meld:endsWith {_turtle_iri(segUri + '#' + section['last'])} ] .\n\n"
         )
-    return Graph().parse(data=rdf, format="n3")
+
+
+def segmentation_to_turtle(seg_data, segUri) -> bytes:
+    """The structural segmentation as a Turtle document, without building an rdflib graph"""
+    return "".join(iter_segmentation_turtle(seg_data, segUri)).encode("utf-8")
+
+
+def segmentation_to_graph(seg_data, segUri) -> Graph:
+    """The structural segmentation as an rdflib graph, with the same triples as segmentation_to_turtle"""
+    g = Graph()
+    g.bind("so", SO)
+    g.bind("frbr", FRBR)
+    g.bind("meld", MELD)
+    g.add((URIRef(segUri), RDF.type, SO.SegmentLine))
+    segment_line = URIRef(segUri + "#segmentation")
+    for ix, seg in enumerate(seg_data):
+        section = seg_data[seg]
+        section_ref = URIRef(segUri + "#" + seg)
+        embodiment = BNode()
+        g.add((section_ref, RDF.type, SO.Segment))
+        g.add((section_ref, SO.onSegmentLine, segment_line))
+        g.add((section_ref, MELD.order, Literal(str(ix))))
+        g.add((section_ref, FRBR.embodiment, embodiment))
+        g.add((embodiment, RDF.type, MELD.MEIManifestation))
+        g.add((embodiment, RDF.type, RDF.Bag))
+        g.add((embodiment, RDFS.member, section_ref))
+        for note in section["notes"]:
+            g.add((embodiment, MELD.notes, URIRef(segUri + "#" + note)))
+        for measure in section["measures"]:
+            g.add((embodiment, MELD.measures, URIRef(segUri + "#" + measure)))
+        g.add((embodiment, MELD.startsWith, URIRef(segUri + "#" + section["first"])))
+        g.add((embodiment, MELD.endsWith, URIRef(segUri + "#" + section["last"])))
+    return g
 
 
 if __name__ == "__main__":
@@ -472,13 +537,12 @@ if __name__ == "__main__":
                 "You must provide --segmentlineOutput, --segmentlineUri, and --meiUri when a MEI file is specified"
             )
         seg_data = generate_structural_segmentation(meiFile)
-        g = segmentation_to_graph(seg_data, segUri, meiUri)
         if outputFormat == "ttl" or outputFormat == "both":
-            ttl = graph_to_turtle(g)
-            with open(segmentlineOutput + ".ttl", "w") as ttl_file:
-                ttl_file.write(ttl)
+            with open(segmentlineOutput + ".ttl", "wb") as ttl_file:
+                ttl_file.write(segmentation_to_turtle(seg_data, segUri))
                 print("MEI score segmentation (ttl) written: " + segmentlineOutput + ".ttl")
         if outputFormat == "json" or outputFormat == "jsonld" or outputFormat == "both":
+            g = segmentation_to_graph(seg_data, segUri)
             jsonld = json.dumps(graph_to_jsonld(g, extension), indent=2)
             with open(segmentlineOutput + extension, "w") as json_file:
                 json_file.write(jsonld)
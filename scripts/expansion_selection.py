@@ -0,0 +1,164 @@
+"""Find which expansion of a score a performance followed, by aligning the performance against each of them.
+
+The expansion that the performance matches best is the one whose alignment has the fewest inserted notes
+(notes in the performance that SMAT couldn't match to the score).
+Before aligning, candidates can be ranked by how well their number of notes (and optionally their pitch
+histogram) fits the performance, so that only the most likely few are aligned.
+Alignments run in a thread pool. The expensive part of an alignment is the SMAT tools, which run as
+subprocesses, so this runs them in parallel without needing worker processes (celery's worker processes
+aren't allowed to start child processes).
+"""
+
+import contextvars
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import mido
+
+from trompaalign.mei import count_notes_in_expansions, get_expansions_from_mei
+
+from . import verovio_midi
+from .smat_align import smat_align
+from .trompa_align import generate_maps_result_json
+
+# Value of the `expansion` argument of perform_workflow to select the expansion automatically
+AUTO_EXPANSION = "auto"
+# In automatic mode, the number of best-ranked expansions to align against
+AUTO_EXPANSION_TOP_K = 2
+
+
+@dataclass
+class ExpansionAlignment:
+    """The result of aligning a performance against one expansion of a score"""
+
+    expansion: str | None
+    canonical_midi: str
+    notes_file: str
+    corresp: str | None = None
+    inserted_notes: int | None = None
+    error: Exception | None = None
+
+
+def candidate_expansions(mei_data):
+    """All expansions in the score, or [None] (align against the score without expanding) if it has none"""
+    expansions = get_expansions_from_mei(mei_data)
+    if not expansions:
+        return [None]
+    return [expansion.id for expansion in expansions]
+
+
+def performance_pitches(performance_midi):
+    """The MIDI pitches of all notes played in a performance MIDI file"""
+    midi = mido.MidiFile(performance_midi)
+    return [
+        message.note for track in midi.tracks for message in track if message.type == "note_on" and message.velocity > 0
+    ]
+
+
+def _pitch_class_histogram(pitches):
+    counts = Counter(pitch % 12 for pitch in pitches)
+    total = sum(counts.values()) or 1
+    return [counts[pitch_class] / total for pitch_class in range(12)]
+
+
+def rank_expansions(mei_data, pitches, expansions=None, pitch_histogram=False):
+    """Rank expansions by how well they fit a performance, without aligning.
+
+    The main measure is the relative difference between the number of notes in the performance and in the
+    expansion (from count_notes_in_expansions). If `pitch_histogram` is set, the L1 distance between the
+    pitch class histograms of the performance and the rendered expansion (between 0 and 2) is added to it.
+
+    :param pitches: MIDI pitches of the notes in the performance, see `performance_pitches`
+    :param expansions: expansion ids to rank, by default all expansions in the score
+    :return: list of (expansion, distance), closest first
+    """
+    if expansions is None:
+        expansions = candidate_expansions(mei_data)
+    note_counts = count_notes_in_expansions(mei_data) or {}
+    performance_histogram = _pitch_class_histogram(pitches) if pitch_histogram else None
+
+    ranking = []
+    for expansion in expansions:
+        note_count = note_counts.get(expansion)
+        if note_count is None:
+            # Not an expansion in the score (e.g. None, the unexpanded score), count the rendered notes
+            note_count = len(verovio_midi.render_score(mei_data, expansion).notes)
+        distance = abs(len(pitches) - note_count) / max(note_count, 1)
+        if pitch_histogram:
+            notes = verovio_midi.render_score(mei_data, expansion).notes
+            expansion_histogram = _pitch_class_histogram([note["midiPitch"] for note in notes])
+            distance += sum(abs(a - b) for a, b in zip(performance_histogram, expansion_histogram))
+        ranking.append((expansion, distance))
+    # sorted is stable, so expansions with the same distance stay in score order
+    return sorted(ranking, key=lambda item: item[1])
+
+
+def align_expansion(mei_data, expansion, performance_midi, workdir) -> ExpansionAlignment:
+    """Align a performance against one expansion of a score, and count the inserted notes"""
+    rendering = verovio_midi.render_score(mei_data, expansion)
+    canonical_midi, notes_file = verovio_midi.write_score_rendering(rendering, workdir)
+    result = ExpansionAlignment(expansion=expansion, canonical_midi=canonical_midi, notes_file=notes_file)
+    try:
+        result.corresp = smat_align(canonical_midi, performance_midi)
+        maps_file = os.path.join(workdir, f"maps.{verovio_midi.expansion_file_key(expansion)}.json")
+        result.inserted_notes = generate_maps_result_json(result.corresp, rendering.notes, maps_file)
+    except Exception as e:
+        result.error = e
+    return result
+
+
+def select_best_expansion(
+    mei_data,
+    performance_midi,
+    workdir,
+    expansions=None,
+    top_k=None,
+    pitch_histogram=False,
+    max_workers=None,
+    progress=None,
+):
+    """Align a performance against each candidate expansion in parallel, and choose the one with the fewest
+    inserted notes. If two expansions have the same number, the first one in `expansions` is chosen.
+
+    :param expansions: expansion ids to try, by default all expansions in the score
+    :param top_k: if set, only align against the `top_k` candidates that best fit the performance according to
+       `rank_expansions`
+    :param pitch_histogram: use the pitch histogram when ranking candidates
+    :param max_workers: maximum number of alignments to run at the same time, by default one per CPU
+    :param progress: optional callable, called with "expansion:<id>" as each alignment finishes
+    :return: (the best ExpansionAlignment, list of ExpansionAlignments for all candidates)
+    :raises: the error of the first candidate if no alignment succeeded
+    """
+    progress = progress or (lambda stage: None)
+    if expansions is None:
+        expansions = candidate_expansions(mei_data)
+    if top_k is not None and len(expansions) > top_k:
+        ranking = rank_expansions(mei_data, performance_pitches(performance_midi), expansions, pitch_histogram)
+        print("Expansion ranking:", ", ".join(f"{expansion} ({distance:.3f})" for expansion, distance in ranking))
+        expansions = [expansion for expansion, _ in ranking[:top_k]]
+    max_workers = max_workers or min(len(expansions), os.cpu_count() or 1)
+
+    def run(expansion):
+        result = align_expansion(mei_data, expansion, performance_midi, workdir)
+        progress(f"expansion:{verovio_midi.expansion_file_key(expansion)}")
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Run each alignment in a copy of our context, so that the stage that is being measured (if any)
+        # records the exit codes of their SMAT subprocesses
+        futures = [executor.submit(contextvars.copy_context().run, run, expansion) for expansion in expansions]
+        results = [future.result() for future in futures]
+
+    for result in results:
+        if result.error is not None:
+            print(f"Alignment against expansion {result.expansion} failed: {result.error}")
+        else:
+            print(f"Alignment against expansion {result.expansion}: {result.inserted_notes} inserted notes")
+
+    succeeded = [result for result in results if result.error is None]
+    if not succeeded:
+        raise results[0].error
+    best = min(succeeded, key=lambda result: result.inserted_notes)
+    return best, results
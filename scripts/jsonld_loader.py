@@ -0,0 +1,177 @@
+"""A document loader for pyld that doesn't go to the network for the JSON-LD contexts that we know.
+
+pyld loads every remote @context with its document loader, and its default loader fetches the context with
+requests (with no timeout) each time a document that refers to it is compacted or expanded. This loader
+serves the contexts in BUNDLED_CONTEXTS from the files in jsonld_contexts/ and any context added with
+`register_context`, and keeps other documents that it fetches for CONTEXT_TTL seconds. If a document can't
+be fetched again once it has expired, the expired copy is used. The loader is installed as pyld's default
+document loader when this module is imported.
+
+The bundled contexts are committed to the repository. To refresh them, or to download a context that has
+been added to BUNDLED_CONTEXTS, run
+
+    python -m scripts.jsonld_loader --fetch
+"""
+
+import argparse
+import copy
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from pyld import jsonld
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_DIR = os.path.join(os.path.dirname(__file__), "jsonld_contexts")
+
+# file in CONTEXT_DIR: (URL to download it from, context URLs that it is served for)
+# The files are committed, `--fetch` refreshes them. schemaorg-context.jsonld is schema.org release 12.0.
+BUNDLED_CONTEXTS = {
+    "schemaorg-context.jsonld": (
+        "https://schema.org/docs/jsonldcontext.jsonld",
+        [
+            "http://schema.org",
+            "http://schema.org/",
+            "https://schema.org",
+            "https://schema.org/",
+            "https://schema.org/docs/jsonldcontext.jsonld",
+        ],
+    ),
+}
+
+# Documents that aren't bundled are fetched again after this many seconds
+CONTEXT_TTL = 24 * 60 * 60
+MAX_CACHED_DOCUMENTS = 100
+FETCH_TIMEOUT = 10
+
+_fetch = jsonld.requests_document_loader(timeout=FETCH_TIMEOUT)
+
+_lock = threading.Lock()
+# context URL: parsed document, for bundled and registered contexts
+_static_documents = {}
+_bundled_loaded = False
+# URL: (time it expires, remote document), least recently used first
+_cache = OrderedDict()
+_stats = {"hits": 0, "misses": 0}
+
+
+def _load_bundled_contexts():
+    global _bundled_loaded
+    for filename, (_, urls) in BUNDLED_CONTEXTS.items():
+        path = os.path.join(CONTEXT_DIR, filename)
+        if not os.path.exists(path):
+            continue
+        with open(path) as fp:
+            document = json.load(fp)
+        for url in urls:
+            _static_documents.setdefault(url, document)
+    _bundled_loaded = True
+
+
+def register_context(url, document):
+    """Serve `document` (a parsed JSON-LD document) for `url` without fetching it"""
+    with _lock:
+        _static_documents[url] = document
+
+
+def _static_document(url):
+    with _lock:
+        if not _bundled_loaded:
+            _load_bundled_contexts()
+        return _static_documents.get(url)
+
+
+def load_document(url, options=None):
+    """pyld document loader. Returns a RemoteDocument dict for `url`"""
+    document = _static_document(url)
+    if document is not None:
+        with _lock:
+            _stats["hits"] += 1
+        # The "static" tag lets pyld keep the processed context between calls to compact/expand
+        return {
+            "contentType": "application/ld+json",
+            "contextUrl": None,
+            "documentUrl": url,
+            "document": copy.deepcopy(document),
+            "tag": "static",
+        }
+
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(url)
+        if entry is not None:
+            _cache.move_to_end(url)
+            if entry[0] > now:
+                _stats["hits"] += 1
+                return copy.deepcopy(entry[1])
+        _stats["misses"] += 1
+
+    try:
+        remote_document = _fetch(url, options or {})
+    except Exception as e:
+        if entry is None:
+            raise
+        logger.warning("Failed to fetch JSON-LD document %s, using the expired copy: %s", url, e)
+        return copy.deepcopy(entry[1])
+
+    with _lock:
+        _cache[url] = (now + CONTEXT_TTL, remote_document)
+        _cache.move_to_end(url)
+        while len(_cache) > MAX_CACHED_DOCUMENTS:
+            _cache.popitem(last=False)
+    return copy.deepcopy(remote_document)
+
+
+def clear_cache():
+    """Forget the documents that were fetched and the contexts that were registered"""
+    global _bundled_loaded
+    with _lock:
+        _cache.clear()
+        _static_documents.clear()
+        _bundled_loaded = False
+    # pyld keeps the contexts that it processed from static documents. This is a private attribute of pyld,
+    # so only clear it if it's there
+    resolved_context_cache = getattr(jsonld, "_resolved_context_cache", None)
+    if resolved_context_cache is not None:
+        resolved_context_cache.clear()
+
+
+def cache_stats():
+    with _lock:
+        return {**_stats, "size": len(_cache)}
+
+
+jsonld.set_document_loader(load_document)
+
+
+def fetch_bundled_contexts():
+    os.makedirs(CONTEXT_DIR, exist_ok=True)
+    for filename, (source, _) in BUNDLED_CONTEXTS.items():
+        print(f"Downloading {source}")
+        r = requests.get(source, headers={"Accept": "application/ld+json, application/json"}, timeout=FETCH_TIMEOUT)
+        r.raise_for_status()
+        with open(os.path.join(CONTEXT_DIR, filename), "w") as fp:
+            json.dump(r.json(), fp, indent=2)
+            fp.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the JSON-LD contexts that are bundled with the app")
+    parser.add_argument("--fetch", action="store_true", help=f"Download the bundled contexts to {CONTEXT_DIR}")
+    args = parser.parse_args()
+
+    if args.fetch:
+        fetch_bundled_contexts()
+    else:
+        for filename, (source, urls) in BUNDLED_CONTEXTS.items():
+            status = "bundled" if os.path.exists(os.path.join(CONTEXT_DIR, filename)) else "missing"
+            print(f"{filename} ({status}): {', '.join(urls)}")
+
+
+if __name__ == "__main__":
+    main()
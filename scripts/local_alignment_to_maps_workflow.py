@@ -1,4 +1,6 @@
 import argparse
+import glob
+import json
 import logging
 import os
 import pathlib
@@ -6,79 +8,176 @@ import requests
 import subprocess
 import sys
 import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 
 from mei_to_midi import mei_to_midi
 from smat_align import smat_align
 from write_expanded_mei_data import write_expanded_mei_data
 
+MANIFEST_NAME = "manifest.jsonl"
 
-def batch_process(midi_files, mei_uri, expansions, outdir, tempdir):
+
+def output_prefix(midi, performancedir, outdir):
+    """The path of the output files of a performance, without their suffix. A performance in a subdirectory of
+    performancedir gets its output in the same subdirectory of outdir, so that performances with the same
+    file name in different directories don't overwrite each other's output"""
+    relative = pathlib.Path(midi).relative_to(performancedir)
+    return pathlib.Path(outdir, relative)
+
+
+def maps_file_for(midi, expansion, performancedir, outdir):
+    return str(output_prefix(midi, performancedir, outdir)) + ".maps." + expansion + ".json"
+
+
+def has_maps_output(midi, performancedir, outdir):
+    prefix = output_prefix(midi, performancedir, outdir)
+    return any(prefix.parent.glob(glob.escape(prefix.name) + ".maps.*.json"))
+
+
+def prepare_expansions(mei_uri, mei_data, expansions, outdir, tempdir):
+    """Write the expanded MEI and canonical MIDI of each expansion once, before the performances are processed
+    in parallel. Returns {expansion: canonical MIDI path}"""
+    canonical_files = {}
+    for expansion in expansions:
+        mei_file = pathlib.Path(outdir, pathlib.Path(mei_uri).stem + "." + expansion + ".mei")
+        canonical = pathlib.Path(tempdir, expansion + ".canonical.mid")
+        if not mei_file.is_file():
+            logging.debug("  writing expanded mei data for " + expansion)
+            write_expanded_mei_data(mei_data, str(mei_file), expansion)
+        if not canonical.is_file():
+            logging.debug("  generating canonical MIDI for " + expansion)
+            mei_to_midi(mei_data, str(canonical), expansion)
+        canonical_files[expansion] = str(canonical)
+    return canonical_files
+
+
+def batch_process(midi_files, performancedir, mei_uri, expansions, outdir, tempdir, jobs=1, resume=True):
     # fetch MEI
     resp = requests.get(mei_uri)
     mei_data = resp.text
-    [
-        process(performance_midi_file, mei_uri, expansions, outdir, tempdir, mei_data)
-        for performance_midi_file in midi_files
-    ]
 
+    start = time.perf_counter()
+    canonical_files = prepare_expansions(mei_uri, mei_data, expansions, outdir, tempdir)
+    prepare_time = time.perf_counter() - start
 
-def process(midi, mei_uri, expansions, outdir, tempdir, mei_data):
-    logging.basicConfig(
-        filename="log-" + datetime.now().isoformat() + ".log",
-        encoding="utf-8",
-        level=logging.DEBUG,
-        format="%(asctime)s %(message)s",
-        datefmt="%m/%d/%Y %I:%M:%S %p",
-    )
-    corresp_file = os.path.join(tempdir, midi.name) + ".corresp"
+    if resume:
+        skipped = [midi for midi in midi_files if has_maps_output(midi, performancedir, outdir)]
+        midi_files = [midi for midi in midi_files if not has_maps_output(midi, performancedir, outdir)]
+        print(f"Skipping {len(skipped)} files which already have maps output")
+
+    results = []
+    with open(os.path.join(outdir, MANIFEST_NAME), "a") as manifest:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(process, midi, performancedir, mei_uri, expansions, outdir, tempdir, canonical_files)
+                for midi in midi_files
+            ]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                manifest.write(json.dumps(result) + "\n")
+                manifest.flush()
+                print(f"[{len(results)}/{len(midi_files)}] {result['file']}: {result['status']}")
+
+    print_summary(results, expansions, prepare_time)
+    return results
+
+
+def process(midi, performancedir, mei_uri, expansions, outdir, tempdir, canonical_files):
+    """Align one performance against each expansion, keeping the maps file of the expansion with the fewest
+    inserted notes. Returns a manifest entry for the file."""
+    result = {
+        "file": str(midi),
+        "time": datetime.now().isoformat(),
+        "status": "ok",
+        "best_expansion": None,
+        "inserted_notes": {},
+        "timings": {},
+        "errors": {},
+    }
+    # Files with the same name can be in different directories, so each file gets its own working directory
+    file_tempdir = tempfile.mkdtemp(dir=tempdir)
+    corresp_file = os.path.join(file_tempdir, midi.name) + ".corresp"
+    output_prefix(midi, performancedir, outdir).parent.mkdir(parents=True, exist_ok=True)
     fewest_inserted_notes = None
     best_expansion = None
-    logging.debug("Processing: " + midi.name)
+    logging.debug("Processing: " + str(midi))
     for expansion in expansions:
         logging.debug("- Expansion: " + expansion)
+        timings = result["timings"].setdefault(expansion, {})
         try:
-            mei_file = pathlib.Path(outdir, pathlib.Path(mei_uri).stem + "." + expansion + ".mei")
-            canonical = pathlib.Path(tempdir, expansion + ".canonical.mid")
-            if not mei_file.is_file():
-                logging.debug("  writing expanded mei data")
-                write_expanded_mei_data(mei_data, str(mei_file), expansion)
-            if not canonical.is_file():
-                logging.debug("  generating canonical MIDI")
-                mei_to_midi(mei_data, str(canonical), expansion)
             logging.debug("  performing SMAT alignment")
-            corresp = smat_align(str(canonical), midi)
+            start = time.perf_counter()
+            corresp = smat_align(canonical_files[expansion], str(midi))
+            timings["smat"] = time.perf_counter() - start
             with open(corresp_file, "w") as out:
                 out.write(corresp)
                 logging.debug("  produced corresp file: " + corresp_file)
-            maps_file = os.path.join(outdir, midi.name + ".maps." + expansion + ".json")
+            maps_file = maps_file_for(midi, expansion, performancedir, outdir)
             logging.debug("  performing MEI reconciliation")
+            start = time.perf_counter()
             inserted_notes_output = subprocess.check_output(
                 [
                     "Rscript",
-                    os.path.join(sys.path[0], "trompa-align-local.R"),
+                    os.path.join(os.path.dirname(os.path.abspath(__file__)), "trompa-align-local.R"),
                     corresp_file,
                     maps_file,
                     mei_uri,
                     expansion or "",
                 ]
             )
+            timings["reconcile"] = time.perf_counter() - start
             split = inserted_notes_output.split()[1]
             num_inserted_notes = int(split)
+            result["inserted_notes"][expansion] = num_inserted_notes
             logging.debug("  COMPLETED RUN: " + str(num_inserted_notes))
             if fewest_inserted_notes is None or num_inserted_notes < fewest_inserted_notes:
+                if best_expansion is not None:
+                    # the previous best is no longer the best, so throw away its maps file
+                    pathlib.Path(maps_file_for(midi, best_expansion, performancedir, outdir)).unlink(missing_ok=True)
+                    logging.debug("  throwing out unused expansion: " + best_expansion)
                 fewest_inserted_notes = num_inserted_notes
                 best_expansion = expansion
                 logging.debug("  current best: " + str(best_expansion) + " " + str(fewest_inserted_notes))
             else:
                 # not the best expansion, so throw away the maps file
-                pathlib.Path(maps_file).unlink()
+                pathlib.Path(maps_file).unlink(missing_ok=True)
                 logging.debug("  throwing out unused expansion: " + expansion)
 
         except Exception as e:
-            logging.error("!!!!! Could not process " + midi.name + " -- skipping")
-            logging.error("!!!!! Exception was: " + e)
-            break
+            # Try the remaining expansions, one of them may still work
+            logging.error("!!!!! Could not process " + midi.name + " with expansion " + expansion)
+            logging.error("!!!!! Exception was: " + str(e))
+            result["errors"][expansion] = str(e)
+
+    result["best_expansion"] = best_expansion
+    if best_expansion is None:
+        result["status"] = "failed"
+    return result
+
+
+def print_summary(results, expansions, prepare_time):
+    """Print a table of the number of inserted notes per expansion, and mean stage timings"""
+    print()
+    print(f"Prepared expansions in {prepare_time:.2f}s")
+    name_width = max([len(pathlib.Path(r["file"]).name) for r in results] + [4])
+    print("file".ljust(name_width), *[e.rjust(20) for e in expansions], "best".rjust(20))
+    for result in sorted(results, key=lambda r: r["file"]):
+        counts = [str(result["inserted_notes"].get(e, "error" if e in result["errors"] else "-")) for e in expansions]
+        print(
+            pathlib.Path(result["file"]).name.ljust(name_width),
+            *[c.rjust(20) for c in counts],
+            str(result["best_expansion"]).rjust(20),
+        )
+
+    for stage in ["smat", "reconcile"]:
+        times = [t[stage] for r in results for t in r["timings"].values() if stage in t]
+        if times:
+            print(f"{stage}: {len(times)} runs, mean {sum(times) / len(times):.2f}s, total {sum(times):.2f}s")
+    failed = [r for r in results if r["status"] != "ok"]
+    print(f"{len(results) - len(failed)} files aligned, {len(failed)} failed")
 
 
 if __name__ == "__main__":
@@ -101,7 +200,21 @@ if __name__ == "__main__":
         dest="standard_expansions",
         action="store_true",
     )
+    parser.add_argument("-j", "--jobs", help="Number of files to process in parallel", type=int, default=1)
+    parser.add_argument(
+        "--no-resume",
+        help="Process all files, including those which already have a maps output",
+        dest="resume",
+        action="store_false",
+    )
     args = parser.parse_args()
+    logging.basicConfig(
+        filename="log-" + datetime.now().isoformat() + ".log",
+        encoding="utf-8",
+        level=logging.DEBUG,
+        format="%(asctime)s %(process)d %(message)s",
+        datefmt="%m/%d/%Y %I:%M:%S %p",
+    )
     tempdir = tempfile.mkdtemp()
     print("Tempdir: ", tempdir)
     if args.standard_expansions:
@@ -112,4 +225,15 @@ if __name__ == "__main__":
         expansions = ["expansion-default"]
     midi_files = [path for path in pathlib.Path(args.performancedir).rglob("*.mid")]
     print("About to start processing with expansions: ", expansions)
-    batch_process(midi_files, args.meiuri, expansions, args.outputdir, tempdir)
+    results = batch_process(
+        midi_files,
+        args.performancedir,
+        args.meiuri,
+        expansions,
+        args.outputdir,
+        tempdir,
+        jobs=args.jobs,
+        resume=args.resume,
+    )
+    if any(result["status"] != "ok" for result in results):
+        sys.exit(1)
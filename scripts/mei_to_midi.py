@@ -4,17 +4,16 @@ import argparse
 import requests
 import sys
 
-import verovio
-
-verovio.enableLog(False)
+try:
+    from .verovio_pool import toolkit_pool
+except ImportError:
+    # Run as a script from the scripts directory
+    from verovio_pool import toolkit_pool
 
 
 def mei_to_midi(mei, fname, expansion=None):
-    vrv = verovio.toolkit()
-    if bool(expansion):
-        vrv.setOption("expand", expansion)
-    vrv.loadData(mei)
-    vrv.renderToMIDIFile(fname)
+    with toolkit_pool.toolkit(mei, expansion) as vrv:
+        vrv.renderToMIDIFile(fname)
 
 
 if __name__ == "__main__":
@@ -1,13 +1,32 @@
 #!/usr/bin/python
 
 import argparse
+import io
 import json
+import logging
+import re
+from itertools import islice
 
 from mido import Message, MidiFile, MidiTrack, second2tick, bpm2tempo
 
+logger = logging.getLogger(__name__)
+
 ticks_per_beat = 5000
 tempo = bpm2tempo(120)
 
+# Number of events that webmidi_to_midi decodes at a time
+EVENT_BATCH_SIZE = 4096
+# Characters read at a time when parsing a webmidi file as a stream
+READ_SIZE = 64 * 1024
+
+# The message types that are written to the midi file, by the high bits of the status byte
+NOTE_OFF = 0b000
+NOTE_ON = 0b001
+CONTROL_CHANGE = 0b011
+
+_WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+_ITEM_END_CHARS = {" ", "\t", "\n", "\r", ",", "]"}
+
 
 def midi_json_to_midi(midi_notes):
     midiFile = MidiFile()
@@ -66,15 +85,121 @@ def midi_json_to_midi(midi_notes):
     return midiFile
 
 
+def iter_json_array(fp, read_size=READ_SIZE):
+    """Parse the items of a JSON array in a file (text or binary) one at a time, without reading the whole file"""
+    if not isinstance(fp, io.TextIOBase):
+        fp = io.TextIOWrapper(fp, encoding="utf-8")
+    decoder = json.JSONDecoder()
+    buffer = fp.read(read_size)
+    pos = 0
+    eof = not buffer
+
+    def next_char():
+        """Skip whitespace, reading more of the file if needed. Returns the next character or "" at the end"""
+        nonlocal buffer, pos, eof
+        while True:
+            pos = _WHITESPACE_RE.match(buffer, pos).end()
+            if pos < len(buffer) or eof:
+                return buffer[pos : pos + 1]
+            read_more()
+
+    def read_more():
+        nonlocal buffer, pos, eof
+        data = fp.read(read_size)
+        eof = not data
+        buffer = buffer[pos:] + data
+        pos = 0
+
+    if next_char() != "[":
+        raise ValueError("Expected a JSON array")
+    pos += 1
+    if next_char() == "]":
+        return
+    while True:
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            read_more()
+            continue
+        if not eof and buffer[end : end + 1] not in _ITEM_END_CHARS:
+            # A number at the end of the buffer (or a prefix of one, like "2." of "2.5") might continue in the next read
+            read_more()
+            continue
+        pos = end
+        yield item
+
+        char = next_char()
+        if char == "]":
+            return
+        if char != ",":
+            raise ValueError(f"Expected , or ] after item of JSON array, got {char!r}")
+        pos += 1
+        next_char()
+
+
+def webmidi_to_midi(events, batch_size=EVENT_BATCH_SIZE):
+    """Convert webmidi events to a midi file, like midi_json_to_midi but without printing every event.
+
+    :param events: a list of webmidi events, or a file object with a JSON array of them, which is parsed
+       incrementally
+    """
+    if hasattr(events, "read"):
+        events = iter_json_array(events)
+
+    midiFile = MidiFile()
+    midiFile.ticks_per_beat = ticks_per_beat
+
+    track = MidiTrack()
+    midiFile.tracks.append(track)
+
+    prev_time = None
+    skipped = 0
+    events = iter(events)
+    while batch := list(islice(events, batch_size)):
+        timestamps = [event["timestamp"] for event in batch]
+        data = [event["data"]["_data"] for event in batch]
+        codes = [(d["0"] >> 4) & 0b111 for d in data]
+        keys = [d["1"] for d in data]
+        velocities = [d["2"] & 0b1111111 for d in data]
+        del batch, data
+        if prev_time is None:
+            prev_time = timestamps[0]
+
+        for timestamp, code, key, velocity in zip(timestamps, codes, keys, velocities):
+            if code not in (NOTE_OFF, NOTE_ON, CONTROL_CHANGE):
+                continue
+            time = round(second2tick((timestamp - prev_time) / 1000, ticks_per_beat=ticks_per_beat, tempo=tempo))
+            try:
+                if code == CONTROL_CHANGE:
+                    message = Message("control_change", channel=0, control=key, value=velocity, time=time)
+                else:
+                    message_type = "note_on" if code == NOTE_ON else "note_off"
+                    message = Message(message_type, channel=0, note=key, velocity=velocity, time=time)
+            except ValueError as e:
+                logger.debug("Skipping webmidi event at %s: %s", timestamp, e)
+                skipped += 1
+                continue
+            track.append(message)
+            prev_time = timestamp
+
+    if skipped:
+        logger.warning("Skipped %d webmidi events with invalid values", skipped)
+    return midiFile
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("midiJson", help="JSON file containing MIDI event data received from client")
     parser.add_argument("output", help="Name of output MIDI file to generate")
+    parser.add_argument("--verbose", action="store_true", help="Print each MIDI event as it is converted")
     args = parser.parse_args()
     output = args.output
 
-    with open(args.midiJson, "r") as fp:
-        midi_notes = json.load(fp)
-
-    midi = midi_json_to_midi(midi_notes)
+    with open(args.midiJson, "rb") as fp:
+        if args.verbose:
+            midi = midi_json_to_midi(json.load(fp))
+        else:
+            midi = webmidi_to_midi(fp)
     midi.save(args.output)
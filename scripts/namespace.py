@@ -4,3 +4,6 @@ MO = Namespace("http://purl.org/ontology/mo/")
 MELD = Namespace("https://meld.linkedmusic.org/terms/")
 TL = Namespace("http://purl.org/NET/c4dm/timeline.owl#")
 LDP = Namespace("http://www.w3.org/ns/ldp#")
+SO = Namespace("http://www.linkedmusic.org/ontologies/segment/")
+FRBR = Namespace("http://purl.org/vocab/frbr/core#")
+MAPS = Namespace("https://terms.trompamusic.eu/maps#")
@@ -2,13 +2,17 @@ import json
 import os
 import subprocess
 
+import mido
 import requests
 
 from . import verovio_midi
-from .convert_to_rdf import maps_result_to_graph, performance_to_graph
-from .mei_to_midi import mei_to_midi
+from .convert_to_rdf import generate_structural_segmentation, maps_result_to_graph, performance_to_graph
+from .expansion_selection import AUTO_EXPANSION, AUTO_EXPANSION_TOP_K, select_best_expansion
 from .midi_to_mp3 import midi_to_mp3
 from .smat_align import smat_align
+from .stage_timing import StageRecorder, record_subprocess
+from .timeline_chunks import TIMELINE_CHUNK_MIN_LENGTH, chunk_timeline
+from .timeline_columns import maps_result_to_columns
 from .trompa_align import generate_maps_result_json
 
 
@@ -62,12 +66,15 @@ def perform_workflow(
     perf_fname,
     audio_fname,
     label,
+    progress=None,
+    recorder=None,
 ):
     """Do an alignment of a performance vs the score
 
     :param performance_midi: path to midi file of the performance
     :param mei_file: path to mei file
-    :param expansion: which expansion to perform (None for all, or a specific number)
+    :param expansion: id of the expansion to render the score with, None to render it without expanding,
+       or AUTO_EXPANSION to align against every expansion in the score and use the best one
     :param mei_uri: url of the external MEI file which is being performed
     :param score_uri: URL of the score URL describing the score
     :param performance_container: Location of a container in user's solid pod, where data for this performance will be
@@ -76,50 +83,79 @@ def perform_workflow(
     :param tempdir: temporary working directory to put files
     :param perf_fname: basename of the resource in performance_container
     :param audio_fname: basename of the resource in audio_container
-    :return:
+    :param progress: optional callable, called with the name of each stage as it starts
+    :param recorder: optional StageRecorder to measure the time and resources used by each stage
+    :return: the performance graph, the timeline graph, the TimelineColumns of the timeline and, if the timeline
+       is long enough to be split into chunks, the TimelineChunkIndex and the graph of each chunk (otherwise None)
     """
+    progress = progress or (lambda stage: None)
+    recorder = recorder or StageRecorder()
     if mei_file is not None:
         with open(mei_file, "r") as f:
             mei_data = f.read()
     else:
-        resp = requests.get(mei_uri)
-        mei_data = resp.text
+        with recorder.stage("download_mei"):
+            resp = requests.get(mei_uri)
+            mei_data = resp.text
         with open(os.path.join(tempdir, "score.mei"), "w") as out:
             out.write(mei_data)
         mei_file = os.path.join(tempdir, "score.mei")
-    print("** Performing MEI_TO_MIDI")
-    mei_to_midi(mei_data, os.path.join(tempdir, "canonical.mid"), expansion)
-
-    print("** Performing SMAT_ALIGN")
-    print("performance_midi: ", performance_midi)
-    corresp = smat_align(os.path.join(tempdir, "canonical.mid"), performance_midi)
+    performance_events = sum(len(track) for track in mido.MidiFile(performance_midi).tracks)
+    if expansion == AUTO_EXPANSION:
+        print("** Performing EXPANSION SELECTION")
+        progress("expansion_selection")
+        with recorder.stage("expansion_selection", mei_bytes=len(mei_data), midi_events=performance_events) as span:
+            best, candidates = select_best_expansion(
+                mei_data, performance_midi, tempdir, top_k=AUTO_EXPANSION_TOP_K, progress=progress
+            )
+            span.attributes["candidates"] = len(candidates)
+        expansion = best.expansion
+        print(f"** Selected expansion {expansion} with {best.inserted_notes} inserted notes")
+        allNotes = verovio_midi.render_score(mei_data, expansion).notes
+        verovio_json_notes = best.notes_file
+        corresp = best.corresp
+    else:
+        print("** Performing MEI_TO_MIDI")
+        progress("mei_to_midi")
+        with recorder.stage("mei_to_midi", mei_bytes=len(mei_data)) as span:
+            # The canonical MIDI and the note table come from the same rendering of the score, for the same
+            # expansion
+            rendering = verovio_midi.render_score(mei_data, expansion)
+            allNotes = rendering.notes
+            canonical_midi, verovio_json_notes = verovio_midi.write_score_rendering(rendering, tempdir)
+            span.attributes["notes"] = len(allNotes)
+
+        print("** Performing SMAT_ALIGN")
+        print("performance_midi: ", performance_midi)
+        with recorder.stage("smat_align", notes=len(allNotes), midi_events=performance_events):
+            corresp = smat_align(canonical_midi, performance_midi, progress=progress)
 
     # Save corresp to file for R version
     with open(os.path.join(tempdir, "corresp.txt"), "w") as out:
         out.write(corresp)
 
-    allNotes = verovio_midi.generate_notes_from_mei(mei_file, None)
-    verovio_json_notes = os.path.join(tempdir, "verovio_note_positions.json")
-    with open(verovio_json_notes, "w") as fp:
-        json.dump(allNotes, fp)
-
     print("** Performing RECONCILIATION")
-
-    # Run R version
-    r_output = os.path.join(tempdir, "maps_r.json")
-    subprocess.run(
-        [
-            "Rscript",
-            os.path.join(os.path.dirname(__file__), "trompa-align.R"),
-            os.path.join(tempdir, "corresp.txt"),
-            r_output,
-            verovio_json_notes,
-        ]
-    )
-
-    # Run Python version
-    py_output = os.path.join(tempdir, "maps_py.json")
-    generate_maps_result_json(corresp, allNotes, py_output)
+    progress("reconcile")
+
+    corresp_rows = corresp.count("\n")
+    with recorder.stage("reconcile_r", notes=len(allNotes), corresp_rows=corresp_rows):
+        # Run R version
+        r_output = os.path.join(tempdir, "maps_r.json")
+        result = subprocess.run(
+            [
+                "Rscript",
+                os.path.join(os.path.dirname(__file__), "trompa-align.R"),
+                os.path.join(tempdir, "corresp.txt"),
+                r_output,
+                verovio_json_notes,
+            ]
+        )
+        record_subprocess("Rscript", result.returncode)
+
+    with recorder.stage("reconcile", notes=len(allNotes), corresp_rows=corresp_rows) as span:
+        # Run Python version
+        py_output = os.path.join(tempdir, "maps_py.json")
+        span.attributes["inserted_notes"] = generate_maps_result_json(corresp, allNotes, py_output)
 
     # Validate outputs
     validate_alignment_outputs(r_output, py_output)
@@ -128,13 +164,16 @@ def perform_workflow(
     os.rename(r_output, os.path.join(tempdir, "maps.json"))
 
     print("** Performing AUDIO SYNTHESIS")
-    midi_to_mp3(performance_midi, os.path.join(tempdir, audio_fname), tempdir)
+    progress("synth")
+    with recorder.stage("synth", midi_events=performance_events):
+        midi_to_mp3(performance_midi, os.path.join(tempdir, audio_fname), tempdir)
     print(
         "** Success: Created synthesised audio output: ",
         os.path.join(tempdir, audio_fname),
     )
 
     print("** Performing RDF CONVERSION")
+    progress("rdf")
     with open(os.path.join(tempdir, "maps.json"), "rb") as f:
         maps_json = f.read()
 
@@ -142,10 +181,17 @@ def perform_workflow(
     performance_uri = os.path.join(performance_container, perf_fname)
     timeline_uri = os.path.join(timeline_container, perf_fname)
 
-    timeline_graph = maps_result_to_graph(
-        maps_json, mei_uri, timeline_uri, score_uri, audio_uri, includePerformance=False, label=label
-    )
-
-    performance_graph = performance_to_graph(performance_uri, timeline_uri, score_uri, audio_uri, label)
+    with recorder.stage("rdf", maps_bytes=len(maps_json)) as span:
+        timeline_graph = maps_result_to_graph(
+            maps_json, mei_uri, timeline_uri, score_uri, audio_uri, includePerformance=False, label=label
+        )
+        timeline_columns = maps_result_to_columns(maps_json, mei_uri, timeline_uri)
+        timeline_chunks = None
+        if timeline_columns.onsets and timeline_columns.onsets[-1] >= TIMELINE_CHUNK_MIN_LENGTH:
+            seg_data = generate_structural_segmentation(mei_file)
+            timeline_chunks = chunk_timeline(maps_json, seg_data, mei_uri, timeline_uri, label)
+            span.attributes["chunks"] = len(timeline_chunks[0].chunks)
+        performance_graph = performance_to_graph(performance_uri, timeline_uri, score_uri, audio_uri, label)
+        span.attributes["triples"] = len(timeline_graph)
     print("** Success: Created timeline output: ", perf_fname)
-    return performance_graph, timeline_graph
+    return performance_graph, timeline_graph, timeline_columns, timeline_chunks
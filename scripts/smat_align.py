@@ -5,61 +5,151 @@ import shutil
 import subprocess
 import sys
 import tempfile
+import time
 import uuid
 
+import mido
+
+try:
+    from .stage_timing import record_subprocess
+except ImportError:
+    from stage_timing import record_subprocess
+
+# Each SMAT tool is killed if it runs for longer than
+#   (SMAT_TIMEOUT_BASE + SMAT_TIMEOUT_PER_NOTE * notes in both files) * SMAT_TIMEOUT_FACTORS.get(tool, 1)
+# seconds, so that a pathological performance can't hang a worker. The HMM tools are the slowest.
+SMAT_TIMEOUT_BASE = 30
+SMAT_TIMEOUT_PER_NOTE = 0.02
+SMAT_TIMEOUT_FACTORS = {"ScorePerfmMatcher": 4, "ErrorDetection": 2, "RealignmentMOHMM": 4}
+# Maximum address space of each tool, in bytes
+SMAT_MEMORY_LIMIT = 4 * 1024 * 1024 * 1024
+# Number of lines at the end of a tool's stderr to include in the error message when it fails
+STDERR_TAIL_LINES = 20
+
 
 class SmatException(Exception):
     """Raised when a SMAT alignment step fails."""
 
-    def __init__(self, stage: str, message: str) -> None:
+    def __init__(self, stage: str, message: str, stderr: str | None = None, returncode: int | None = None) -> None:
         super().__init__(message)
         self.stage = stage
+        self.stderr = stderr
+        self.returncode = returncode
+
+
+def count_midi_notes(midi_file):
+    midi = mido.MidiFile(midi_file)
+    return sum(1 for track in midi.tracks for message in track if message.type == "note_on" and message.velocity > 0)
+
+
+def smat_timeout(tool, notes):
+    return (SMAT_TIMEOUT_BASE + SMAT_TIMEOUT_PER_NOTE * notes) * SMAT_TIMEOUT_FACTORS.get(tool, 1)
+
+
+def _stderr_tail(stderr):
+    lines = stderr.strip().splitlines()[-STDERR_TAIL_LINES:]
+    return "\n".join(lines)
 
 
-def smat_align(file1, file2):
+def run_smat_tool(args, cwd, timeout):
+    """Run a SMAT tool with a timeout and CPU and memory limits.
+
+    The limits are set with the shell's ulimit rather than a preexec_fn, which isn't safe to use when
+    alignments run in threads (see expansion_selection).
+    We don't know that every SMAT tool exits with 0 when it succeeds, so a tool that exits with another code
+    isn't an error by itself, the caller checks that it wrote its output (see _check_output).
+    :raises: SmatException if the tool times out or is killed by a signal
+    """
+    tool = args[0]
+    cpu_limit = int(timeout) + 1
+    memory_limit_kb = SMAT_MEMORY_LIMIT // 1024
+    command = ["sh", "-c", f'ulimit -t {cpu_limit} && ulimit -v {memory_limit_kb} && exec "$0" "$@"', *args]
+    start = time.perf_counter()
+    try:
+        result = subprocess.run(command, cwd=cwd, capture_output=True, text=True, errors="replace", timeout=timeout)
+    except subprocess.TimeoutExpired as e:
+        stderr = e.stderr.decode("utf-8", errors="replace") if isinstance(e.stderr, bytes) else (e.stderr or "")
+        record_subprocess(tool, None, time.perf_counter() - start)
+        raise SmatException(tool, f"{tool} timed out after {timeout:.0f}s", stderr=stderr) from e
+    record_subprocess(tool, result.returncode, time.perf_counter() - start)
+    if result.returncode < 0:
+        # A negative return code is the signal that killed the tool, e.g. SIGXCPU or SIGKILL for the CPU limit,
+        # or SIGSEGV/SIGABRT when it couldn't allocate memory
+        raise SmatException(tool, _failure_message(tool, result), stderr=result.stderr, returncode=result.returncode)
+    if result.returncode != 0:
+        print(f"{tool} exited with code {result.returncode}, checking its output")
+    return result
+
+
+def _failure_message(tool, result):
+    if result.returncode < 0:
+        message = f"{tool} was killed by signal {-result.returncode}"
+    else:
+        message = f"{tool} exited with code {result.returncode}"
+    tail = _stderr_tail(result.stderr)
+    if tail:
+        message += f":\n{tail}"
+    return message
+
+
+def _check_output(tempdir, filename, stage, description, result=None):
+    """Raise a SmatException if a tool didn't write its output file. The tools can exit successfully without
+    writing their output, e.g. if an input file is empty. `result` is the tool's CompletedProcess"""
+    if os.path.exists(os.path.join(tempdir, filename)):
+        return
+    message = f"{description}, {filename}, doesn't exist"
+    if result is not None and result.returncode != 0:
+        message += f" ({_failure_message(stage, result)})"
+        raise SmatException(stage, message, stderr=result.stderr, returncode=result.returncode)
+    raise SmatException(stage, message)
+
+
+def smat_align(file1, file2, progress=None):
     # Align 2 midi files. This is a python port of MIDIToMIDIAlign.sh from SMAT
     # It assumes that the compiled tools are in $PATH
     # Because we use a temporary directory, we don't bother to clean up anything
+    # If set, progress is called with the name of each stage (smat:<tool>) before it runs
+    progress = progress or (lambda stage: None)
+    notes = count_midi_notes(file1) + count_midi_notes(file2)
     with tempfile.TemporaryDirectory() as tempdir:
         shutil.copy(file1, tempdir)
         shutil.copy(file2, tempdir)
         file1_stem = os.path.splitext(os.path.basename(file1))[0]
         file2_stem = os.path.splitext(os.path.basename(file2))[0]
 
+        def run(args):
+            return run_smat_tool(args, tempdir, smat_timeout(args[0], notes))
+
         # Generate pianoroll. Assumes that files are in tempdir. Argument doesn't include
         # extension. Output filename is {stem}_spr.txt
-        subprocess.run(["midi2pianoroll", "0", file1_stem], cwd=tempdir)
-        subprocess.run(["midi2pianoroll", "0", file2_stem], cwd=tempdir)
-
-        if not os.path.exists(os.path.join(tempdir, f"{file1_stem}_spr.txt")):
-            raise SmatException("midi2pianoroll", f"spr of first file, {file1_stem}_spr.txt, doesn't exist")
-        if not os.path.exists(os.path.join(tempdir, f"{file2_stem}_spr.txt")):
-            raise SmatException("midi2pianoroll", f"spr of second file, {file2_stem}_spr.txt, doesn't exist")
-
-        subprocess.run(["SprToFmt3x", f"{file1_stem}_spr.txt", f"{file1_stem}_fmt3x.txt"], cwd=tempdir)
-        if not os.path.exists(os.path.join(tempdir, f"{file1_stem}_fmt3x.txt")):
-            raise SmatException("SprToFmt3x", f"fmt3x of first file, {file1_stem}_fmt3x.txt, doesn't exist")
-
-        subprocess.run(["Fmt3xToHmm", f"{file1_stem}_fmt3x.txt", f"{file1_stem}_hmm.txt"], cwd=tempdir)
-        if not os.path.exists(os.path.join(tempdir, f"{file1_stem}_hmm.txt")):
-            raise SmatException("Fmt3xToHmm", f"hmm of first file, {file1_stem}_hmm.txt, doesn't exist")
-
-        subprocess.run(
+        progress("smat:midi2pianoroll")
+        result1 = run(["midi2pianoroll", "0", file1_stem])
+        result2 = run(["midi2pianoroll", "0", file2_stem])
+        _check_output(tempdir, f"{file1_stem}_spr.txt", "midi2pianoroll", "spr of first file", result1)
+        _check_output(tempdir, f"{file2_stem}_spr.txt", "midi2pianoroll", "spr of second file", result2)
+
+        progress("smat:SprToFmt3x")
+        result = run(["SprToFmt3x", f"{file1_stem}_spr.txt", f"{file1_stem}_fmt3x.txt"])
+        _check_output(tempdir, f"{file1_stem}_fmt3x.txt", "SprToFmt3x", "fmt3x of first file", result)
+
+        progress("smat:Fmt3xToHmm")
+        result = run(["Fmt3xToHmm", f"{file1_stem}_fmt3x.txt", f"{file1_stem}_hmm.txt"])
+        _check_output(tempdir, f"{file1_stem}_hmm.txt", "Fmt3xToHmm", "hmm of first file", result)
+
+        progress("smat:ScorePerfmMatcher")
+        result = run(
             [
                 "ScorePerfmMatcher",
                 f"{file1_stem}_hmm.txt",
                 f"{file2_stem}_spr.txt",
                 f"{file2_stem}_pre_match.txt",
                 "0.001",
-            ],
-            cwd=tempdir,
+            ]
         )
-        if not os.path.exists(os.path.join(tempdir, f"{file2_stem}_pre_match.txt")):
-            raise SmatException(
-                "ScorePerfmMatcher", f"pre_match of second file, {file2_stem}_pre_match.txt, doesn't exist"
-            )
+        _check_output(tempdir, f"{file2_stem}_pre_match.txt", "ScorePerfmMatcher", "pre_match of second file", result)
 
-        subprocess.run(
+        progress("smat:ErrorDetection")
+        result = run(
             [
                 "ErrorDetection",
                 f"{file1_stem}_fmt3x.txt",
@@ -67,15 +157,12 @@ def smat_align(file1, file2):
                 f"{file2_stem}_pre_match.txt",
                 f"{file2_stem}_err_match.txt",
                 "0",
-            ],
-            cwd=tempdir,
+            ]
         )
-        if not os.path.exists(os.path.join(tempdir, f"{file2_stem}_err_match.txt")):
-            raise SmatException(
-                "ErrorDetection", f"err_match of second file, {file2_stem}_err_match.txt, doesn't exist"
-            )
+        _check_output(tempdir, f"{file2_stem}_err_match.txt", "ErrorDetection", "err_match of second file", result)
 
-        subprocess.run(
+        progress("smat:RealignmentMOHMM")
+        result = run(
             [
                 "RealignmentMOHMM",
                 f"{file1_stem}_fmt3x.txt",
@@ -83,27 +170,22 @@ def smat_align(file1, file2):
                 f"{file2_stem}_err_match.txt",
                 f"{file2_stem}_realigned_match.txt",
                 "0.3",
-            ],
-            cwd=tempdir,
+            ]
+        )
+        _check_output(
+            tempdir, f"{file2_stem}_realigned_match.txt", "RealignmentMOHMM", "realigned_match of second file", result
         )
-        if not os.path.exists(os.path.join(tempdir, f"{file2_stem}_realigned_match.txt")):
-            raise SmatException(
-                "RealignmentMOHMM", f"realigned_match of second file, {file2_stem}_realigned_match.txt, doesn't exist"
-            )
 
-        subprocess.run(
+        progress("smat:MatchToCorresp")
+        result = run(
             [
                 "MatchToCorresp",
                 f"{file2_stem}_realigned_match.txt",
                 f"{file1_stem}_spr.txt",
                 f"{file2_stem}_corresp.txt",
-            ],
-            cwd=tempdir,
+            ]
         )
-        if not os.path.exists(os.path.join(tempdir, f"{file2_stem}_corresp.txt")):
-            raise SmatException(
-                "MatchToCorresp", f"end result of second file, {file2_stem}_corresp.txt.txt, doesn't exist"
-            )
+        _check_output(tempdir, f"{file2_stem}_corresp.txt", "MatchToCorresp", "end result of second file", result)
 
         with open(os.path.join(tempdir, f"{file2_stem}_corresp.txt")) as fp:
             return fp.read()
@@ -0,0 +1,114 @@
+"""Timing and resource use of the stages of an alignment.
+
+A StageRecorder measures each stage that runs inside `recorder.stage(name)`: wall time, CPU time of this
+process and of the subprocesses that it waited for (SMAT, Rscript, fluidsynth), peak RSS, the exit codes of
+subprocesses and any input sizes that the stage records. Finished stages are kept in `recorder.spans`
+and are passed to each of the recorder's hooks, which can send them somewhere (logs, metrics, tracing).
+"""
+
+import contextvars
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+# ru_maxrss is in kilobytes on linux and bytes on macOS
+_MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+_current_span = contextvars.ContextVar("current_stage_span", default=None)
+
+
+@dataclass
+class StageSpan:
+    """Measurements of one stage of an alignment. Times are in seconds, memory in bytes"""
+
+    name: str
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    child_cpu_time: float = 0.0
+    peak_rss: int = 0
+    child_peak_rss: int = 0
+    # Exit code of each subprocess run during the stage, as [name, exit code] pairs in the order they ran
+    exit_codes: list = field(default_factory=list)
+    # Input sizes and other values recorded by the stage, e.g. {"notes": 1234}
+    attributes: dict = field(default_factory=dict)
+    error: str | None = None
+    # Total wall time of the subprocesses run during the stage, by name
+    subprocess_times: dict = field(default_factory=dict)
+
+
+class StageHook:
+    """Receives stages as they start and finish. Subclasses override one or both methods"""
+
+    def stage_started(self, span: StageSpan):
+        pass
+
+    def stage_finished(self, span: StageSpan):
+        pass
+
+
+def _rusage():
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return self_usage, child_usage
+
+
+class StageRecorder:
+    def __init__(self, hooks=None):
+        self.hooks = list(hooks or [])
+        self.spans: list[StageSpan] = []
+
+    def _call_hooks(self, method, span):
+        for hook in self.hooks:
+            try:
+                getattr(hook, method)(span)
+            except Exception as e:
+                # Instrumentation must never fail an alignment
+                print(f"Stage hook {type(hook).__name__}.{method} failed: {e}")
+
+    @contextmanager
+    def stage(self, name, **attributes):
+        """Measure the code in this block as the stage `name`. Yields the StageSpan, so that the stage
+        can add attributes to it. Stages can be nested, each is measured separately."""
+        span = StageSpan(name=name, attributes=dict(attributes))
+        self._call_hooks("stage_started", span)
+        token = _current_span.set(span)
+        self_before, child_before = _rusage()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.wall_time = time.perf_counter() - wall_start
+            span.cpu_time = time.process_time() - cpu_start
+            self_after, child_after = _rusage()
+            span.child_cpu_time = (child_after.ru_utime + child_after.ru_stime) - (
+                child_before.ru_utime + child_before.ru_stime
+            )
+            # Peak RSS is the peak over the life of the process (or of its largest child), not only this stage
+            span.peak_rss = self_after.ru_maxrss * _MAXRSS_UNIT
+            span.child_peak_rss = child_after.ru_maxrss * _MAXRSS_UNIT
+            _current_span.reset(token)
+            self.spans.append(span)
+            self._call_hooks("stage_finished", span)
+
+
+def record_subprocess(name, returncode, duration=None):
+    """Record the exit code (None if it was killed because it timed out) and the run time of a subprocess in
+    the stage that is currently running, if there is one"""
+    span = _current_span.get()
+    if span is not None:
+        span.exit_codes.append([name, returncode])
+        if duration is not None:
+            span.subprocess_times[name] = span.subprocess_times.get(name, 0.0) + duration
+
+
+def record_attributes(**attributes):
+    """Record input sizes or other values in the stage that is currently running, if there is one"""
+    span = _current_span.get()
+    if span is not None:
+        span.attributes.update(attributes)
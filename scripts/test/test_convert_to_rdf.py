@@ -4,7 +4,21 @@ Comprehensive test suite for score_to_graph function to ensure behavior is prese
 during refactoring from mixed string/rdflib approach to pure rdflib approach.
 """
 
-from scripts.convert_to_rdf import score_to_graph
+from pathlib import Path
+
+from rdflib import Graph
+from rdflib.compare import isomorphic
+
+from scripts.convert_to_rdf import (
+    generate_structural_segmentation,
+    merge_graph,
+    performance_to_graph,
+    score_to_graph,
+    segmentation_to_graph,
+    segmentation_to_turtle,
+)
+
+test_mei = Path(__file__).parent.parent.parent / "trompaalign" / "test" / "data" / "Beethoven_Op119_Nr08-Breitkopf.mei"
 
 
 class TestScoreToGraph:
@@ -118,3 +132,71 @@ PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
         turtle_output = graph.serialize(format="n3")
 
         assert """dcterms:title "Test \\"Score\\" with & special <characters> and 'quotes'" ;""" in turtle_output
+
+
+def _templated_segmentation_graph(seg_data, segUri):
+    """The segmentation graph as it was built before segmentation_to_turtle, by parsing a templated document"""
+    rdf = f"""@prefix so: <http://www.linkedmusic.org/ontologies/segment/> .
+@prefix frbr: <http://purl.org/vocab/frbr/core#> .
+@prefix rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#> .
+@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .
+@prefix meld: <https://meld.linkedmusic.org/terms/> .
+@base <{segUri}> .
+
+<{segUri}> a so:SegmentLine .
+"""
+    for ix, seg in enumerate(seg_data):
+        notes = ", ".join(f"<{segUri}#{n}>" for n in seg_data[seg]["notes"])
+        measures = ", ".join(f"<{segUri}#{m}>" for m in seg_data[seg]["measures"])
+        rdf += f"""<#{seg}> a so:Segment ;
+    so:onSegmentLine <{segUri}#segmentation> ;
+    meld:order "{ix}" ;
+    frbr:embodiment [ a meld:MEIManifestation, rdf:Bag ;
+    rdfs:member <{segUri}#{seg}> ;
+    meld:notes {notes} ;
+    meld:measures {measures} ;
+    meld:startsWith <{segUri}#{seg_data[seg]["first"]}> ;
+    meld:endsWith <{segUri}#{seg_data[seg]["last"]}> ] .
+"""
+    return Graph().parse(data=rdf, format="n3")
+
+
+def test_segmentation_turtle_and_graph_are_isomorphic():
+    seg_uri = "http://example.org/segments/1"
+    seg_data = generate_structural_segmentation(str(test_mei))
+    assert len(seg_data) > 1
+
+    expected = _templated_segmentation_graph(seg_data, seg_uri)
+    from_turtle = Graph().parse(data=segmentation_to_turtle(seg_data, seg_uri), format="turtle")
+    graph = segmentation_to_graph(seg_data, seg_uri)
+
+    assert len(expected) > 100
+    assert isomorphic(from_turtle, expected)
+    assert isomorphic(graph, expected)
+
+
+def test_merge_graph_matches_reparsing():
+    timeline = Graph()
+    timeline.parse(
+        data="""@prefix tl: <http://purl.org/NET/c4dm/timeline.owl#> .
+<http://example.org/tl/1#0> a tl:Instant ; tl:onTimeLine <http://example.org/tl/1> .
+<http://example.org/tl/1#1> tl:at [ a tl:Instant ] .""",
+        format="n3",
+    )
+    performance = performance_to_graph(
+        "http://example.org/tl/1",
+        "http://example.org/tl/1",
+        "http://example.org/score/1",
+        "http://example.org/a.mp3",
+        "x",
+    )
+
+    expected = Graph()
+    expected += timeline
+    expected.parse(data=performance.serialize(format="n3"), format="n3")
+    merged = Graph()
+    merged += timeline
+    merge_graph(merged, performance)
+
+    assert len(merged) == len(timeline) + len(performance)
+    assert isomorphic(merged, expected)
@@ -0,0 +1,96 @@
+from pathlib import Path
+
+import pytest
+
+from scripts import expansion_selection
+from scripts.expansion_selection import candidate_expansions, rank_expansions, select_best_expansion
+from scripts.smat_align import SmatException
+
+test_mei = Path(__file__).parent.parent.parent / "trompaalign" / "test" / "data" / "Beethoven_Op119_Nr08-Breitkopf.mei"
+
+CORRESP_HEADER = (
+    "// alignID\talignOntime\talignSitch\talignPitch\talignOnvel\trefID\trefOntime\trefSitch\trefPitch\trefOnvel\n"
+)
+
+
+def _corresp_with_inserted_notes(count):
+    rows = [f"{i}\t{i}.000000\tC4\t60\t50\t*\t-1\t*\t-1\t-1\t" for i in range(count)]
+    return CORRESP_HEADER + "\n".join(rows) + "\n"
+
+
+def _load_mei():
+    with open(test_mei, "r") as f:
+        return f.read()
+
+
+def test_candidate_expansions():
+    assert candidate_expansions(_load_mei()) == ["expansion-default", "expansion-minimal", "expansion-nested"]
+
+
+def test_select_best_expansion(tmp_path, monkeypatch):
+    inserted_notes = {"expansion-default": 4, "expansion-minimal": 1, "expansion-nested": 9}
+
+    def fake_smat_align(canonical_midi, performance_midi, progress=None):
+        expansion = Path(canonical_midi).name.split(".")[1]
+        return _corresp_with_inserted_notes(inserted_notes[expansion])
+
+    monkeypatch.setattr(expansion_selection, "smat_align", fake_smat_align)
+    best, results = select_best_expansion(_load_mei(), "performance.mid", str(tmp_path))
+
+    assert best.expansion == "expansion-minimal"
+    assert best.inserted_notes == 1
+    assert [r.inserted_notes for r in results] == [4, 1, 9]
+    assert Path(best.canonical_midi).exists()
+
+
+def test_select_best_expansion_skips_failures(tmp_path, monkeypatch):
+    def fake_smat_align(canonical_midi, performance_midi, progress=None):
+        if "expansion-minimal" in canonical_midi:
+            raise SmatException("ScorePerfmMatcher", "failed")
+        return _corresp_with_inserted_notes(2)
+
+    monkeypatch.setattr(expansion_selection, "smat_align", fake_smat_align)
+    best, _ = select_best_expansion(_load_mei(), "performance.mid", str(tmp_path), max_workers=1)
+    assert best.expansion == "expansion-default"
+
+    def failing_smat_align(canonical_midi, performance_midi, progress=None):
+        raise SmatException("ScorePerfmMatcher", "failed")
+
+    monkeypatch.setattr(expansion_selection, "smat_align", failing_smat_align)
+    with pytest.raises(SmatException):
+        select_best_expansion(_load_mei(), "performance.mid", str(tmp_path))
+
+
+def test_rank_expansions_by_note_count():
+    mei_data = _load_mei()
+    # The expansions have 442, 221 and 663 notes
+    assert [e for e, _ in rank_expansions(mei_data, [60] * 225)] == [
+        "expansion-minimal",
+        "expansion-default",
+        "expansion-nested",
+    ]
+    assert rank_expansions(mei_data, [60] * 440)[0][0] == "expansion-default"
+    assert rank_expansions(mei_data, [60] * 700)[0][0] == "expansion-nested"
+
+
+def test_rank_expansions_with_pitch_histogram():
+    mei_data = _load_mei()
+    ranking = rank_expansions(mei_data, [60] * 442, pitch_histogram=True)
+    assert ranking[0][0] == "expansion-default"
+    # A performance of only C is far from the score's pitches
+    assert ranking[0][1] > 0.5
+
+
+def test_select_best_expansion_top_k(tmp_path, monkeypatch):
+    aligned = []
+
+    def fake_smat_align(canonical_midi, performance_midi, progress=None):
+        aligned.append(Path(canonical_midi).name.split(".")[1])
+        return _corresp_with_inserted_notes(0)
+
+    monkeypatch.setattr(expansion_selection, "smat_align", fake_smat_align)
+    monkeypatch.setattr(expansion_selection, "performance_pitches", lambda midi: [60] * 230)
+    best, results = select_best_expansion(_load_mei(), "performance.mid", str(tmp_path), top_k=2)
+
+    assert sorted(aligned) == ["expansion-default", "expansion-minimal"]
+    assert best.expansion == "expansion-minimal"
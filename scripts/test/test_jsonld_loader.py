@@ -0,0 +1,73 @@
+import os
+import time
+
+import pytest
+from pyld import jsonld
+
+from scripts import jsonld_loader
+
+CONTEXT_URL = "https://contexts.example.org/music.jsonld"
+
+
+@pytest.fixture(autouse=True)
+def loader(monkeypatch):
+    jsonld_loader.clear_cache()
+    fetched = []
+
+    def fetch(url, options):
+        fetched.append(url)
+        if url != CONTEXT_URL:
+            raise jsonld.JsonLdError("offline", "jsonld.LoadDocumentError")
+        return {
+            "contextUrl": None,
+            "documentUrl": url,
+            "document": {"@context": {"mo": "http://purl.org/ontology/mo/"}},
+        }
+
+    monkeypatch.setattr(jsonld_loader, "_fetch", fetch)
+    yield fetched
+    jsonld_loader.clear_cache()
+
+
+def test_compact_uses_registered_context(loader):
+    jsonld_loader.register_context(
+        "https://www.w3.org/ns/ldp.jsonld", {"@context": {"ldp": "http://www.w3.org/ns/ldp#"}}
+    )
+    document = {"@id": "https://pod.example.org/scores/", "@type": "http://www.w3.org/ns/ldp#Container"}
+
+    for _ in range(2):
+        compacted = jsonld.compact(document, "https://www.w3.org/ns/ldp.jsonld")
+        assert compacted["@type"] == "ldp:Container"
+
+    assert loader == []
+
+
+def test_fetched_documents_are_memoized(loader, monkeypatch):
+    document = {"@context": CONTEXT_URL, "@id": "https://pod.example.org/p1", "mo:performer": "Alice"}
+
+    assert jsonld.expand(document) == jsonld.expand(document)
+    assert loader == [CONTEXT_URL]
+
+    # Once it expires the document is fetched again, and the expired copy is used if that fails
+    later = time.monotonic() + jsonld_loader.CONTEXT_TTL + 1
+    monkeypatch.setattr(jsonld_loader.time, "monotonic", lambda: later)
+    jsonld_loader.load_document(CONTEXT_URL)
+    monkeypatch.setattr(jsonld_loader, "_fetch", lambda url, options: 1 / 0)
+    assert jsonld_loader.load_document(CONTEXT_URL)["document"]["@context"]["mo"] == "http://purl.org/ontology/mo/"
+    assert loader == [CONTEXT_URL, CONTEXT_URL]
+
+
+def test_unknown_document_fails_without_cached_copy():
+    with pytest.raises(jsonld.JsonLdError):
+        jsonld_loader.load_document("https://contexts.example.org/missing.jsonld")
+
+
+def test_bundled_contexts_are_served_from_files(loader):
+    for filename, (_, urls) in jsonld_loader.BUNDLED_CONTEXTS.items():
+        assert os.path.exists(os.path.join(jsonld_loader.CONTEXT_DIR, filename))
+        for url in urls:
+            assert jsonld_loader.load_document(url)["document"]["@context"]
+
+    document = {"@context": "https://schema.org/", "@id": "https://pod.example.org/s1", "name": "Op. 119"}
+    assert jsonld.expand(document)[0]["http://schema.org/name"] == [{"@value": "Op. 119"}]
+    assert loader == []
@@ -0,0 +1,60 @@
+import io
+import json
+import os
+import random
+
+import pytest
+
+from scripts.midi_events_to_file import iter_json_array, midi_json_to_midi, webmidi_to_midi
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), "..", "..", "examples", "example-clara-performance-midi.json")
+
+
+def midi_bytes(midi):
+    out = io.BytesIO()
+    midi.save(file=out)
+    return out.getvalue()
+
+
+def random_events(count):
+    rng = random.Random(4)
+    timestamp = 1000.0
+    events = []
+    for _ in range(count):
+        timestamp += rng.uniform(0, 300)
+        # Mostly note on/off and control change, with some other messages and out of range keys
+        status = rng.choice([0x80, 0x90, 0x90, 0xB0, 0xA0, 0xE0, 0x1B])
+        key = rng.randrange(140)
+        events.append({"data": {"_data": {"0": status, "1": key, "2": rng.randrange(256)}}, "timestamp": timestamp})
+    return events
+
+
+def test_webmidi_to_midi_example_matches_midi_json_to_midi(capsys):
+    with open(EXAMPLE) as fp:
+        expected = midi_bytes(midi_json_to_midi(json.load(fp)))
+    capsys.readouterr()
+
+    with open(EXAMPLE, "rb") as fp:
+        assert midi_bytes(webmidi_to_midi(fp)) == expected
+    assert capsys.readouterr().out == ""
+
+
+def test_webmidi_to_midi_matches_midi_json_to_midi(capsys):
+    events = random_events(3000)
+    expected = midi_bytes(midi_json_to_midi(events))
+
+    assert midi_bytes(webmidi_to_midi(events, batch_size=128)) == expected
+    stream = io.StringIO(json.dumps(events, indent=1))
+    assert midi_bytes(webmidi_to_midi(iter_json_array(stream, read_size=100), batch_size=128)) == expected
+
+
+@pytest.mark.parametrize("document", ["[]", ' [ 1, 2.5e3 ,{"a": [1, 2]}, "x" ]\n', "[12345678]"])
+def test_iter_json_array(document):
+    for read_size in (1, 3, 1024):
+        assert list(iter_json_array(io.StringIO(document), read_size=read_size)) == json.loads(document)
+
+
+@pytest.mark.parametrize("document", ["{}", "[1 2]", "[1,", '[{"a": 1]'])
+def test_iter_json_array_invalid(document):
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO(document), read_size=2))
@@ -0,0 +1,52 @@
+import sys
+
+import pytest
+
+from scripts import smat_align
+from scripts.smat_align import SmatException, _check_output, run_smat_tool, smat_timeout
+from scripts.stage_timing import StageRecorder
+
+
+def test_run_smat_tool_nonzero_exit(tmp_path):
+    # Exit codes other than 0 aren't an error by themselves, the tool's output is checked instead
+    recorder = StageRecorder()
+    with recorder.stage("smat_align"):
+        result = run_smat_tool(["sh", "-c", "echo 'cannot read hmm file' >&2; exit 3"], tmp_path, timeout=10)
+
+    assert result.returncode == 3
+    assert recorder.spans[0].exit_codes == [["sh", 3]]
+    assert "sh" in recorder.spans[0].subprocess_times
+
+    with pytest.raises(SmatException) as excinfo:
+        _check_output(tmp_path, "hmm.txt", "sh", "hmm of first file", result)
+    assert excinfo.value.returncode == 3
+    assert "cannot read hmm file" in excinfo.value.stderr
+    assert "exited with code 3" in str(excinfo.value)
+    assert "cannot read hmm file" in str(excinfo.value)
+
+
+def test_run_smat_tool_killed_by_signal(tmp_path):
+    with pytest.raises(SmatException) as excinfo:
+        run_smat_tool(["sh", "-c", "echo 'out of memory' >&2; kill -ABRT $$"], tmp_path, timeout=10)
+
+    assert excinfo.value.stage == "sh"
+    assert excinfo.value.returncode == -6
+    assert "killed by signal 6" in str(excinfo.value)
+    assert "out of memory" in str(excinfo.value)
+
+
+def test_run_smat_tool_timeout(tmp_path):
+    with pytest.raises(SmatException, match="timed out after 1s"):
+        run_smat_tool(["sleep", "10"], tmp_path, timeout=1)
+
+
+def test_run_smat_tool_memory_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(smat_align, "SMAT_MEMORY_LIMIT", 512 * 1024 * 1024)
+    result = run_smat_tool([sys.executable, "-c", "bytearray(1024 * 1024 * 1024)"], tmp_path, timeout=10)
+    assert result.returncode == 1
+    assert "MemoryError" in result.stderr
+
+
+def test_smat_timeout_scales_with_notes():
+    assert smat_timeout("ScorePerfmMatcher", 10000) > smat_timeout("ScorePerfmMatcher", 100)
+    assert smat_timeout("ScorePerfmMatcher", 1000) > smat_timeout("SprToFmt3x", 1000)
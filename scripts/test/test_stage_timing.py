@@ -0,0 +1,62 @@
+import subprocess
+import sys
+
+import pytest
+
+from scripts.stage_timing import StageHook, StageRecorder, record_attributes, record_subprocess
+
+
+class RecordingHook(StageHook):
+    def __init__(self):
+        self.events = []
+
+    def stage_started(self, span):
+        self.events.append(("started", span.name))
+
+    def stage_finished(self, span):
+        self.events.append(("finished", span.name))
+
+
+class FailingHook(StageHook):
+    def stage_finished(self, span):
+        raise RuntimeError("metrics backend is down")
+
+
+def test_stage_measures_subprocesses():
+    hook = RecordingHook()
+    recorder = StageRecorder([hook])
+
+    with recorder.stage("outer", notes=10):
+        with recorder.stage("inner") as span:
+            result = subprocess.run([sys.executable, "-c", "import sys; sys.exit(3)"])
+            record_subprocess("python", result.returncode)
+            record_attributes(midi_events=20)
+
+    inner, outer = recorder.spans
+    assert inner.name == "inner"
+    assert inner is span
+    assert inner.exit_codes == [["python", 3]]
+    assert inner.attributes == {"midi_events": 20}
+    assert inner.child_cpu_time > 0
+    assert inner.peak_rss > 0
+    # Values are only recorded in the innermost stage
+    assert outer.exit_codes == []
+    assert outer.attributes == {"notes": 10}
+    assert outer.wall_time >= inner.wall_time
+    assert hook.events == [("started", "outer"), ("started", "inner"), ("finished", "inner"), ("finished", "outer")]
+
+
+def test_stage_records_error():
+    recorder = StageRecorder([FailingHook()])
+
+    with pytest.raises(ValueError):
+        with recorder.stage("reconcile"):
+            raise ValueError("bad corresp")
+
+    # A failing hook doesn't hide the error of the stage
+    assert recorder.spans[0].error == "ValueError: bad corresp"
+
+
+def test_record_outside_stage_is_ignored():
+    record_subprocess("python", 0)
+    record_attributes(notes=1)
@@ -0,0 +1,78 @@
+import json
+
+from rdflib import Graph
+
+from scripts.convert_to_rdf import maps_result_to_graph
+from scripts.timeline_chunks import TimelineChunkIndex, chunk_ranges, chunk_timeline
+
+MEI_URI = "https://example.org/score.mei"
+TIMELINE_URI = "https://pod.example.org/timelines/score/perf-1"
+
+SEG_DATA = {
+    "section-A": {"notes": {"note-a1", "note-a2"}},
+    "section-B": {"notes": {"note-b1"}},
+}
+
+
+def _maps_result():
+    # 20 minutes of playing: sections A B A B, 300 seconds each, the second A B through the repeat
+    maps_result = []
+    for onset in range(1200):
+        section = "a1" if (onset // 300) % 2 == 0 else "b1"
+        rend = "-rend2" if onset >= 600 else ""
+        xml_id = f"note-{section}{rend}"
+        if onset % 7 == 0:
+            xml_id = f"trompa-align_inserted_{onset}"
+        maps_result.append({"obs_mean_onset": onset + 0.5, "xml_id": [xml_id], "velocity": [60]})
+    return json.dumps(maps_result)
+
+
+def test_chunk_ranges_split_at_segments():
+    onsets = list(range(10))
+    segments = ["A", "A", None, "B", "B", "B", "C", "C", "C", "C"]
+
+    assert chunk_ranges(onsets, segments, duration=2, max_duration=100) == [range(0, 3), range(3, 6), range(6, 10)]
+    # Without a segment boundary, chunks are split at the maximum duration
+    assert chunk_ranges(onsets, [None] * 10, duration=2, max_duration=4) == [range(0, 4), range(4, 8), range(8, 10)]
+    assert chunk_ranges([], [], duration=2, max_duration=4) == []
+
+
+def test_chunk_timeline():
+    maps_result = _maps_result()
+    index, graphs = chunk_timeline(maps_result, SEG_DATA, MEI_URI, TIMELINE_URI, "test")
+
+    assert [(chunk.first_instant, chunk.last_instant) for chunk in index.chunks] == [
+        (0, 299),
+        (300, 599),
+        (600, 899),
+        (900, 1199),
+    ]
+    assert index.chunks[1].segments == ["section-B"]
+    assert index.chunks[1].start == 300.5
+    assert index.chunks[1].end == index.chunks[2].start
+    assert [chunk.uri for chunk in index.chunks_between(310, 320)] == [f"{TIMELINE_URI}.chunk-1"]
+
+    # The chunks together are the whole timeline
+    whole = maps_result_to_graph(maps_result, MEI_URI, TIMELINE_URI, None, None, False, "test")
+    merged = Graph()
+    for graph in graphs:
+        merged += graph
+    assert set(merged) == set(whole)
+
+    assert TimelineChunkIndex.from_json(index.to_json()) == index
+
+
+def test_timeline_of_a_range_of_instants():
+    maps_result = json.loads(_maps_result())
+    # An inserted note with a single velocity
+    maps_result[400]["velocity"] = 70
+    whole = maps_result_to_graph(json.dumps(maps_result), MEI_URI, TIMELINE_URI, None, None, False, "test")
+
+    instants = range(350, 450)
+    part = maps_result_to_graph(maps_result, MEI_URI, TIMELINE_URI, None, None, False, "test", instants=instants)
+
+    assert set(part) < set(whole)
+    assert set(part) == set(
+        maps_result_to_graph(maps_result, MEI_URI, TIMELINE_URI, None, None, False, "test", instants, 350)
+    )
+    assert {str(s) for s in part.subjects() if "#v" in str(s)} == {f"{TIMELINE_URI}#v{n}" for n in instants}
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+from rdflib import Literal, URIRef
+
+from scripts.convert_to_rdf import maps_result_to_graph
+from scripts.namespace import TL
+from scripts.timeline_columns import TimelineColumns, maps_result_to_columns
+
+MEI_URI = "https://example.org/score.mei"
+TIMELINE_URI = "https://pod.example.org/timelines/score/perf-1"
+
+MAPS_RESULT = json.dumps(
+    [
+        {"obs_mean_onset": 0.5, "xml_id": ["note-1", "note-2"], "velocity": [60, 64]},
+        {"obs_mean_onset": 0.75, "xml_id": "trompa-align_inserted_3", "velocity": 40},
+        {"obs_mean_onset": 1.25, "xml_id": ["note-3"], "velocity": [70]},
+    ]
+)
+
+
+def test_maps_result_to_columns():
+    columns = maps_result_to_columns(MAPS_RESULT, MEI_URI, TIMELINE_URI)
+
+    assert len(columns) == 3
+    assert columns.onsets == [0.5, 0.75, 1.25]
+    assert columns.velocities == [62, 40, 70]
+    assert columns.note_offsets == [0, 2, 3, 4]
+    assert columns.notes(0) == [("note-1", 60), ("note-2", 64)]
+    assert columns.notes(1) == [("trompa-align_inserted_3", 40)]
+
+
+def test_columns_match_timeline():
+    columns = maps_result_to_columns(MAPS_RESULT, MEI_URI, TIMELINE_URI)
+    graph = maps_result_to_graph(MAPS_RESULT, MEI_URI, TIMELINE_URI, None, None, False, "test")
+
+    for index, onset in enumerate(columns.onsets):
+        instant = URIRef(f"{TIMELINE_URI}#{index}")
+        assert graph.value(instant, TL.at) == Literal(f"P{onset}S")
+
+
+def test_round_trip():
+    columns = maps_result_to_columns(MAPS_RESULT, MEI_URI, TIMELINE_URI)
+
+    assert TimelineColumns.from_json(columns.to_json()) == columns
+    empty = TimelineColumns(timeline=TIMELINE_URI, mei=MEI_URI)
+    assert TimelineColumns.from_json(empty.to_json()) == empty
+
+
+def test_from_json_rejects_inconsistent_columns():
+    document = json.loads(maps_result_to_columns(MAPS_RESULT, MEI_URI, TIMELINE_URI).to_json())
+    document["note_ids"].pop()
+    with pytest.raises(ValueError, match="different lengths"):
+        TimelineColumns.from_json(json.dumps(document))
+
+    document["version"] = 2
+    with pytest.raises(ValueError, match="Unsupported"):
+        TimelineColumns.from_json(json.dumps(document))
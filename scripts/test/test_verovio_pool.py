@@ -0,0 +1,92 @@
+import base64
+from pathlib import Path
+
+import verovio
+
+from scripts.verovio_midi import render_midi_and_notes, render_score, write_score_rendering
+from scripts.verovio_pool import TOOLKIT_MEMORY_FACTOR, VerovioToolkitPool
+
+test_mei = Path(__file__).parent.parent.parent / "trompaalign" / "test" / "data" / "Beethoven_Op119_Nr08-Breitkopf.mei"
+
+
+def _load_mei():
+    with open(test_mei, "r") as f:
+        return f.read()
+
+
+def test_pool_reuses_loaded_toolkit():
+    mei_data = _load_mei()
+    pool = VerovioToolkitPool()
+
+    with pool.toolkit(mei_data, "expansion-minimal") as tk:
+        first = tk
+        midi = tk.renderToMIDI()
+    with pool.toolkit(mei_data, "expansion-minimal") as tk:
+        assert tk is first
+        timemap = tk.renderToTimemap()
+
+    assert pool.stats()["hits"] == 1
+    assert pool.stats()["misses"] == 1
+
+    fresh = verovio.toolkit()
+    fresh.setOptions({"expand": "expansion-minimal"})
+    fresh.loadData(mei_data)
+    assert midi == fresh.renderToMIDI()
+    assert timemap == fresh.renderToTimemap()
+
+
+def test_pool_keys_by_expansion():
+    mei_data = _load_mei()
+    pool = VerovioToolkitPool()
+
+    with pool.toolkit(mei_data, "expansion-minimal") as tk:
+        minimal_notes = len([e for e in tk.renderToTimemap() if "on" in e])
+    with pool.toolkit(mei_data, "expansion-default") as tk:
+        default_notes = len([e for e in tk.renderToTimemap() if "on" in e])
+
+    assert pool.stats()["misses"] == 2
+    assert default_notes > minimal_notes
+
+
+def test_pool_evicts_least_recently_used():
+    mei_data = _load_mei()
+    pool = VerovioToolkitPool(max_bytes=2 * len(mei_data) * TOOLKIT_MEMORY_FACTOR)
+
+    for expansion in ["expansion-default", "expansion-minimal", "expansion-default", "expansion-nested"]:
+        with pool.toolkit(mei_data, expansion):
+            pass
+
+    # expansion-minimal was least recently used when expansion-nested was loaded
+    assert pool.stats()["evictions"] == 1
+    with pool.toolkit(mei_data, "expansion-default"):
+        pass
+    assert pool.stats()["hits"] == 2
+
+
+def test_render_midi_and_notes():
+    mei_data = _load_mei()
+    midi, notes = render_midi_and_notes(mei_data, "expansion-default")
+
+    fresh = verovio.toolkit()
+    fresh.setOptions({"expand": "expansion-default"})
+    fresh.loadData(mei_data)
+    assert midi == base64.b64decode(fresh.renderToMIDI())
+    assert len(notes) == 442
+    for note in notes:
+        assert note["midiPitch"] == fresh.getMIDIValuesForElement(note["id"])["pitch"]
+
+
+def test_render_score_per_expansion(tmp_path):
+    mei_data = _load_mei()
+    default = render_score(mei_data, "expansion-default")
+    minimal = render_score(mei_data, "expansion-minimal")
+
+    assert render_score(mei_data, "expansion-default") is default
+    assert len(default.notes) == 442
+    assert len(minimal.notes) == 221
+
+    default_files = write_score_rendering(default, tmp_path)
+    minimal_files = write_score_rendering(minimal, tmp_path)
+    assert default_files != minimal_files
+    with open(default_files[0], "rb") as f:
+        assert f.read() == default.midi
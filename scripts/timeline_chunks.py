@@ -0,0 +1,166 @@
+"""Split the timeline of a long performance into chunks of a few minutes each.
+
+The timeline of an hour-long rehearsal is several megabytes of JSON-LD which has to be fetched whole. Long
+timelines are also uploaded as chunks, each a timeline document with the instants of a range of time, and an
+index document which lists the time span of each chunk so that clients can fetch only the chunks they need:
+
+    {
+      "version": 1,
+      "timeline": "<timeline uri>",
+      "mei": "<mei uri>",
+      "chunks": [
+        {"uri": "<timeline uri>.chunk-0", "start": 0.52, "end": 121.3, "first_instant": 0, "last_instant": 811,
+         "segments": ["section-A", "section-B"]},
+        ...
+      ]
+    }
+
+Chunks are split where the performance moves from one section of the structural segmentation to the next
+(see generate_structural_segmentation), after at least TIMELINE_CHUNK_DURATION seconds. A chunk that reaches
+TIMELINE_CHUNK_MAX_DURATION without a section boundary is split anyway. `start` is the onset of the first
+instant of a chunk and `end` is the start of the next chunk (or the last onset), so the spans cover the
+whole timeline. Instants keep their IRIs <timeline#i>, so the chunks together have the same triples as the
+whole timeline.
+"""
+
+import json
+import re
+from dataclasses import asdict, dataclass, field
+
+from scripts.convert_to_rdf import maps_result_to_graph
+
+TIMELINE_CHUNKS_VERSION = 1
+# Only timelines that are at least this long (in seconds) are chunked
+TIMELINE_CHUNK_MIN_LENGTH = 10 * 60
+TIMELINE_CHUNK_DURATION = 2 * 60
+TIMELINE_CHUNK_MAX_DURATION = 5 * 60
+
+# verovio gives the notes of the second and later passes through a repeat the ids <id>-rend2, <id>-rend3...
+REND_SUFFIX_RE = re.compile(r"^(.*?)(-rend\d+)?$")
+
+
+@dataclass
+class TimelineChunk:
+    uri: str
+    start: float
+    end: float
+    first_instant: int
+    last_instant: int
+    segments: list = field(default_factory=list)
+
+
+@dataclass
+class TimelineChunkIndex:
+    timeline: str
+    mei: str
+    chunks: list[TimelineChunk] = field(default_factory=list)
+
+    def chunks_between(self, start, end):
+        """The chunks with instants between `start` and `end` seconds"""
+        return [chunk for chunk in self.chunks if chunk.start <= end and chunk.end >= start]
+
+    def to_json(self) -> bytes:
+        document = {
+            "version": TIMELINE_CHUNKS_VERSION,
+            "timeline": self.timeline,
+            "mei": self.mei,
+            "chunks": [asdict(chunk) for chunk in self.chunks],
+        }
+        return json.dumps(document, separators=(",", ":")).encode("utf-8")
+
+    @classmethod
+    def from_json(cls, data) -> "TimelineChunkIndex":
+        document = json.loads(data)
+        if document.get("version") != TIMELINE_CHUNKS_VERSION:
+            raise ValueError(f"Unsupported timeline chunk index version {document.get('version')}")
+        return cls(
+            timeline=document["timeline"],
+            mei=document["mei"],
+            chunks=[TimelineChunk(**chunk) for chunk in document["chunks"]],
+        )
+
+
+def note_segments(seg_data):
+    """The section of each note in a structural segmentation, by note id"""
+    segments = {}
+    for section, data in seg_data.items():
+        for note in data["notes"]:
+            segments.setdefault(note, section)
+    return segments
+
+
+def instant_segment(xml_ids, segments):
+    """The (section, pass through a repeat) that the notes of an instant are in, or None for inserted notes"""
+    for xml_id in xml_ids:
+        note, rend = REND_SUFFIX_RE.match(xml_id).groups()
+        if note in segments:
+            return segments[note], rend
+    return None
+
+
+def chunk_ranges(onsets, instant_segments, duration=TIMELINE_CHUNK_DURATION, max_duration=TIMELINE_CHUNK_MAX_DURATION):
+    """Split instants into ranges of consecutive instants, at segment boundaries where possible"""
+    ranges = []
+    start = 0
+    previous_segment = None
+    for ix in range(len(onsets)):
+        segment = instant_segments[ix]
+        elapsed = onsets[ix] - onsets[start]
+        at_boundary = segment is not None and previous_segment is not None and segment != previous_segment
+        if ix > start and ((at_boundary and elapsed >= duration) or elapsed >= max_duration):
+            ranges.append(range(start, ix))
+            start = ix
+        if segment is not None:
+            previous_segment = segment
+    if onsets:
+        ranges.append(range(start, len(onsets)))
+    return ranges
+
+
+def chunk_timeline(maps_result_json, seg_data, mei_uri, timeline_uri, label):
+    """Split the timeline of a MAPS result into chunks.
+
+    :return: the TimelineChunkIndex and the timeline graph of each chunk
+    """
+    maps_result = json.loads(maps_result_json)
+    onsets = [float(obs["obs_mean_onset"]) for obs in maps_result]
+    segments = note_segments(seg_data)
+    instant_segments = []
+    for obs in maps_result:
+        xml_ids = [obs["xml_id"]] if isinstance(obs["xml_id"], str) else obs["xml_id"]
+        instant_segments.append(instant_segment(xml_ids, segments))
+
+    index = TimelineChunkIndex(timeline=timeline_uri, mei=mei_uri)
+    graphs = []
+    ranges = chunk_ranges(onsets, instant_segments)
+    # Velocity annotations are numbered through the whole timeline, this is the number of the first one of a chunk
+    first_annotation = 0
+    for number, instants in enumerate(ranges):
+        end = onsets[ranges[number + 1].start] if number + 1 < len(ranges) else onsets[instants[-1]]
+        chunk_segments = dict.fromkeys(s[0] for s in instant_segments[instants.start : instants.stop] if s)
+        index.chunks.append(
+            TimelineChunk(
+                uri=f"{timeline_uri}.chunk-{number}",
+                start=onsets[instants.start],
+                end=end,
+                first_instant=instants.start,
+                last_instant=instants[-1],
+                segments=list(chunk_segments),
+            )
+        )
+        graphs.append(
+            maps_result_to_graph(
+                maps_result,
+                mei_uri,
+                timeline_uri,
+                None,
+                None,
+                includePerformance=False,
+                label=label,
+                instants=instants,
+                first_annotation=first_annotation,
+            )
+        )
+        for obs in maps_result[instants.start : instants.stop]:
+            first_annotation += len(obs.get("velocity", []))
+    return index, graphs
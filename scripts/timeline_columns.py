@@ -0,0 +1,103 @@
+"""A columnar copy of a performance timeline, for clients that only need onsets, velocities and notes.
+
+The timeline document has a tl:Instant for each onset and an oa:Annotation for the velocity of each note,
+which is a lot of JSON-LD to parse to find which notes were played when. The columns file has the same data
+as flat arrays, in a JSON document that can be loaded in one go:
+
+    {
+      "version": 1,
+      "timeline": "<timeline uri>",
+      "mei": "<mei uri>",
+      "onsets": [0.52, 0.97, ...],          # seconds, one per instant, in timeline order
+      "velocities": [64.5, 70, ...],        # mean velocity of each instant, or null
+      "note_offsets": [0, 2, 3, ...],       # notes of instant i are note_ids[note_offsets[i]:note_offsets[i + 1]]
+      "note_ids": ["note-0001", ...],       # MEI xml:ids, or trompa-align_inserted_* for inserted notes
+      "note_velocities": [64, 65, ...]      # velocity of each note, or null
+    }
+
+Row i is the instant <timeline#i> in the timeline document.
+"""
+
+import json
+from dataclasses import dataclass, field
+from statistics import mean
+
+TIMELINE_COLUMNS_VERSION = 1
+TIMELINE_COLUMNS_CONTENT_TYPE = "application/json"
+
+
+@dataclass
+class TimelineColumns:
+    timeline: str
+    mei: str
+    onsets: list = field(default_factory=list)
+    velocities: list = field(default_factory=list)
+    note_offsets: list = field(default_factory=lambda: [0])
+    note_ids: list = field(default_factory=list)
+    note_velocities: list = field(default_factory=list)
+
+    def __len__(self):
+        return len(self.onsets)
+
+    def notes(self, index):
+        """The (xml:id, velocity) pairs of the notes played at instant `index`"""
+        start, end = self.note_offsets[index], self.note_offsets[index + 1]
+        return list(zip(self.note_ids[start:end], self.note_velocities[start:end]))
+
+    def to_json(self) -> bytes:
+        document = {
+            "version": TIMELINE_COLUMNS_VERSION,
+            "timeline": self.timeline,
+            "mei": self.mei,
+            "onsets": self.onsets,
+            "velocities": self.velocities,
+            "note_offsets": self.note_offsets,
+            "note_ids": self.note_ids,
+            "note_velocities": self.note_velocities,
+        }
+        return json.dumps(document, separators=(",", ":")).encode("utf-8")
+
+    @classmethod
+    def from_json(cls, data) -> "TimelineColumns":
+        document = json.loads(data)
+        if document.get("version") != TIMELINE_COLUMNS_VERSION:
+            raise ValueError(f"Unsupported timeline columns version {document.get('version')}")
+        columns = cls(
+            timeline=document["timeline"],
+            mei=document["mei"],
+            onsets=document["onsets"],
+            velocities=document["velocities"],
+            note_offsets=document["note_offsets"],
+            note_ids=document["note_ids"],
+            note_velocities=document["note_velocities"],
+        )
+        columns.validate()
+        return columns
+
+    def validate(self):
+        if len(self.velocities) != len(self.onsets) or len(self.note_offsets) != len(self.onsets) + 1:
+            raise ValueError("onsets, velocities and note_offsets have different lengths")
+        if len(self.note_velocities) != len(self.note_ids) or self.note_offsets[-1] != len(self.note_ids):
+            raise ValueError("note_offsets, note_ids and note_velocities have different lengths")
+        if any(a > b for a, b in zip(self.note_offsets, self.note_offsets[1:])):
+            raise ValueError("note_offsets isn't sorted")
+
+
+def maps_result_to_columns(maps_result_json, mei_uri, timeline_uri) -> TimelineColumns:
+    """Columns of the timeline that maps_result_to_graph makes from the same MAPS result"""
+    columns = TimelineColumns(timeline=timeline_uri, mei=mei_uri)
+    for obs in json.loads(maps_result_json):
+        xml_ids = obs["xml_id"]
+        velocities = obs.get("velocity")
+        # Inserted notes have a single xml_id and velocity instead of lists
+        if isinstance(xml_ids, str):
+            xml_ids = [xml_ids]
+        if velocities is not None and not isinstance(velocities, list):
+            velocities = [velocities]
+        columns.onsets.append(float(obs["obs_mean_onset"]))
+        columns.velocities.append(mean(velocities) if velocities else None)
+        columns.note_ids.extend(xml_ids)
+        # One velocity per note, the timeline annotates the first len(velocities) notes
+        columns.note_velocities.extend(((velocities or []) + [None] * len(xml_ids))[: len(xml_ids)])
+        columns.note_offsets.append(len(columns.note_ids))
+    return columns
@@ -14,6 +14,9 @@ def generate_maps_result_json(corresp_string, attrs, output_file, threshold=5):
         attrs (dict): The Verovio notes data
         output_file (str): Path to write the output JSON file
         threshold (int): Alignment threshold in milliseconds (default=5)
+
+    Returns:
+        int: The number of inserted notes (performed notes that aren't in the score)
     """
     # Process corresp string
     corresp_string = corresp_string.replace("*", "-1")
@@ -109,6 +112,7 @@ def generate_maps_result_json(corresp_string, attrs, output_file, threshold=5):
         json.dump(maps_export, f)
 
     print(f"MAPS file written: {output_file}")
+    return len(inserted_notes)
 
 
 if __name__ == "__main__":
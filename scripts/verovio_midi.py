@@ -1,39 +1,118 @@
-import verovio
+import base64
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
 
+from .verovio_pool import VerovioLoadError, toolkit_pool
+
+# Number of renderings (one per score and expansion) to keep in memory in each process
+RENDERING_CACHE_SIZE = 32
+
+
+@dataclass
+class ScoreRendering:
+    """The canonical MIDI and note table of a score, rendered for one expansion"""
+
+    expansion: str | None
+    midi: bytes
+    notes: list[dict]
+
+
+_renderings = OrderedDict()
+_renderings_lock = threading.Lock()
+_rendering_stats = {"hits": 0, "misses": 0}
+
+
+def expansion_file_key(expansion):
+    """A name for an expansion that can be used in filenames. Rendering without an expansion is "none" """
+    if not expansion:
+        return "none"
+    return expansion.lstrip("#").replace("/", "_")
+
+
+def render_midi_and_notes(mei_data, expansion):
+    """Render the canonical MIDI of a score and the table of its notes, loading the score once.
+
+    Returns (MIDI file contents as bytes, list of notes), where each note is a dict
+    {"id": note id, "tstamp": onset in ms, "midiPitch": MIDI pitch}, in order of onset.
+
+    Pitches are looked up per note with getMIDIValuesForElement. Getting them from the MIDI file or the
+    timemap in bulk isn't reliable: tied notes are merged into one MIDI note, and notes in a chord have the
+    same onset so can't be told apart.
+    """
+    with toolkit_pool.toolkit(mei_data, expansion) as tk:
+        # must render to MIDI first or getMIDIValuesForElement won't work
+        midi = base64.b64decode(tk.renderToMIDI())
+        timemap = tk.renderToTimemap()
+        notes = [
+            {"id": note_id, "tstamp": event["tstamp"], "midiPitch": tk.getMIDIValuesForElement(note_id)["pitch"]}
+            for event in timemap
+            for note_id in event.get("on", [])
+        ]
+    return midi, notes
 
-def generate_notes_from_mei(mei_file, expansion):
-    verovio.enableLog(False)
-    tk = verovio.toolkit()
-    if expansion:
-        tk.setOptions({"expand": f"{expansion}"})
 
-    print("VERSION", tk.getVersion())
+def render_score(mei_data, expansion) -> ScoreRendering:
+    """Get the canonical MIDI and note table of a score for an expansion.
+
+    Renderings are cached per process by score and expansion, so that aligning against several
+    expansions of the same score (or several performances of it) only renders each expansion once.
+    Don't modify the returned rendering.
+    """
+    key = (hashlib.sha256(mei_data.encode("utf-8")).hexdigest(), expansion or None)
+    with _renderings_lock:
+        rendering = _renderings.get(key)
+        if rendering is not None:
+            _renderings.move_to_end(key)
+            _rendering_stats["hits"] += 1
+            return rendering
+        _rendering_stats["misses"] += 1
+
+    midi, notes = render_midi_and_notes(mei_data, expansion)
+    rendering = ScoreRendering(expansion=expansion or None, midi=midi, notes=notes)
+    with _renderings_lock:
+        _renderings[key] = rendering
+        while len(_renderings) > RENDERING_CACHE_SIZE:
+            _renderings.popitem(last=False)
+    return rendering
+
+
+def clear_rendering_cache():
+    with _renderings_lock:
+        _renderings.clear()
+
+
+def rendering_cache_stats():
+    with _renderings_lock:
+        return {"entries": len(_renderings), **_rendering_stats}
+
+
+def write_score_rendering(rendering: ScoreRendering, directory):
+    """Write the canonical MIDI and note table of a rendering to `directory`, named by its expansion
+    so that renderings of several expansions can be kept side by side.
+
+    Returns (canonical MIDI path, note table path)
+    """
+    file_key = expansion_file_key(rendering.expansion)
+    midi_file = os.path.join(directory, f"canonical.{file_key}.mid")
+    notes_file = os.path.join(directory, f"verovio_note_positions.{file_key}.json")
+    if not os.path.exists(midi_file):
+        with open(midi_file, "wb") as out:
+            out.write(rendering.midi)
+    if not os.path.exists(notes_file):
+        with open(notes_file, "w") as fp:
+            json.dump(rendering.notes, fp)
+    return midi_file, notes_file
+
+
+def generate_notes_from_mei(mei_file, expansion):
+    with open(mei_file, "r") as f:
+        mei_data = f.read()
     try:
-        tk.loadFile(mei_file)
-    except Exception:
+        return render_score(mei_data, expansion).notes
+    except VerovioLoadError:
         print(f"Python: Could not load MEI file: {mei_file}")
-
-    print("Python: Rendering to MIDI")
-    # must render to MIDI first or getMIDIValuesForElement won't work
-    tk.renderToMIDI()
-    print("Python: Rendering to Timemap")
-
-    timemap = tk.renderToTimemap()
-    allNotes = []
-    timemapNoteOns = list(filter(lambda x: "on" in x, timemap))
-
-    list(
-        map(
-            lambda x: list(
-                map(
-                    lambda y: allNotes.append(
-                        {"id": y, "tstamp": x["tstamp"], "midiPitch": tk.getMIDIValuesForElement(y)["pitch"]}
-                    ),
-                    x["on"],
-                )
-            ),
-            timemapNoteOns,
-        )
-    )
-
-    return allNotes
+        return []
@@ -0,0 +1,119 @@
+"""A per-process pool of verovio toolkits with MEI documents already loaded.
+
+Loading an MEI document is the slowest part of using verovio, and an alignment job renders the same
+score several times (canonical MIDI, timemap, expanded MEI). Toolkits are kept by (MEI hash, expansion)
+so that each score is loaded once per worker process, and the least recently used toolkits are dropped
+when the estimated memory use of the pool goes over a limit.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import verovio
+
+verovio.enableLog(False)
+
+# A loaded toolkit uses roughly this many times the size of the MEI source in memory
+TOOLKIT_MEMORY_FACTOR = 60
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Verovio only sets its resource (font) path for the thread that imports it, and loading resources or
+# data from several threads at once fails, so toolkits are created and loaded one at a time.
+RESOURCE_PATH = os.path.join(os.path.dirname(verovio.__file__), "data")
+_load_lock = threading.Lock()
+
+
+class VerovioLoadError(Exception):
+    pass
+
+
+class _PoolEntry:
+    def __init__(self, size):
+        self.size = size
+        self.toolkit = None
+        # A toolkit can only be used by one thread at a time
+        self.lock = threading.Lock()
+
+
+class VerovioToolkitPool:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(mei_data, expansion):
+        digest = hashlib.sha256(mei_data.encode("utf-8")).hexdigest()
+        return digest, expansion or None
+
+    def _evict(self, keep):
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            key, entry = next(iter(self._entries.items()))
+            if key == keep:
+                self._entries.move_to_end(key)
+                continue
+            del self._entries[key]
+            self._size -= entry.size
+            self.evictions += 1
+
+    @contextmanager
+    def toolkit(self, mei_data, expansion=None):
+        """Get a toolkit with `mei_data` loaded using the verovio `expand` option `expansion`.
+
+        The toolkit belongs to the pool and is reserved for the caller only inside this block.
+        Don't change options that affect loading (e.g. expand), or load other data into it.
+        """
+        key = self._key(mei_data, expansion)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _PoolEntry(len(mei_data) * TOOLKIT_MEMORY_FACTOR)
+                self._entries[key] = entry
+                self._size += entry.size
+                self.misses += 1
+                self._evict(keep=key)
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+
+        with entry.lock:
+            if entry.toolkit is None:
+                with _load_lock:
+                    tk = verovio.toolkit(False)
+                    tk.setResourcePath(RESOURCE_PATH)
+                    if expansion:
+                        tk.setOptions({"expand": expansion})
+                    loaded = tk.loadData(mei_data)
+                if not loaded:
+                    with self._lock:
+                        if self._entries.get(key) is entry:
+                            del self._entries[key]
+                            self._size -= entry.size
+                    raise VerovioLoadError("Verovio could not load the MEI data")
+                entry.toolkit = tk
+            yield entry.toolkit
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "estimated_bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+toolkit_pool = VerovioToolkitPool()
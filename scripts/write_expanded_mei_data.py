@@ -2,19 +2,17 @@ import argparse
 import requests
 import sys
 
-import json
-import verovio
-
-verovio.enableLog(False)
+try:
+    from .verovio_pool import toolkit_pool
+except ImportError:
+    # Run as a script from the scripts directory
+    from verovio_pool import toolkit_pool
 
 
 def write_expanded_mei_data(mei, fname, expansion):
-    vrv = verovio.toolkit()
-    if bool(expansion):
-        vrv.setOptions(json.dumps({"expand": expansion}))
-    vrv.loadData(mei)
-    print("writing mei to: ", fname)
-    vrv.saveFile(fname)
+    with toolkit_pool.toolkit(mei, expansion) as vrv:
+        print("writing mei to: ", fname)
+        vrv.saveFile(fname)
 
 
 if __name__ == "__main__":
@@ -6,7 +6,8 @@ from typing import Optional
 import requests
 
 from solidauth import client
-from trompaalign.solid import create_ldp_container, is_lock_expired_response
+from trompaalign.ratelimit import penalize_pod_host, pod_write_slot
+from trompaalign.solid import create_ldp_container, is_lock_expired_response, pod_session
 
 
 def _with_trailing_slash(uri: str) -> str:
@@ -21,7 +22,7 @@ def container_exists(solid_client: client.SolidClient, provider: str, profile: s
     uri = _with_trailing_slash(container_uri)
     try:
         headers = solid_client.get_bearer_for_user(provider, profile, uri, "HEAD")
-        r = requests.head(uri, headers=headers)
+        r = pod_session.head(uri, headers=headers)
         if r.status_code == 404:
             return False
         if r.ok:
@@ -32,7 +33,7 @@ def container_exists(solid_client: client.SolidClient, provider: str, profile: s
     try:
         headers = solid_client.get_bearer_for_user(provider, profile, uri, "GET")
         headers.update({"Accept": "text/turtle"})
-        r = requests.get(uri, headers=headers)
+        r = pod_session.get(uri, headers=headers)
         if r.status_code == 404:
             return False
         if r.ok:
@@ -117,11 +118,13 @@ def upload_file_to_pod(
     if content_type:
         headers["content-type"] = content_type
 
-    r = requests.put(remote_uri, data=content, headers=headers)
+    with pod_write_slot(remote_uri):
+        r = pod_session.put(remote_uri, data=content, headers=headers)
     try:
         r.raise_for_status()
     except requests.exceptions.HTTPError as e:
         if is_lock_expired_response(r):
+            penalize_pod_host(remote_uri)
             print(f"Warning: provider lock timeout, treating as success for {remote_uri}")
         else:
             print(f"Error uploading {remote_uri}: {e}")
@@ -1,18 +1,37 @@
 import importlib
 import json
-from dataclasses import asdict, is_dataclass
+from dataclasses import asdict, fields, is_dataclass
 from typing import Any
 
+import msgpack
 from kombu.serialization import register
 
 
 DATACLASS_MARKER = "__dataclass__"
+# msgpack extension type code for a dataclass, packed as [marker, {field name: value}]
+DATACLASS_EXT_CODE = 1
+
+# Dataclasses that can be returned from a task, keyed by their marker ("module.ClassName").
+# Only these types are decoded by the dataclass-msgpack serializer.
+RESULT_DATACLASSES: dict[str, type] = {}
+
+
+def _marker(cls: type) -> str:
+    return f"{cls.__module__}.{cls.__name__}"
+
+
+def register_result_dataclass(cls):
+    """Class decorator to allow a dataclass to be used as a task result"""
+    if not is_dataclass(cls):
+        raise TypeError(f"{cls} is not a dataclass")
+    RESULT_DATACLASSES[_marker(cls)] = cls
+    return cls
 
 
 def _default(obj: Any):
     if is_dataclass(obj):
         return {
-            DATACLASS_MARKER: f"{obj.__class__.__module__}.{obj.__class__.__name__}",
+            DATACLASS_MARKER: _marker(obj.__class__),
             "data": asdict(obj),
         }
     raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
@@ -22,9 +41,12 @@ def _object_hook(obj: dict):
     marker = obj.get(DATACLASS_MARKER)
     if not marker:
         return obj
-    module_name, class_name = marker.rsplit(".", 1)
-    module = importlib.import_module(module_name)
-    dataclass_type = getattr(module, class_name)
+    dataclass_type = RESULT_DATACLASSES.get(marker)
+    if dataclass_type is None:
+        # A dataclass that wasn't registered, e.g. a result stored by an older worker
+        module_name, class_name = marker.rsplit(".", 1)
+        module = importlib.import_module(module_name)
+        dataclass_type = getattr(module, class_name)
     return dataclass_type(**obj["data"])
 
 
@@ -36,6 +58,38 @@ def dataclass_loads(data: str) -> Any:
     return json.loads(data, object_hook=_object_hook)
 
 
+def _msgpack_default(obj: Any):
+    if is_dataclass(obj) and not isinstance(obj, type):
+        marker = _marker(obj.__class__)
+        if marker not in RESULT_DATACLASSES:
+            raise TypeError(f"Dataclass {marker} is not registered as a result dataclass")
+        # Fields are packed by name so that a worker and a client with different versions of the dataclass
+        # (reordered or added fields) agree on the values. Nested dataclasses become nested ext types
+        values = {field.name: getattr(obj, field.name) for field in fields(obj)}
+        return msgpack.ExtType(DATACLASS_EXT_CODE, msgpack.packb([marker, values], default=_msgpack_default))
+    raise TypeError(f"Object of type {type(obj)} is not msgpack serializable")
+
+
+def _msgpack_ext_hook(code: int, data: bytes):
+    if code != DATACLASS_EXT_CODE:
+        return msgpack.ExtType(code, data)
+    marker, values = msgpack.unpackb(data, ext_hook=_msgpack_ext_hook)
+    dataclass_type = RESULT_DATACLASSES.get(marker)
+    if dataclass_type is None:
+        raise TypeError(f"Dataclass {marker} is not registered as a result dataclass")
+    # Ignore fields that were added in a newer version of the dataclass, fields that are missing get their defaults
+    known_fields = {field.name for field in fields(dataclass_type) if field.init}
+    return dataclass_type(**{name: value for name, value in values.items() if name in known_fields})
+
+
+def dataclass_msgpack_dumps(obj: Any) -> bytes:
+    return msgpack.packb(obj, default=_msgpack_default)
+
+
+def dataclass_msgpack_loads(data: bytes) -> Any:
+    return msgpack.unpackb(data, ext_hook=_msgpack_ext_hook)
+
+
 register(
     "dataclass-json",
     dataclass_dumps,
@@ -43,3 +97,11 @@ register(
     content_type="application/json",
     content_encoding="utf-8",
 )
+
+register(
+    "dataclass-msgpack",
+    dataclass_msgpack_dumps,
+    dataclass_msgpack_loads,
+    content_type="application/x-dataclass-msgpack",
+    content_encoding="binary",
+)
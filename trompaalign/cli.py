@@ -25,6 +25,7 @@ from trompaalign.solid import (
     get_storage_from_profile,
     get_title_from_mei,
     http_options,
+    list_container,
     lookup_provider_from_profile,
     patch_container_item_title,
     recursive_delete_from_pod,
@@ -73,10 +74,9 @@ def cmd_list_containers_in_pod(profile, use_client_id_document):
     print(f"Storage: {storage}")
     print("Pod containers:")
     print(f"{provider=} {profile=}")
-    listing = get_pod_listing(cl, provider, profile, storage)
-    for item in listing["@graph"]:
-        if "ldp:BasicContainer" in item.get("@type", []):
-            print(" ", item.get("@id"))
+    for item in list_container(cl, provider, profile, storage):
+        if item.is_container:
+            print(" ", item.uri)
 
 
 @cli.command("list-container")
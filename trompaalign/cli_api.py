@@ -31,8 +31,9 @@ def cmd_add_score(profile, score_url, celery):
 @click.argument("profile")
 @click.argument("score_url")
 @click.argument("midi_file", type=click.File("rb"))
+@click.option("--expansion", help='Id of the MEI expansion to align against, or "auto" to choose the best one')
 @click.option("--celery", is_flag=True, help="Run the task in celery")
-def cmd_align(profile, score_url, midi_file, celery):
+def cmd_align(profile, score_url, midi_file, expansion, celery):
     """Align a score to a recording"""
 
     provider = lookup_provider_from_profile(profile)
@@ -47,10 +48,10 @@ def cmd_align(profile, score_url, midi_file, celery):
     print(f"Aligning score {score_url} to recording {midi_url} and {midi_url} for profile {profile}")
     label = datetime.now(timezone.utc).isoformat(timespec="seconds")
     if celery:
-        task = tasks.align_recording.delay(profile, score_url, webmidi_url, midi_url, label)
+        task = tasks.align_recording.delay(profile, score_url, webmidi_url, midi_url, label, expansion)
         print(f"Task created: {task.task_id}")
     else:
-        tasks.align_recording(profile, score_url, webmidi_url, midi_url, label)
+        tasks.align_recording(profile, score_url, webmidi_url, midi_url, label, expansion)
 
 
 @cli_api.command("refresh-all-tokens")
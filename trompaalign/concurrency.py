@@ -0,0 +1,52 @@
+import functools
+import http.cookiejar
+import threading
+
+import requests
+from flask import current_app, has_app_context
+
+
+def with_app_context(fn):
+    """Wrap `fn` so that it runs inside the current flask app context, for use in a worker thread.
+
+    Flask's app context (and so `current_app`, our extensions and the database session) is local to
+    the thread that pushed it. Each call pushes a new context for the same app, so threads don't share
+    a database session.
+    """
+    if not has_app_context():
+        return fn
+    app = current_app._get_current_object()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with app.app_context():
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+class ThreadLocalSession:
+    """A requests.Session for each thread, used like a Session.
+
+    requests doesn't guarantee that a Session can be used from more than one thread at a time, and pod
+    requests are made from thread pools (e.g. solid.create_and_save_structure). Each thread gets its own
+    session, so its own connection pool, with the given response hooks.
+    Sessions are shared by all the users and tasks of a thread, so they never store cookies: a cookie set by a
+    pod server or load balancer must not be sent with a later request made for another user.
+    """
+
+    def __init__(self, response_hooks=None):
+        self._local = threading.local()
+        self._response_hooks = list(response_hooks or [])
+
+    def session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+            session.hooks["response"].extend(self._response_hooks)
+            self._local.session = session
+        return session
+
+    def __getattr__(self, name):
+        return getattr(self.session(), name)
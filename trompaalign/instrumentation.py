@@ -0,0 +1,92 @@
+"""Hooks that send the stage measurements of an alignment (see scripts.stage_timing) to logs, prometheus
+metrics and sentry performance spans."""
+
+import logging
+import threading
+
+import sentry_sdk
+from flask import current_app
+
+from scripts.stage_timing import StageHook, StageSpan
+from trompaalign.metrics import stage_cpu, stage_duration, stage_failures, stage_peak_rss
+
+logger = logging.getLogger(__name__)
+
+
+class LoggingStageHook(StageHook):
+    def stage_finished(self, span: StageSpan):
+        logger.info(
+            "Stage %s: %.2fs wall, %.2fs cpu, %.2fs subprocess cpu, peak rss %.0f MB%s%s%s",
+            span.name,
+            span.wall_time,
+            span.cpu_time,
+            span.child_cpu_time,
+            span.peak_rss / 1024 / 1024,
+            f", {span.attributes}" if span.attributes else "",
+            f", exit codes {span.exit_codes}" if span.exit_codes else "",
+            f", failed: {span.error}" if span.error else "",
+        )
+
+
+class PrometheusStageHook(StageHook):
+    def stage_finished(self, span: StageSpan):
+        stage_duration.labels(span.name).observe(span.wall_time)
+        stage_cpu.labels(span.name).observe(span.cpu_time + span.child_cpu_time)
+        stage_peak_rss.labels(span.name).set(span.peak_rss)
+        if span.error:
+            stage_failures.labels(span.name).inc()
+
+
+class SentryStageHook(StageHook):
+    """Report each stage as a span of the current sentry transaction (the celery task).
+
+    Stages can run at the same time in other threads (see tasks.upload_concurrently), so spans are made with
+    start_child and finished explicitly instead of being entered as the scope's current span, which is
+    shared by the threads. A stage's parent is the stage that is running in the same thread, or the span
+    that was current when the hook was made.
+    """
+
+    def __init__(self):
+        self._parent = sentry_sdk.get_current_span()
+        self._local = threading.local()
+        self._spans = {}
+
+    def _open_spans(self):
+        if not hasattr(self._local, "spans"):
+            self._local.spans = []
+        return self._local.spans
+
+    def stage_started(self, span: StageSpan):
+        open_spans = self._open_spans()
+        parent = open_spans[-1] if open_spans else self._parent
+        if parent is None:
+            return
+        sentry_span = parent.start_child(op="alignment.stage", name=span.name)
+        open_spans.append(sentry_span)
+        self._spans[id(span)] = sentry_span
+
+    def stage_finished(self, span: StageSpan):
+        sentry_span = self._spans.pop(id(span), None)
+        if sentry_span is None:
+            return
+        open_spans = self._open_spans()
+        if sentry_span in open_spans:
+            open_spans.remove(sentry_span)
+        sentry_span.set_data("cpu_time", span.cpu_time)
+        sentry_span.set_data("child_cpu_time", span.child_cpu_time)
+        sentry_span.set_data("peak_rss", span.peak_rss)
+        sentry_span.set_data("exit_codes", span.exit_codes)
+        sentry_span.set_data("subprocess_times", span.subprocess_times)
+        for key, value in span.attributes.items():
+            sentry_span.set_data(key, value)
+        if span.error:
+            sentry_span.set_status("internal_error")
+        sentry_span.finish()
+
+
+def default_stage_hooks():
+    """The hooks for stages of tasks running in the current app"""
+    hooks = [LoggingStageHook(), PrometheusStageHook()]
+    if current_app.config["SENTRY_DSN"]:
+        hooks.append(SentryStageHook())
+    return hooks
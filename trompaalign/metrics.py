@@ -0,0 +1,187 @@
+"""Prometheus metrics for the webserver and the celery workers.
+
+The webserver exposes metrics at /metrics. Workers run their own exporter on TR_ALIGN_WORKER_METRICS_PORT.
+When the webserver or the workers run in several processes (gunicorn workers, celery prefork pool), set
+PROMETHEUS_MULTIPROC_DIR to an empty directory before starting them, so that the metrics of all processes
+are collected together.
+"""
+
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import flask
+from celery.signals import task_postrun, task_prerun, worker_init, worker_process_shutdown
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+from scripts import jsonld_loader, verovio_midi
+from scripts.verovio_pool import toolkit_pool
+
+logger = logging.getLogger(__name__)
+
+# Alignment stages and tasks take from under a second (rdf) to several minutes (smat_align on a long performance)
+STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+http_request_duration = Histogram(
+    "clara_http_request_duration_seconds", "Time to handle a request to the webserver", ["method", "route", "status"]
+)
+task_duration = Histogram(
+    "clara_task_duration_seconds", "Run time of a celery task", ["task", "state"], buckets=STAGE_BUCKETS
+)
+stage_duration = Histogram(
+    "clara_stage_duration_seconds", "Wall time of an alignment stage", ["stage"], buckets=STAGE_BUCKETS
+)
+stage_cpu = Histogram(
+    "clara_stage_cpu_seconds",
+    "CPU time of an alignment stage, including its subprocesses",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+stage_failures = Counter("clara_stage_failures_total", "Alignment stages that raised an exception", ["stage"])
+stage_peak_rss = Gauge(
+    "clara_stage_peak_rss_bytes",
+    "Peak RSS of the worker at the end of an alignment stage",
+    ["stage"],
+    multiprocess_mode="max",
+)
+pod_request_duration = Histogram(
+    "clara_pod_request_duration_seconds", "Time until the response headers of a request to a pod", ["host", "method"]
+)
+pod_responses = Counter("clara_pod_responses_total", "Responses to requests to pods", ["host", "method", "status"])
+cache_requests = Counter(
+    "clara_cache_requests_total",
+    "Lookups in an in-process cache. The hit ratio is rate(result=hit) / rate(all results)",
+    ["cache", "result"],
+)
+
+# In-process caches to report in cache_requests, by name. Each is a callable returning a dict with at least
+# "hits" and "misses" since the process started
+CACHES = {
+    "verovio_toolkits": toolkit_pool.stats,
+    "score_renderings": verovio_midi.rendering_cache_stats,
+    "jsonld_documents": jsonld_loader.cache_stats,
+}
+_reported_cache_stats = {}
+# update_cache_metrics is called from webserver threads and after tasks, a delta must only be counted once
+_reported_cache_stats_lock = threading.Lock()
+
+
+def register_cache(name, stats):
+    """Report the hits and misses of a cache. `stats` is a callable returning {"hits": int, "misses": int}"""
+    CACHES[name] = stats
+
+
+def update_cache_metrics():
+    """Add the hits and misses of each cache since the last update to cache_requests"""
+    with _reported_cache_stats_lock:
+        for name, stats in list(CACHES.items()):
+            current = stats()
+            previous = _reported_cache_stats.get(name, {"hits": 0, "misses": 0})
+            for key, result in (("hits", "hit"), ("misses", "miss")):
+                if current[key] > previous[key]:
+                    cache_requests.labels(name, result).inc(current[key] - previous[key])
+            _reported_cache_stats[name] = {"hits": current["hits"], "misses": current["misses"]}
+
+
+def observe_pod_response(response, *args, **kwargs):
+    """requests response hook which records the latency and status of a request to a pod"""
+    host = urlparse(response.url).netloc
+    method = response.request.method
+    pod_request_duration.labels(host, method).observe(response.elapsed.total_seconds())
+    pod_responses.labels(host, method, str(response.status_code)).inc()
+    return response
+
+
+class QueueDepthCollector(Collector):
+    """Number of tasks waiting in the celery queues, read from the redis broker when metrics are collected"""
+
+    def __init__(self, redis_client, queues):
+        self.redis_client = redis_client
+        self.queues = queues
+
+    def collect(self):
+        depth = GaugeMetricFamily("clara_queue_depth", "Tasks waiting in a celery queue", labels=["queue"])
+        for queue in self.queues:
+            depth.add_metric([queue], self.redis_client.llen(queue))
+        yield depth
+
+
+def metrics_registry():
+    """The registry to export. In multiprocess mode this collects the metrics written by every process"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def metrics_response(redis_client, queues):
+    update_cache_metrics()
+    queue_registry = CollectorRegistry()
+    queue_registry.register(QueueDepthCollector(redis_client, queues))
+    body = generate_latest(metrics_registry()) + generate_latest(queue_registry)
+    return flask.Response(body, content_type=CONTENT_TYPE_LATEST)
+
+
+_task_start_times = {}
+
+
+@task_prerun.connect
+def _task_started(task_id=None, **kwargs):
+    _task_start_times[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def _task_finished(task_id=None, task=None, state=None, **kwargs):
+    start = _task_start_times.pop(task_id, None)
+    if start is not None:
+        task_duration.labels(task.name, state or "UNKNOWN").observe(time.perf_counter() - start)
+    update_cache_metrics()
+
+
+@worker_process_shutdown.connect
+def _worker_process_shutdown(pid=None, **kwargs):
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+def init_app(app):
+    """Measure the requests handled by the app, and start the metrics exporter when it runs a celery worker"""
+
+    @app.before_request
+    def _start_request_timer():
+        flask.g.request_start_time = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        start = flask.g.pop("request_start_time", None)
+        if start is not None:
+            route = flask.request.url_rule.rule if flask.request.url_rule else "unmatched"
+            http_request_duration.labels(flask.request.method, route, str(response.status_code)).observe(
+                time.perf_counter() - start
+            )
+        return response
+
+    def start_worker_exporter(**kwargs):
+        port = app.config["WORKER_METRICS_PORT"]
+        if not port:
+            return
+        if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+            logger.warning("PROMETHEUS_MULTIPROC_DIR isn't set, metrics of tasks in pool processes won't be exported")
+        start_http_server(port, registry=metrics_registry())
+
+    worker_init.connect(start_worker_exporter, weak=False, dispatch_uid="trompaalign.metrics.worker_exporter")
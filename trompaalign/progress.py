@@ -0,0 +1,114 @@
+"""Stage-level progress events for long-running celery tasks.
+
+Tasks publish an event each time they enter a new stage (e.g. downloading, mei_to_midi, smat:<stage>).
+Events are appended to a short-lived history list in redis and published on a pub/sub channel, so that
+the webserver can stream them to the browser (see `progress_events`) instead of the browser polling
+for the task status.
+"""
+
+import json
+import logging
+import time
+
+import redis
+from celery import current_task
+from celery.signals import task_postrun
+
+from trompaalign.extensions import redis_client
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_KEY_PREFIX = "trompaalign:progress:"
+# How long to keep the event history of a task after its last event
+PROGRESS_HISTORY_TTL = 60 * 60
+
+# Stage name of the final event published when a task stops running
+STAGE_FINISHED = "finished"
+
+
+def _channel_name(task_id):
+    return f"{PROGRESS_KEY_PREFIX}{task_id}"
+
+
+def _history_key(task_id):
+    return f"{PROGRESS_KEY_PREFIX}{task_id}:history"
+
+
+def publish_progress(task_id, stage, **data):
+    """Record that a task has entered `stage`, and notify any listeners.
+
+    Each event gets an increasing sequence number so that listeners can de-duplicate events that they
+    see both in the history and on the channel.
+    Progress reporting is best-effort, a redis failure never fails the task.
+    """
+    event = {"task": task_id, "stage": stage, "time": time.time(), **data}
+    history_key = _history_key(task_id)
+    try:
+        event["seq"] = redis_client.incr(f"{history_key}:seq")
+        payload = json.dumps(event)
+        pipe = redis_client.pipeline()
+        pipe.rpush(history_key, payload)
+        pipe.expire(history_key, PROGRESS_HISTORY_TTL)
+        pipe.expire(f"{history_key}:seq", PROGRESS_HISTORY_TTL)
+        pipe.publish(_channel_name(task_id), payload)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("Unable to publish progress for task %s (%s): %s", task_id, stage, e)
+
+
+def task_progress_reporter():
+    """Return a callable `report(stage, **data)` that publishes progress for the currently running task.
+
+    If we're not running inside a celery worker (e.g. a task function is called directly from the CLI)
+    the stage is only logged.
+    """
+    task_id = None
+    if current_task and current_task.request and current_task.request.id:
+        task_id = current_task.request.id
+
+    def report(stage, **data):
+        logger.info("Stage: %s", stage)
+        if task_id is not None:
+            publish_progress(task_id, stage, **data)
+
+    return report
+
+
+@task_postrun.connect
+def _publish_task_finished(sender=None, task_id=None, state=None, **kwargs):
+    publish_progress(task_id, STAGE_FINISHED, state=state)
+
+
+def progress_events(task_id, keepalive_interval=15):
+    """Yield progress events for a task as they are published.
+
+    The history of events that happened before we started listening is yielded first.
+    Yields None every `keepalive_interval` seconds if there have been no events, so that the caller
+    can keep a connection alive or check if it should stop waiting.
+    Stops after the task's "finished" event.
+    """
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    # Subscribe before reading the history so that we don't miss events published in between
+    pubsub.subscribe(_channel_name(task_id))
+    try:
+        last_seq = 0
+        for payload in redis_client.lrange(_history_key(task_id), 0, -1):
+            event = json.loads(payload)
+            last_seq = event["seq"]
+            yield event
+            if event["stage"] == STAGE_FINISHED:
+                return
+        while True:
+            message = pubsub.get_message(timeout=keepalive_interval)
+            if message is None:
+                yield None
+                continue
+            event = json.loads(message["data"])
+            if event["seq"] <= last_seq:
+                continue
+            last_seq = event["seq"]
+            yield event
+            if event["stage"] == STAGE_FINISHED:
+                return
+    finally:
+        pubsub.close()
@@ -0,0 +1,155 @@
+"""Limit the rate and concurrency of writes to Solid pods, shared between all workers.
+
+Some Solid servers (e.g. solidcommunity.net) fail with "Lock expired" errors when they get too many
+concurrent writes. Every write to a pod is made inside `pod_write_slot`, which waits for both
+ - a token from a token bucket for the pod's host (limits the rate of writes), and
+ - one of a limited number of concurrent write slots for the host.
+State is kept in redis so that the limits apply across all celery workers and the webserver.
+
+Limiting is cooperative: if redis isn't available (e.g. outside of a flask app) writes aren't limited,
+and if we wait too long for a slot we log a warning and make the write anyway.
+"""
+
+import logging
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import redis
+from flask import current_app, has_app_context
+
+logger = logging.getLogger(__name__)
+
+RATELIMIT_KEY_PREFIX = "trompaalign:pod-ratelimit:"
+
+# Take a token from the bucket in KEYS[1] if one is available.
+# ARGV: rate (tokens/second), burst (bucket size).
+# Returns 0 if a token was taken, otherwise the number of seconds until one will be available
+_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 60)
+return tostring(wait)
+"""
+
+# Take one of ARGV[1] concurrent slots in the sorted set KEYS[1]. Slots are leased until a timeout, so
+# that a worker which dies while writing doesn't hold a slot forever.
+# ARGV: limit, lease id, lease length (seconds). Returns 1 if a slot was taken, otherwise 0
+_CONCURRENCY_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) < limit then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[2])
+    redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[3])) + 60)
+    return 1
+end
+return 0
+"""
+
+_scripts = {}
+
+
+def _get_redis():
+    if not has_app_context():
+        return None
+    flask_redis = current_app.extensions.get("redis")
+    if flask_redis is None:
+        return None
+    return flask_redis._redis_client
+
+
+def _get_script(client, source):
+    key = (id(client), source)
+    if key not in _scripts:
+        _scripts[key] = client.register_script(source)
+    return _scripts[key]
+
+
+def _host_keys(uri):
+    host = urlparse(uri).netloc
+    return f"{RATELIMIT_KEY_PREFIX}{host}:bucket", f"{RATELIMIT_KEY_PREFIX}{host}:slots"
+
+
+def _acquire(client, uri):
+    """Wait for a token and a write slot for the host of `uri`. Returns (slots key, lease id) if a slot was taken"""
+    config = current_app.config
+    bucket_key, slots_key = _host_keys(uri)
+    deadline = time.monotonic() + config["POD_WRITE_MAX_WAIT"]
+
+    token_bucket = _get_script(client, _TOKEN_BUCKET_SCRIPT)
+    while True:
+        wait = float(token_bucket(keys=[bucket_key], args=[config["POD_WRITE_RATE"], config["POD_WRITE_BURST"]]))
+        if wait <= 0:
+            break
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.warning("Waited too long for a write token for %s, writing anyway", uri)
+            return None
+        # Jitter so that waiting workers don't all retry at the same moment
+        time.sleep(min(remaining, wait + random.uniform(0, wait)))
+
+    concurrency = _get_script(client, _CONCURRENCY_SCRIPT)
+    lease_id = str(uuid.uuid4())
+    args = [config["POD_WRITE_CONCURRENCY"], lease_id, config["POD_WRITE_LEASE"]]
+    backoff = 0.05
+    while not concurrency(keys=[slots_key], args=args):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.warning("Waited too long for a write slot for %s, writing anyway", uri)
+            return None
+        time.sleep(min(remaining, backoff + random.uniform(0, backoff)))
+        backoff = min(backoff * 2, 1.0)
+    return slots_key, lease_id
+
+
+@contextmanager
+def pod_write_slot(uri):
+    """Wait until we are allowed to write to the pod that `uri` is on, and hold a write slot while in this block"""
+    client = _get_redis()
+    lease = None
+    if client is not None:
+        try:
+            lease = _acquire(client, uri)
+        except redis.RedisError as e:
+            logger.warning("Unable to get a pod write slot for %s, writing anyway: %s", uri, e)
+    try:
+        yield
+    finally:
+        if lease is not None:
+            slots_key, lease_id = lease
+            try:
+                client.zrem(slots_key, lease_id)
+            except redis.RedisError as e:
+                logger.warning("Unable to release pod write slot for %s: %s", uri, e)
+
+
+def penalize_pod_host(uri):
+    """Empty the token bucket of a host that is overloaded (e.g. returned a lock timeout),
+    so that all workers back off from writing to it for a while."""
+    client = _get_redis()
+    if client is None:
+        return
+    bucket_key, _ = _host_keys(uri)
+    try:
+        seconds, microseconds = client.time()
+        tokens = -current_app.config["POD_WRITE_BURST"]
+        client.hset(bucket_key, mapping={"tokens": str(tokens), "ts": str(seconds + microseconds / 1000000)})
+    except redis.RedisError as e:
+        logger.warning("Unable to penalize pod host for %s: %s", uri, e)
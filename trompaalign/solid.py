@@ -1,9 +1,11 @@
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 import io
 import json
 import logging
 import os
+import re
 import uuid
 from urllib.error import HTTPError
 
@@ -15,12 +17,23 @@ import requests.utils
 from pyld import jsonld
 from rdflib import URIRef
 
-from scripts.convert_to_rdf import generate_structural_segmentation, score_to_graph, segmentation_to_graph
-from scripts.namespace import MELD, MO, TL
+from scripts import jsonld_loader  # noqa: F401 (installs the JSON-LD document loader)
+from scripts.convert_to_rdf import generate_structural_segmentation, score_to_graph, segmentation_to_turtle
+from scripts.namespace import LDP, MAPS, MELD, MO, TL
+from scripts.timeline_chunks import TimelineChunkIndex
+from scripts.timeline_columns import TIMELINE_COLUMNS_CONTENT_TYPE, TimelineColumns
+from trompaalign.concurrency import ThreadLocalSession, with_app_context
 from trompaalign.mei import get_metadata_for_mei
+from trompaalign.metrics import observe_pod_response
+from trompaalign.ratelimit import penalize_pod_host, pod_write_slot
 
 logger = logging.getLogger(__name__)
 
+# Requests to pods and profiles use a session, so that connections to a pod host are reused and so that
+# the latency and status of every response is recorded in the pod request metrics. Each thread gets its own
+# session because requests are also made from thread pools
+pod_session = ThreadLocalSession(response_hooks=[observe_pod_response])
+
 
 class SolidError(Exception):
     pass
@@ -84,13 +97,15 @@ def create_ldp_container(
     if timeout is not None:
         request_kwargs["timeout"] = timeout
 
-    r = requests.put(container_uri, data=turtle_data.encode("utf-8"), headers=headers, **request_kwargs)
+    with pod_write_slot(container_uri):
+        r = pod_session.put(container_uri, data=turtle_data.encode("utf-8"), headers=headers, **request_kwargs)
     if r.status_code == 201:
         return container_uri
     try:
         r.raise_for_status()
     except requests.exceptions.HTTPError as e:
         if is_lock_expired_response(r):
+            penalize_pod_host(container_uri)
             print(f"Warning: provider lock timeout, treating container create as success for {container_uri}")
         else:
             print(f"Unexpected status creating container {container_uri}: {e}")
@@ -101,7 +116,7 @@ def create_ldp_container(
 
 def http_options(solid_client, provider, profile, container):
     headers = solid_client.get_bearer_for_user(provider, profile, container, "OPTIONS")
-    r = requests.options(container, headers=headers)
+    r = pod_session.options(container, headers=headers)
     r.raise_for_status()
     return r.headers, r.content
 
@@ -121,6 +136,76 @@ def get_pod_listing_ttl(solid_client, provider, profile, storage):
     return get_uri_ttl(storage, headers)
 
 
+@dataclass
+class ContainerItem:
+    uri: str
+    is_container: bool
+
+
+LDP_CONTAINS = "http://www.w3.org/ns/ldp#contains"
+LDP_CONTAINER_TYPES = {"http://www.w3.org/ns/ldp#Container", "http://www.w3.org/ns/ldp#BasicContainer"}
+RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+# Only triples whose subject, predicate and object are all IRIs are needed from a listing
+NTRIPLE_IRIS_RE = re.compile(r"^\s*<([^>]*)>\s*<([^>]*)>\s*<([^>]*)>\s*\.\s*$")
+
+
+def _container_items(triples, container_uri) -> list[ContainerItem]:
+    """The items in a container, from the (subject, predicate, object) IRIs of its listing.
+
+    An item is a container if the listing says that it's an ldp:Container, or (if the server doesn't
+    include the types of contained resources) if its URI ends in a /
+    """
+    contained = []
+    container_items = set()
+    for subject, predicate, obj in triples:
+        if predicate == LDP_CONTAINS and subject == container_uri:
+            contained.append(obj)
+        elif predicate == RDF_TYPE and obj in LDP_CONTAINER_TYPES:
+            container_items.add(subject)
+    return [ContainerItem(uri, uri in container_items or uri.endswith("/")) for uri in dict.fromkeys(contained)]
+
+
+def parse_container_ntriples(lines, container_uri) -> list[ContainerItem]:
+    """Get the items in a container from the lines of an N-Triples listing of the container.
+    Lines that can't be an ldp:contains or rdf:type triple are skipped without parsing them"""
+
+    def triples():
+        for line in lines:
+            if "#contains>" not in line and "#type>" not in line:
+                continue
+            match = NTRIPLE_IRIS_RE.match(line)
+            if match:
+                yield match.groups()
+
+    return _container_items(triples(), container_uri)
+
+
+def parse_container_turtle(data, container_uri) -> list[ContainerItem]:
+    """Get the items in a container from a Turtle listing of the container"""
+    graph = rdflib.Graph()
+    graph.parse(data=data, format="turtle", publicID=container_uri)
+    triples = ((str(s), str(p), str(o)) for s, p, o in graph if p in (LDP.contains, RDF.type))
+    return _container_items(triples, container_uri)
+
+
+def list_container(solid_client, provider, profile, container) -> list[ContainerItem]:
+    """List the resources in a container on a pod.
+
+    Asks for N-Triples, which is read line by line as it is received, without building a graph or compacting
+    JSON-LD. This is much faster than get_pod_listing for containers with thousands of items (midi/,
+    timelines/). Servers that can't return N-Triples return Turtle, which is parsed with rdflib.
+    """
+    headers = solid_client.get_bearer_for_user(provider, profile, container, "GET")
+    headers["Accept"] = "application/n-triples, text/turtle;q=0.9"
+    with pod_session.get(container, headers=headers, stream=True) as r:
+        r.raise_for_status()
+        content_type = r.headers.get("content-type", "").split(";")[0].strip()
+        if content_type == "application/n-triples":
+            r.encoding = "utf-8"
+            return parse_container_ntriples(r.iter_lines(decode_unicode=True), container)
+        return parse_container_turtle(r.content, container)
+
+
 def _parse_acl_link_from_headers(headers):
     """Return ACL URI from Link headers if present, else None."""
     links = headers.get("Link")
@@ -153,7 +238,7 @@ def discover_acl_uri(solid_client, provider, profile, resource_uri):
     try:
         headers = solid_client.get_bearer_for_user(provider, profile, resource_uri, "HEAD")
         logger.debug("HEAD %s with headers: %s", resource_uri, headers)
-        r = requests.head(resource_uri, headers=headers)
+        r = pod_session.head(resource_uri, headers=headers)
         # Some servers may not allow HEAD; ignore failures and try OPTIONS
         logger.debug("HEAD status: %s, headers: %s", r.status_code, r.headers)
         if r.ok:
@@ -190,7 +275,7 @@ def _head_for_etag(solid_client, provider, profile, uri):
     try:
         headers = solid_client.get_bearer_for_user(provider, profile, uri, "HEAD")
         logger.debug("Probing ETag via HEAD %s with headers: %s", uri, headers)
-        r = requests.head(uri, headers=headers)
+        r = pod_session.head(uri, headers=headers)
         logger.debug("HEAD status: %s, headers: %s", r.status_code, r.headers)
         if r.status_code == 404:
             logger.debug("HEAD indicates ACL does not exist: %s", uri)
@@ -205,7 +290,7 @@ def _head_for_etag(solid_client, provider, profile, uri):
             headers = solid_client.get_bearer_for_user(provider, profile, uri, "GET")
             headers.update({"Accept": "text/turtle"})
             logger.debug("Probing ETag via GET %s with headers: %s", uri, headers)
-            r = requests.get(uri, headers=headers)
+            r = pod_session.get(uri, headers=headers)
             logger.debug("GET status: %s, headers: %s", r.status_code, r.headers)
             if r.status_code == 404:
                 return False, None
@@ -322,7 +407,8 @@ def _put_document_with_preconditions(
         headers["If-Match"] = etag
     if not existing:
         headers["If-None-Match"] = "*"
-    r = requests.put(resource_uri, data=content_bytes, headers=headers)
+    with pod_write_slot(resource_uri):
+        r = pod_session.put(resource_uri, data=content_bytes, headers=headers)
     if r.status_code == 412:
         raise SolidError("Update failed due to precondition (ETag mismatch). Reload and retry.")
     r.raise_for_status()
@@ -366,7 +452,8 @@ def delete_resource(solid_client, provider, profile, resource_uri: str):
         requests.HTTPError: If the deletion fails
     """
     headers = solid_client.get_bearer_for_user(provider, profile, resource_uri, "DELETE")
-    r = requests.delete(resource_uri, headers=headers)
+    with pod_write_slot(resource_uri):
+        r = pod_session.delete(resource_uri, headers=headers)
     r.raise_for_status()
     return r
 
@@ -381,7 +468,8 @@ def delete_acl_for_resource(solid_client, provider, profile, resource_uri: str):
     headers = solid_client.get_bearer_for_user(provider, profile, acl_uri, "DELETE")
     if etag:
         headers["If-Match"] = etag
-    r = requests.delete(acl_uri, headers=headers)
+    with pod_write_slot(acl_uri):
+        r = pod_session.delete(acl_uri, headers=headers)
     if r.status_code == 412:
         raise SolidError("ACL delete failed due to precondition (ETag mismatch). Reload and retry.")
     r.raise_for_status()
@@ -413,7 +501,8 @@ def patch_container_item_title(solid_client, provider, profile, container, item,
   <{item}> <http://purl.org/dc/terms/title> "{title}" .
 }}"""
 
-    r = requests.patch(container, data=update_data, headers=headers)
+    with pod_write_slot(container):
+        r = pod_session.patch(container, data=update_data, headers=headers)
     r.raise_for_status()
     print(r.text)
     print(f"Status: {r.status_code}")
@@ -471,7 +560,7 @@ def get_resource_from_pod(solid_client, provider, profile, uri, accept=None):
     headers = solid_client.get_bearer_for_user(provider, profile, uri, "GET")
     if accept:
         headers.update({"Accept": accept})
-    r = requests.get(uri, headers=headers)
+    r = pod_session.get(uri, headers=headers)
     r.raise_for_status()
     return r.content
 
@@ -489,7 +578,8 @@ def create_clara_container(solid_client, provider, profile, storage):
     }
     type_headers = {"Accept": "application/ld+json", "content-type": "application/ld+json"}
     headers.update(type_headers)
-    r = requests.put(clara_container, data=json.dumps(container_payload), headers=headers)
+    with pod_write_slot(clara_container):
+        r = pod_session.put(clara_container, data=json.dumps(container_payload), headers=headers)
     if r.status_code == 201:
         print("Successfully created")
     else:
@@ -503,7 +593,7 @@ def lookup_provider_from_profile(profile_url: str):
     :return:
     """
 
-    r = requests.options(profile_url)
+    r = pod_session.options(profile_url)
     r.raise_for_status()
     links = r.headers.get("Link")
     if links:
@@ -551,7 +641,8 @@ def upload_mei_to_pod(solid_client, provider, profile, storage, payload):
     headers = solid_client.get_bearer_for_user(provider, profile, resource, "PUT")
     # TODO: Should this be an XML mimetype, or a specific MEI one?
     headers["content-type"] = "application/xml"
-    r = requests.put(resource, data=payload.encode("utf-8"), headers=headers)
+    with pod_write_slot(resource):
+        r = pod_session.put(resource, data=payload.encode("utf-8"), headers=headers)
     r.raise_for_status()
     print(r.text)
     return resource
@@ -563,7 +654,8 @@ def upload_webmidi_to_pod(solid_client, provider, profile, storage, payload: byt
     print(f"Uploading webmidi file to {resource}")
     headers = solid_client.get_bearer_for_user(provider, profile, resource, "PUT")
     headers["content-type"] = "application/json"
-    r = requests.put(resource, data=payload, headers=headers)
+    with pod_write_slot(resource):
+        r = pod_session.put(resource, data=payload, headers=headers)
     r.raise_for_status()
     print("status:", r.text)
     return resource
@@ -574,7 +666,8 @@ def upload_midi_to_pod(solid_client, provider, profile, storage, payload: bytes)
     print(f"Uploading midi file to {resource}")
     headers = solid_client.get_bearer_for_user(provider, profile, resource, "PUT")
     headers["content-type"] = "audio/midi"
-    r = requests.put(resource, data=payload, headers=headers)
+    with pod_write_slot(resource):
+        r = pod_session.put(resource, data=payload, headers=headers)
     r.raise_for_status()
     print("status:", r.text)
     return resource
@@ -584,7 +677,8 @@ def upload_mp3_to_pod(solid_client, provider, profile, resource, payload: bytes)
     print(f"Uploading mp3 file to {resource}")
     headers = solid_client.get_bearer_for_user(provider, profile, resource, "PUT")
     headers["content-type"] = "audio/mpeg"
-    r = requests.put(resource, data=payload, headers=headers)
+    with pod_write_slot(resource):
+        r = pod_session.put(resource, data=payload, headers=headers)
     r.raise_for_status()
     print("status:", r.text)
     return resource
@@ -592,15 +686,13 @@ def upload_mp3_to_pod(solid_client, provider, profile, resource, payload: bytes)
 
 def find_score_for_external_uri(solid_client, provider, profile, storage, mei_external_uri):
     resource = os.path.join(storage, CLARA_CONTAINER_NAME, "scores/")
-    score_listing = get_pod_listing(solid_client, provider, profile, resource)
-    contents = get_contents_of_container_rdf(score_listing, resource)
-    for item in contents:
-        file = get_resource_from_pod(solid_client, provider, profile, item)
+    for item in list_container(solid_client, provider, profile, resource):
+        file = get_resource_from_pod(solid_client, provider, profile, item.uri)
         graph = rdflib.Graph()
         graph.parse(file)
         matches = list(graph.triples((None, MO.published_as, URIRef(mei_external_uri))))
         if len(matches):
-            return item
+            return item.uri
 
 
 def list_external_score_urls(solid_client, provider, profile, storage):
@@ -609,10 +701,7 @@ def list_external_score_urls(solid_client, provider, profile, storage):
     Iterates over all resources in the scores container and extracts values of mo:published_as.
     """
     resource = os.path.join(storage, CLARA_CONTAINER_NAME, "scores/")
-    score_listing = get_pod_listing(solid_client, provider, profile, resource)
-    if score_listing is None:
-        return set()
-    contents = get_contents_of_container(score_listing, resource)
+    contents = [item.uri for item in list_container(solid_client, provider, profile, resource)]
     external_urls = set()
     for item in contents:
         try:
@@ -694,10 +783,7 @@ def list_score_urls(solid_client, provider, profile, storage):
     Returns a list of Score objects
     """
     resource = os.path.join(storage, CLARA_CONTAINER_NAME, "scores/")
-    score_listing = get_pod_listing(solid_client, provider, profile, resource)
-    if score_listing is None:
-        return []
-    contents = get_contents_of_container(score_listing, resource)
+    contents = [item.uri for item in list_container(solid_client, provider, profile, resource)]
     print("contents", contents)
     return contents
 
@@ -709,8 +795,7 @@ def list_performance_urls(solid_client, provider, profile, storage, performances
         performances_container: the URI of the performances container (from Score.performances_container)
     """
 
-    contents = get_contents_of_container(performances_container, performances_container)
-    return contents
+    return [item.uri for item in list_container(solid_client, provider, profile, performances_container)]
 
 
 @dataclass
@@ -722,6 +807,10 @@ class Performance:
     derived_from: str
     timeline: str
     offset: str | None = None
+    # Columnar copy of the timeline (see scripts/timeline_columns.py), only for performances aligned since it was added
+    timeline_columns: str | None = None
+    # Index of the chunks of the timeline (see scripts/timeline_chunks.py), only for long performances
+    timeline_chunks: str | None = None
 
 
 def load_performance_from_uri(solid_client, provider, profile, uri: str) -> Performance:
@@ -735,6 +824,8 @@ def load_performance_from_uri(solid_client, provider, profile, uri: str) -> Perf
     derived_from = None
     timeline = None
     offset = None
+    timeline_columns = None
+    timeline_chunks = None
 
     triples = list(graph.triples((uri_ref, RDF.type, MO.Performance)))
     if not triples:
@@ -755,6 +846,14 @@ def load_performance_from_uri(solid_client, provider, profile, uri: str) -> Perf
         print("offset", o)
         break
 
+    for _s, _p, o in graph.triples((uri_ref, MAPS.timelineColumns, None)):
+        timeline_columns = str(o)
+        break
+
+    for _s, _p, o in graph.triples((uri_ref, MAPS.timelineChunks, None)):
+        timeline_chunks = str(o)
+        break
+
     if signal_uri:
         signal_ref = URIRef(signal_uri)
         for _s, _p, o in graph.triples((signal_ref, MO.available_as, None)):
@@ -784,12 +883,42 @@ def load_performance_from_uri(solid_client, provider, profile, uri: str) -> Perf
         derived_from=derived_from,
         timeline=timeline,
         offset=offset,
+        timeline_columns=timeline_columns,
+        timeline_chunks=timeline_chunks,
     )
 
 
+# Responses to a PATCH from servers that don't support SPARQL UPDATE patches (or that can't parse ours)
+PATCH_UNSUPPORTED_STATUSES = {400, 405, 415, 422, 501}
+
+
+def _patch_insert_data(solid_client, provider, profile, resource_uri, graph: rdflib.Graph) -> bool:
+    """Add the triples in `graph` to a resource with a SPARQL UPDATE `INSERT DATA` patch, creating the resource
+    if it doesn't exist. Only the new triples are sent, and triples which are already in the resource aren't
+    duplicated, so concurrent inserts don't overwrite each other.
+
+    Returns False if the server doesn't accept the patch, so that the caller can fall back to a PUT.
+    """
+    headers = solid_client.get_bearer_for_user(provider, profile, resource_uri, "PATCH")
+    headers["content-type"] = "application/sparql-update"
+    # No PREFIX declarations, node-solid-server's patch parser doesn't support them (see patch_container_item_title)
+    triples = "\n".join(f"  {s.n3()} {p.n3()} {o.n3()} ." for s, p, o in graph)
+    update_data = f"INSERT DATA {{\n{triples}\n}}"
+    with pod_write_slot(resource_uri):
+        r = pod_session.patch(resource_uri, data=update_data.encode("utf-8"), headers=headers)
+    if r.status_code in PATCH_UNSUPPORTED_STATUSES:
+        logger.info("PATCH of %s failed with status %s, falling back to PUT: %s", resource_uri, r.status_code, r.text)
+        return False
+    r.raise_for_status()
+    return True
+
+
 def update_score_list_bulk(solid_client, provider, profile, storage, external_urls: set[str]) -> tuple[int, int]:
     """Add multiple external URLs to the scores list in a single write.
 
+    The new schema:itemListElement triples are added with a PATCH. Servers that don't accept the PATCH get
+    the whole list with a PUT instead.
+
     Returns (added_count, total_after).
     """
     graph, _etag_ignored, score_data_resource = _get_score_list(solid_client, provider, profile, storage)
@@ -814,6 +943,14 @@ def update_score_list_bulk(solid_client, provider, profile, storage, external_ur
             )
         return 0, len(existing_urls)
 
+    # The type and name of the list are included so that the PATCH creates the list if it doesn't exist yet. If it
+    # does, they're already in it and aren't added again
+    new_triples = _get_empty_score_list_graph(score_data_resource)
+    for url in to_add:
+        _add_score_to_list(new_triples, score_data_resource, url)
+    if _patch_insert_data(solid_client, provider, profile, score_data_resource, new_triples):
+        return len(to_add), len(existing_urls) + len(to_add)
+
     for url in to_add:
         _add_score_to_list(graph, score_data_resource, url)
 
@@ -849,7 +986,7 @@ def _get_score_list(solid_client, provider, profile, storage):
     try:
         headers = solid_client.get_bearer_for_user(provider, profile, score_data_resource, "GET")
         headers["Accept"] = "text/turtle"
-        r = requests.get(score_data_resource, headers=headers)
+        r = pod_session.get(score_data_resource, headers=headers)
         r.raise_for_status()
         etag = r.headers.get("ETag")
         graph = rdflib.Graph()
@@ -890,6 +1027,25 @@ def add_score_to_list(solid_client, provider, profile, storage, mei_external_uri
     return added > 0
 
 
+def _turtle_put_headers(solid_client, provider, profile, resource):
+    headers = solid_client.get_bearer_for_user(provider, profile, resource, "PUT")
+    headers["content-type"] = "text/turtle"
+    return headers
+
+
+def _put_structure_turtle(resource, data, headers, description):
+    print(f"Making {description}:", resource)
+    with pod_write_slot(resource):
+        r = pod_session.put(resource, data=data, headers=headers, timeout=10)
+    try:
+        r.raise_for_status()
+    except requests.exceptions.HTTPError as e:
+        print(f"Error making {description}: {e}")
+        raise e
+    finally:
+        print(r.text)
+
+
 def create_and_save_structure(
     solid_client, provider, profile, storage, title, mei_payload: str, mei_external_uri, mei_copy_uri
 ):
@@ -918,49 +1074,33 @@ def create_and_save_structure(
     mei_io.seek(0)
 
     segmentation = generate_structural_segmentation(mei_io)
-    segmentation_graph = segmentation_to_graph(segmentation, segment_resource)
+    segmentation_data = segmentation_to_turtle(segmentation, segment_resource)
     score_graph = score_to_graph(
         score_resource, segment_resource, performance_resource, mei_external_uri, mei_copy_uri, title
     )
 
-    segmentation_data = segmentation_graph.serialize(format="n3", encoding="utf-8")
     score_data = score_graph.serialize(format="n3", encoding="utf-8")
 
+    # The containers, score and segments don't depend on each other, so they are written at the same time. The
+    # bearers for the score and segments are made here first, so that if the access token has to be refreshed
+    # it's refreshed once, before the threads ask for their bearers.
+    score_headers = _turtle_put_headers(solid_client, provider, profile, score_resource)
+    segment_headers = _turtle_put_headers(solid_client, provider, profile, segment_resource)
     print("Making performance container:", performance_resource)
-    create_ldp_container(solid_client, provider, profile, performance_resource, timeout=10)
-
     print("Making timeline container:", timeline_resource)
-    create_ldp_container(solid_client, provider, profile, timeline_resource, timeout=10)
-
-    print("Making score:", score_resource)
-    headers = solid_client.get_bearer_for_user(provider, profile, score_resource, "PUT")
-    headers["content-type"] = "text/turtle"
-    r = requests.put(score_resource, data=score_data, headers=headers, timeout=10)
-    try:
-        r.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        print(f"Error making score: {e}")
-        print(r.text)
-        raise e
-    finally:
-        print(r.text)
-    print(r.text)
-
-    print("Making segment:", segment_resource)
-    headers = solid_client.get_bearer_for_user(provider, profile, segment_resource, "PUT")
-    headers["content-type"] = "text/turtle"
-    r = requests.put(segment_resource, data=segmentation_data, headers=headers, timeout=10)
-    try:
-        r.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        print(f"Error making segment: {e}")
-        print(r.text)
-        raise e
-    finally:
-        print(r.text)
-    print(r.text)
-
-    # Add the external MEI URL to the scores list
+    create_container = with_app_context(create_ldp_container)
+    put_turtle = with_app_context(_put_structure_turtle)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [
+            executor.submit(create_container, solid_client, provider, profile, performance_resource, timeout=10),
+            executor.submit(create_container, solid_client, provider, profile, timeline_resource, timeout=10),
+            executor.submit(put_turtle, score_resource, score_data, score_headers, "score"),
+            executor.submit(put_turtle, segment_resource, segmentation_data, segment_headers, "segment"),
+        ]
+        for future in futures:
+            future.result()
+
+    # Add the external MEI URL to the scores list, only once everything that the score refers to exists
     try:
         added, _total = update_score_list_bulk(solid_client, provider, profile, storage, {mei_external_uri})
         if added == 0:
@@ -985,19 +1125,21 @@ def get_uri_jsonld(uri, headers=None):
     if not headers:
         headers = {}
     headers.update({"Accept": "application/ld+json"})
-    r = requests.get(uri, headers=headers)
+    r = pod_session.get(uri, headers=headers)
     r.raise_for_status()
+    data = r.json()
     logger.debug("Get json-ld from %s", uri)
     logger.debug("json-ld headers: %s", r.headers)
-    logger.debug("json-ld content: %s", json.dumps(r.json(), indent=2))
-    return r.json(), r.headers
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("json-ld content: %s", json.dumps(data, indent=2))
+    return data, r.headers
 
 
 def get_uri_ttl(uri, headers=None):
     if not headers:
         headers = {}
     headers.update({"Accept": "text/turtle"})
-    r = requests.get(uri, headers=headers)
+    r = pod_session.get(uri, headers=headers)
     r.raise_for_status()
     return r.text
 
@@ -1018,48 +1160,55 @@ def save_performance_manifest(solid_client, provider, profile, performance_uri,
     print(f"Uploading manifest to {performance_uri}")
     headers = solid_client.get_bearer_for_user(provider, profile, performance_uri, "PUT")
     headers["content-type"] = "text/turtle"
-    r = requests.put(performance_uri, data=manifest, headers=headers)
+    with pod_write_slot(performance_uri):
+        r = pod_session.put(performance_uri, data=manifest, headers=headers)
     r.raise_for_status()
     print("save_performance_manifest status:", r.text)
 
 
+def save_timeline_columns(solid_client, provider, profile, columns_uri, columns: TimelineColumns):
+    print(f"Uploading timeline columns to {columns_uri}")
+    headers = solid_client.get_bearer_for_user(provider, profile, columns_uri, "PUT")
+    headers["content-type"] = TIMELINE_COLUMNS_CONTENT_TYPE
+    with pod_write_slot(columns_uri):
+        r = pod_session.put(columns_uri, data=columns.to_json(), headers=headers)
+    r.raise_for_status()
+    print("save_timeline_columns status:", r.text)
+
+
+def save_timeline_chunk_index(solid_client, provider, profile, index_uri, index: TimelineChunkIndex):
+    print(f"Uploading timeline chunk index to {index_uri}")
+    headers = solid_client.get_bearer_for_user(provider, profile, index_uri, "PUT")
+    headers["content-type"] = "application/json"
+    with pod_write_slot(index_uri):
+        r = pod_session.put(index_uri, data=index.to_json(), headers=headers)
+    r.raise_for_status()
+    print("save_timeline_chunk_index status:", r.text)
+
+
 def save_performance_timeline(solid_client, provider, profile, timeline_uri, timeline):
     print(f"Uploading timeline to {timeline_uri}")
     headers = solid_client.get_bearer_for_user(provider, profile, timeline_uri, "PUT")
     headers["content-type"] = "application/ld+json"
-    r = requests.put(timeline_uri, data=json.dumps(timeline).encode("utf-8"), headers=headers)
+    with pod_write_slot(timeline_uri):
+        r = pod_session.put(timeline_uri, data=json.dumps(timeline).encode("utf-8"), headers=headers)
     r.raise_for_status()
     print("save_performance_timeline status:", r.text)
 
 
 def recursive_delete_from_pod(solid_client, provider, profile, container):
     """
-    A container listing has 2 types of data returned from a query:
-     - the information about the container itself (has an ldp:contains section with
-         all items in that container)
-     - the information about each item in ldp:contains (including its @type)
-
-    So, we loop through all items. If it's an ldp:Container (and not the main ID), recurse into it
-    otherwise, just delete it.
+    Loop through all items in the container. If it's a container, recurse into it, otherwise just delete it.
     After recursing into it, delete the container itself, as it'll be empty.
     """
-    listing = get_pod_listing(solid_client, provider, profile, container)
-    if listing is None:
-        # If listing is None, just delete the container itself
-        delete_resource(solid_client, provider, profile, container)
-        return
-    for item in listing.get("@graph", []):
-        item_id = item["@id"]
-        # First item is ourselves, skip it
-        if item_id == container:
-            continue
-        if "ldp:Container" in item["@type"]:
+    for item in list_container(solid_client, provider, profile, container):
+        if item.is_container:
             # If the container has other containers, delete them
-            recursive_delete_from_pod(solid_client, provider, profile, item["@id"])
+            recursive_delete_from_pod(solid_client, provider, profile, item.uri)
         else:
             # Otherwise it's just a file, delete it.
-            print(f"Delete file {item_id}")
-            delete_resource(solid_client, provider, profile, item_id)
+            print(f"Delete file {item.uri}")
+            delete_resource(solid_client, provider, profile, item.uri)
     # Finally, delete the container itself
     delete_resource(solid_client, provider, profile, container)
 
@@ -1146,11 +1295,9 @@ def delete_duplicate_scores(solid_client, provider, profile, storage, delete_emp
         try:
             logger.debug("Getting performances for container: %s", score.performances_container)
             # Get the listing for the performances container
-            listing = get_pod_listing(solid_client, provider, profile, score.performances_container)
-            if listing is None:
-                performance_urls = []
-            else:
-                performance_urls = get_contents_of_container(listing, score.performances_container)
+            performance_urls = list_performance_urls(
+                solid_client, provider, profile, storage, score.performances_container
+            )
         except Exception as e:
             logger.warning("Error getting performances for score %s: %s", score.uri, e)
             print(f"Error getting performances for score {score.uri}: {e}")
@@ -0,0 +1,29 @@
+"""Temporary storage for files uploaded to the webserver that are processed by a celery task.
+
+The webserver shouldn't make slow requests to a user's pod while handling a request, so uploaded files
+are put in redis and the task that processes them is responsible for saving them to the pod.
+"""
+
+import uuid
+
+from trompaalign.extensions import redis_client
+
+STAGED_UPLOAD_KEY_PREFIX = "trompaalign:staged-upload:"
+# Keep staged files for long enough that they survive a backlog of queued tasks
+STAGED_UPLOAD_TTL = 24 * 60 * 60
+
+
+def stage_upload(payload: bytes) -> str:
+    """Store an uploaded file and return the key to retrieve it with"""
+    key = STAGED_UPLOAD_KEY_PREFIX + str(uuid.uuid4())
+    redis_client.set(key, payload, ex=STAGED_UPLOAD_TTL)
+    return key
+
+
+def get_staged_upload(key: str) -> bytes | None:
+    """Get the contents of a staged file, or None if it has expired"""
+    return redis_client.get(key)
+
+
+def delete_staged_upload(key: str):
+    redis_client.delete(key)
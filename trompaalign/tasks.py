@@ -1,10 +1,16 @@
+import base64
+import io
 import json
 import logging
 import os
+import random
 import tempfile
+import time
 import urllib.error
 import uuid
-from dataclasses import dataclass
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 
 from flask import current_app
 import rdflib
@@ -13,19 +19,25 @@ from celery import shared_task
 from rdflib import RDF, SKOS, URIRef
 
 from scripts.convert_to_rdf import graph_to_jsonld, graph_to_turtle
-from scripts.midi_events_to_file import midi_json_to_midi
-from scripts.namespace import MO
+from scripts.midi_events_to_file import webmidi_to_midi
+from scripts.namespace import MAPS, MO
 from scripts.performance_alignment_workflow import perform_workflow
 from scripts.smat_align import SmatException
+from scripts.stage_timing import StageRecorder, StageSpan
 from solidauth import client
-from trompaalign import celery_serializers  # noqa: F401
+from trompaalign.celery_serializers import register_result_dataclass
+from trompaalign.concurrency import with_app_context
 from trompaalign.extensions import backend
+from trompaalign.instrumentation import default_stage_hooks
 from trompaalign.mei import mei_is_valid
+from trompaalign.progress import task_progress_reporter
+from trompaalign.staging import delete_staged_upload, get_staged_upload
 from trompaalign.solid import (
     CLARA_CONTAINER_NAME,
     SolidError,
     create_and_save_structure,
     create_clara_container,
+    delete_resource,
     score_exists_in_list,
     get_pod_listing,
     get_resource_from_pod,
@@ -34,9 +46,12 @@ from trompaalign.solid import (
     lookup_provider_from_profile,
     save_performance_manifest,
     save_performance_timeline,
+    save_timeline_chunk_index,
+    save_timeline_columns,
     upload_mei_to_pod,
     upload_midi_to_pod,
     upload_mp3_to_pod,
+    upload_webmidi_to_pod,
 )
 
 
@@ -57,39 +72,141 @@ class AlignmentFailed(Exception):
         self.midi_url = midi_url
 
 
+@register_result_dataclass
 @dataclass
 class PerformanceResult:
     id: str
     uri: str
     timeline_uri: str
     audio_uri: str
+    timeline_columns_uri: str | None = None
+    timeline_chunks_uri: str | None = None
 
 
+register_result_dataclass(StageSpan)
+
+
+@register_result_dataclass
 @dataclass
 class AlignRecordingResult:
     performance: PerformanceResult
+    # Time and resources used by each stage of the alignment
+    stages: list[StageSpan] = field(default_factory=list)
 
 
-@shared_task(ignore_result=False)
-def refresh_all_authentication_tokens():
-    """Refresh all authentication tokens for all users."""
-    for configuration in backend.backend.get_configuration_tokens():
-        provider = configuration.issuer
-        profile = configuration.profile
+def _access_token_expiry(configuration) -> float | None:
+    """Return the expiry time (unix timestamp) of the access token in a configuration token, if we can tell.
+
+    Solid-OIDC access tokens are JWTs, so we read the `exp` claim. We don't verify the signature, it's only used
+    to decide if the token should be refreshed.
+    """
+    data = getattr(configuration, "data", None)
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except ValueError:
+            return None
+    if not isinstance(data, dict):
+        return None
+    access_token = data.get("access_token")
+    if not isinstance(access_token, str) or access_token.count(".") != 2:
+        return None
+    payload = access_token.split(".")[1]
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _refresh_tokens_for_issuer(provider, use_client_id_document, profiles, min_interval, jitter):
+    """Refresh tokens for all of the given profiles of a single provider, one at a time.
+
+    All refreshes share a SolidClient, so that provider metadata is only fetched once, and are spaced at least
+    `min_interval` seconds apart (plus a random jitter) so that we don't send a burst of requests to the provider.
+    """
+    cl = client.SolidClient(backend.backend, use_client_id_document)
+    stats = {"refreshed": 0, "failed": 0, "errors": 0, "latencies": []}
+    last_request = None
+    for profile in profiles:
+        wait = random.uniform(0, jitter)
+        if last_request is not None:
+            wait += max(0.0, min_interval - (time.monotonic() - last_request))
+        time.sleep(wait)
+        last_request = time.monotonic()
         logger.info(f"Refreshing token for {profile} from {provider}")
-        # Dynamic registration has a FK to the registration record. If we used a client id document then
-        # the FK is null and the client_id is the URL of the client id document.
-        use_client_id_document = configuration.client_registration is None
-        cl = client.SolidClient(backend.backend, use_client_id_document)
         # shouldn't get NoSuchAuthenticationError because we just got the configuration tokens from the backend
         try:
             # This will refresh if it's expired
             cl.get_valid_access_token(provider, profile)
-            logger.info(" ... done")
+            stats["refreshed"] += 1
+            logger.info(f" ... done {profile}")
         except client.TokenRefreshFailed:
             # Unable to refresh, give up and just delete it.
             logger.error(f"Token refresh failed for {profile}, deleting")
             backend.backend.delete_configuration_token(provider, profile, use_client_id_document)
+            stats["failed"] += 1
+        except Exception as e:
+            # Something unexpected (e.g. provider is down), try again next time
+            logger.exception(f"Error refreshing token for {profile}: {e}")
+            stats["errors"] += 1
+        stats["latencies"].append(time.monotonic() - last_request)
+    return stats
+
+
+@shared_task(ignore_result=False)
+def refresh_all_authentication_tokens():
+    """Refresh authentication tokens for all users.
+
+    Tokens with an access token that is still valid until after the next run of this task are skipped
+    without contacting their provider. The remaining tokens are grouped by provider. Providers are refreshed in parallel, but the tokens for a single
+    provider are refreshed one by one, with a rate limit.
+    Returns a summary of the number of tokens refreshed and the time that it took.
+    """
+    config = current_app.config
+    refresh_before = time.time() + config["TOKEN_REFRESH_EXPIRY_MARGIN"]
+
+    groups = defaultdict(list)
+    skipped = 0
+    for configuration in backend.backend.get_configuration_tokens():
+        expiry = _access_token_expiry(configuration)
+        if expiry is not None and expiry > refresh_before:
+            skipped += 1
+            continue
+        # Dynamic registration has a FK to the registration record. If we used a client id document then
+        # the FK is null and the client_id is the URL of the client id document.
+        use_client_id_document = configuration.client_registration is None
+        groups[(configuration.issuer, use_client_id_document)].append(configuration.profile)
+
+    summary = {"providers": len(groups), "skipped": skipped, "refreshed": 0, "failed": 0, "errors": 0}
+    latencies = []
+    refresh_for_issuer = with_app_context(_refresh_tokens_for_issuer)
+    with ThreadPoolExecutor(max_workers=config["TOKEN_REFRESH_WORKERS"]) as executor:
+        futures = {
+            executor.submit(
+                refresh_for_issuer,
+                provider,
+                use_client_id_document,
+                profiles,
+                config["TOKEN_REFRESH_PROVIDER_INTERVAL"],
+                config["TOKEN_REFRESH_JITTER"],
+            ): provider
+            for (provider, use_client_id_document), profiles in groups.items()
+        }
+        for future in as_completed(futures):
+            stats = future.result()
+            logger.info(
+                f"Provider {futures[future]}: {stats['refreshed']} refreshed, {stats['failed']} failed, "
+                f"{stats['errors']} errors"
+            )
+            for key in ("refreshed", "failed", "errors"):
+                summary[key] += stats[key]
+            latencies.extend(stats["latencies"])
+
+    summary["mean_latency"] = sum(latencies) / len(latencies) if latencies else 0.0
+    summary["max_latency"] = max(latencies, default=0.0)
+    logger.info(f"Token refresh complete: {summary}")
+    return summary
 
 
 @shared_task(ignore_result=False)
@@ -114,6 +231,7 @@ def add_score(profile, mei_external_uri):
     :return:
     """
 
+    report_progress = task_progress_reporter()
     use_client_id_document = current_app.config["ALWAYS_USE_CLIENT_URL"]
     cl = client.SolidClient(backend.backend, use_client_id_document)
 
@@ -141,6 +259,7 @@ def add_score(profile, mei_external_uri):
         # Non-fatal: continue with normal flow
         pass
 
+    report_progress("downloading")
     try:
         headers = {"User-Agent": "Clara (https://github.com/trompamusic/clara)"}
         r = requests.get(mei_external_uri, headers=headers, timeout=10)
@@ -156,19 +275,22 @@ def add_score(profile, mei_external_uri):
 
     filename = os.path.basename(mei_external_uri)
     title = get_title_from_mei(mei_text, filename)
+    report_progress("upload")
     mei_copy_uri = upload_mei_to_pod(cl, provider, profile, storage, mei_text)
 
     return create_and_save_structure(cl, provider, profile, storage, title, mei_text, mei_external_uri, mei_copy_uri)
 
 
 @shared_task(ignore_result=False)
-def align_recording(profile, score_url, webmidi_url, midi_url, label):
+def align_recording(profile, score_url, webmidi_url, midi_url, label, expansion=None):
     """
 
     :param profile:
     :param score_url: the URL of our "score" RDF document
     :param webmidi_url: The URL of the uploaded webmidi file, or None if there is only a midi file
     :param midi_url: should be set only if webmidi is None
+    :param expansion: id of the MEI expansion to align against, None to use the score without expanding it,
+       or "auto" to choose the expansion that best matches the performance
     :return:
     """
 
@@ -184,10 +306,122 @@ def align_recording(profile, score_url, webmidi_url, midi_url, label):
     use_client_id_document = current_app.config["ALWAYS_USE_CLIENT_URL"]
     cl = client.SolidClient(backend.backend, use_client_id_document)
 
+    return run_alignment(cl, provider, profile, storage, score_url, webmidi_url, midi_url, label, expansion=expansion)
+
+
+@shared_task(ignore_result=False)
+def align_staged_recording(profile, score_url, staged_key, midi_type, label, expansion=None):
+    """Save a performance that the webserver staged in redis to the user's pod, and then align it.
+
+    This lets the /api/align endpoint return without waiting for the user's pod.
+
+    :param profile:
+    :param score_url: the URL of our "score" RDF document
+    :param staged_key: the key of the uploaded performance file, from `stage_upload`
+    :param midi_type: "webmidi" or "midi", the type of the uploaded file
+    :param expansion: id of the MEI expansion to align against, None to use the score without expanding it,
+       or "auto" to choose the expansion that best matches the performance
+    :return:
+    """
+
+    report_progress = task_progress_reporter()
+    provider = lookup_provider_from_profile(profile)
+    if not provider:
+        logger.error("Cannot find provider, quitting")
+        return
+    storage = get_storage_from_profile(profile)
+    if not storage:
+        logger.error("Cannot find storage, quitting")
+        return
+
+    use_client_id_document = current_app.config["ALWAYS_USE_CLIENT_URL"]
+    cl = client.SolidClient(backend.backend, use_client_id_document)
+
+    payload = get_staged_upload(staged_key)
+    if payload is None:
+        raise SolidError("The uploaded performance expired before it could be processed, please try again")
+
+    report_progress("upload_performance")
+    try:
+        if midi_type == "webmidi":
+            webmidi_url = upload_webmidi_to_pod(cl, provider, profile, storage, payload)
+            midi_url = None
+        else:
+            midi_url = upload_midi_to_pod(cl, provider, profile, storage, payload)
+            webmidi_url = None
+    except requests.exceptions.RequestException as e:
+        raise SolidError(f"Unable to save the performance to your pod: {e}")
+    delete_staged_upload(staged_key)
+
+    return run_alignment(
+        cl,
+        provider,
+        profile,
+        storage,
+        score_url,
+        webmidi_url,
+        midi_url,
+        label,
+        expansion=expansion,
+        performance_payload=payload,
+    )
+
+
+def upload_concurrently(cl, provider, profile, recorder, uploads):
+    """Run uploads at the same time, each measured as its own stage.
+
+    :param uploads: list of (stage name, resources that it writes, function that writes them)
+
+    If any upload fails, all of the resources are deleted (in the order that they are listed, so list the
+    resource that makes the others visible first), and the first error is raised.
+    """
+
+    def run(name, upload):
+        with recorder.stage(name):
+            upload()
+
+    run = with_app_context(run)
+    errors = []
+    with ThreadPoolExecutor(max_workers=len(uploads)) as executor:
+        futures = {executor.submit(run, name, upload): name for name, _resources, upload in uploads}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Upload {futures[future]} failed: {e}")
+                errors.append(e)
+    if not errors:
+        return
+
+    for _name, resources, _upload in uploads:
+        for resource in resources:
+            try:
+                delete_resource(cl, provider, profile, resource)
+            except requests.exceptions.HTTPError as e:
+                # 404 if the upload of this resource failed or never started
+                if e.response is None or e.response.status_code != 404:
+                    logger.warning(f"Unable to delete {resource} after a failed upload: {e}")
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Unable to delete {resource} after a failed upload: {e}")
+    raise errors[0]
+
+
+def run_alignment(
+    cl, provider, profile, storage, score_url, webmidi_url, midi_url, label, expansion=None, performance_payload=None
+) -> AlignRecordingResult:
+    """Align a performance that has been uploaded to the user's pod against a score, and save the results.
+
+    :param performance_payload: the contents of the webmidi or midi file, if we already have it, so that
+       we don't have to download it again
+    """
+    report_progress = task_progress_reporter()
+    recorder = StageRecorder(default_stage_hooks())
     clara_container = os.path.join(storage, CLARA_CONTAINER_NAME)
 
     with tempfile.TemporaryDirectory() as td:
-        score = get_resource_from_pod(cl, provider, profile, score_url)
+        report_progress("downloading")
+        with recorder.stage("download_score"):
+            score = get_resource_from_pod(cl, provider, profile, score_url)
         graph = rdflib.Graph()
         graph.parse(data=score, format="n3")
         # e.g., find all triples where `<someuri> a mo:score`
@@ -217,33 +451,41 @@ def align_recording(profile, score_url, webmidi_url, midi_url, label):
                 f"Cannot find location of performance container given the score resource {score_url}"
             )
 
-        mei_content = get_resource_from_pod(cl, provider, profile, external_mei_url)
+        with recorder.stage("download_mei") as span:
+            mei_content = get_resource_from_pod(cl, provider, profile, external_mei_url)
+            span.attributes["mei_bytes"] = len(mei_content)
 
         mei_file = os.path.join(td, "score.mei")
         with open(mei_file, "wb") as fp:
             fp.write(mei_content)
 
-        if webmidi_url is not None:
-            logger.info("Converting webmidi to midi and uploading")
-            webmidi = get_resource_from_pod(cl, provider, profile, webmidi_url)
-            midi = midi_json_to_midi(json.loads(webmidi.decode("utf-8")))
-            midi_file = os.path.join(td, "performance.mid")
-            midi.save(midi_file)
-            midi_url = upload_midi_to_pod(cl, provider, profile, storage, open(midi_file, "rb").read())
-        else:
-            logger.info("only got a midi URL, using it directly")
-            midi_contents = get_resource_from_pod(cl, provider, profile, midi_url)
-            midi_file = os.path.join(td, "performance.mid")
-            with open(midi_file, "wb") as fp:
-                fp.write(midi_contents)
+        with recorder.stage("prepare_performance", webmidi=webmidi_url is not None):
+            if webmidi_url is not None:
+                logger.info("Converting webmidi to midi and uploading")
+                if performance_payload is not None:
+                    webmidi = performance_payload
+                else:
+                    webmidi = get_resource_from_pod(cl, provider, profile, webmidi_url)
+                midi = webmidi_to_midi(io.BytesIO(webmidi))
+                midi_file = os.path.join(td, "performance.mid")
+                midi.save(midi_file)
+                midi_url = upload_midi_to_pod(cl, provider, profile, storage, open(midi_file, "rb").read())
+            else:
+                logger.info("only got a midi URL, using it directly")
+                if performance_payload is not None:
+                    midi_contents = performance_payload
+                else:
+                    midi_contents = get_resource_from_pod(cl, provider, profile, midi_url)
+                midi_file = os.path.join(td, "performance.mid")
+                with open(midi_file, "wb") as fp:
+                    fp.write(midi_contents)
 
-        expansion = None
         audio_container = os.path.join(clara_container, "audio")
         perf_fname = str(uuid.uuid4())
         audio_fname = str(uuid.uuid4()) + ".mp3"
 
         try:
-            performance_graph, timeline_graph = perform_workflow(
+            performance_graph, timeline_graph, timeline_columns, timeline_chunks = perform_workflow(
                 midi_file,
                 mei_file,
                 expansion,
@@ -256,21 +498,19 @@ def align_recording(profile, score_url, webmidi_url, midi_url, label):
                 perf_fname,
                 audio_fname,
                 label,
+                progress=report_progress,
+                recorder=recorder,
             )
 
             performance_resource = os.path.join(performance_container, perf_fname)
             logger.info(f"Performance resource: {performance_resource}")
             timeline_resource = os.path.join(timeline_container, perf_fname)
             logger.info(f"Timeline resource: {timeline_resource}")
+            timeline_columns_resource = f"{timeline_resource}.columns.json"
+            timeline_chunks_resource = f"{timeline_resource}.chunks.json" if timeline_chunks else None
 
-            audio_resource = os.path.join(audio_container, audio_fname)
-            mp3_uri = upload_mp3_to_pod(
-                cl,
-                provider,
-                profile,
-                audio_resource,
-                open(os.path.join(td, audio_fname), "rb").read(),
-            )
+            report_progress("upload")
+            mp3_uri = os.path.join(audio_container, audio_fname)
 
             # Add triples for Signal->Midi and Midi->webmidi
             performance_graph.add((URIRef(midi_url), RDF.type, MO.Signal))
@@ -280,12 +520,67 @@ def align_recording(profile, score_url, webmidi_url, midi_url, label):
             performance_graph.add((performance_signal_ref, MO.derived_from, URIRef(midi_url)))
             if webmidi_url:
                 performance_graph.add((URIRef(midi_url), MO.derived_from, URIRef(webmidi_url)))
-
-            performance_document = graph_to_turtle(performance_graph)
-            timeline_document = graph_to_jsonld(timeline_graph, mei_uri=external_mei_url, tl_uri=timeline_resource)
-
-            save_performance_manifest(cl, provider, profile, performance_resource, performance_document)
-            save_performance_timeline(cl, provider, profile, timeline_resource, timeline_document)
+            # Clients that only need onsets and notes can load the columns instead of the timeline
+            performance_graph.add(
+                (URIRef(performance_resource), MAPS.timelineColumns, URIRef(timeline_columns_resource))
+            )
+            # Long timelines are also uploaded in chunks, so that clients can fetch the parts that they need
+            if timeline_chunks:
+                performance_graph.add(
+                    (URIRef(performance_resource), MAPS.timelineChunks, URIRef(timeline_chunks_resource))
+                )
+
+            with recorder.stage("serialize", triples=len(timeline_graph)):
+                performance_document = graph_to_turtle(performance_graph)
+                timeline_document = graph_to_jsonld(timeline_graph, mei_uri=external_mei_url, tl_uri=timeline_resource)
+                chunk_documents = []
+                if timeline_chunks:
+                    chunk_index, chunk_graphs = timeline_chunks
+                    for chunk, chunk_graph in zip(chunk_index.chunks, chunk_graphs):
+                        chunk_document = graph_to_jsonld(
+                            chunk_graph, mei_uri=external_mei_url, tl_uri=timeline_resource
+                        )
+                        chunk_documents.append((chunk.uri, chunk_document))
+
+            def upload_mp3():
+                with open(os.path.join(td, audio_fname), "rb") as fp:
+                    upload_mp3_to_pod(cl, provider, profile, mp3_uri, fp.read())
+
+            def upload_chunks():
+                # Upload the chunks before the index which refers to them
+                for chunk_uri, chunk_document in chunk_documents:
+                    save_performance_timeline(cl, provider, profile, chunk_uri, chunk_document)
+                save_timeline_chunk_index(cl, provider, profile, timeline_chunks_resource, chunk_index)
+
+            # The manifest and the timeline don't wait for the mp3, which is much larger. The performance is
+            # listed as soon as its manifest is written, so it's deleted first if another upload fails.
+            uploads = [
+                (
+                    "upload_manifest",
+                    [performance_resource],
+                    lambda: save_performance_manifest(
+                        cl, provider, profile, performance_resource, performance_document
+                    ),
+                ),
+                (
+                    "upload_timeline",
+                    [timeline_resource],
+                    lambda: save_performance_timeline(cl, provider, profile, timeline_resource, timeline_document),
+                ),
+                (
+                    "upload_timeline_columns",
+                    [timeline_columns_resource],
+                    lambda: save_timeline_columns(cl, provider, profile, timeline_columns_resource, timeline_columns),
+                ),
+                ("upload_mp3", [mp3_uri], upload_mp3),
+            ]
+            if timeline_chunks:
+                chunk_resources = [timeline_chunks_resource] + [uri for uri, _document in chunk_documents]
+                uploads.append(("upload_timeline_chunks", chunk_resources, upload_chunks))
+            # Get a bearer on this thread first, so that if the access token has to be refreshed it's refreshed
+            # once, before the uploads ask for their bearers
+            cl.get_bearer_for_user(provider, profile, performance_resource, "PUT")
+            upload_concurrently(cl, provider, profile, recorder, uploads)
         except Exception as exc:
             if isinstance(exc, SmatException):
                 message = f"SMAT failed during {exc.stage}: {exc}"
@@ -299,7 +594,10 @@ def align_recording(profile, score_url, webmidi_url, midi_url, label):
                 uri=performance_resource,
                 timeline_uri=timeline_resource,
                 audio_uri=mp3_uri,
-            )
+                timeline_columns_uri=timeline_columns_resource,
+                timeline_chunks_uri=timeline_chunks_resource,
+            ),
+            stages=recorder.spans,
         )
 
     return result_payload
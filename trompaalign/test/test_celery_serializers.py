@@ -0,0 +1,103 @@
+from dataclasses import asdict, dataclass, field
+
+import pytest
+
+from trompaalign import celery_serializers
+from trompaalign.celery_serializers import (
+    dataclass_dumps,
+    dataclass_loads,
+    dataclass_msgpack_dumps,
+    dataclass_msgpack_loads,
+    register_result_dataclass,
+)
+
+
+@register_result_dataclass
+@dataclass
+class ExamplePerformance:
+    id: str
+    uri: str
+    audio_uri: str | None
+
+
+@register_result_dataclass
+@dataclass
+class ExampleResult:
+    performance: ExamplePerformance
+
+
+@dataclass
+class UnregisteredResult:
+    id: str
+
+
+def _task_meta(result):
+    """A result as it's stored by the celery redis backend"""
+    return {
+        "status": "SUCCESS",
+        "result": result,
+        "traceback": None,
+        "children": [],
+        "date_done": "2025-01-01T12:00:00.000000+00:00",
+        "task_id": "4c5c1f6a-7bd0-4a4e-9f5a-8f0a5c5c0e6b",
+    }
+
+
+def test_msgpack_round_trip_matches_json():
+    result = ExampleResult(
+        performance=ExamplePerformance(
+            id="perf-1", uri="https://pod.example/perf-1.ttl", audio_uri="https://pod.example/perf-1.mp3"
+        )
+    )
+    meta = _task_meta(result)
+
+    from_msgpack = dataclass_msgpack_loads(dataclass_msgpack_dumps(meta))
+    from_json = dataclass_loads(dataclass_dumps(meta))
+
+    assert from_msgpack["result"] == result
+    assert isinstance(from_msgpack["result"].performance, ExamplePerformance)
+    assert asdict(from_msgpack["result"]) == asdict(from_json["result"])
+    assert {k: v for k, v in from_msgpack.items() if k != "result"} == {
+        k: v for k, v in from_json.items() if k != "result"
+    }
+
+
+def test_msgpack_is_smaller_than_json():
+    result = ExampleResult(
+        performance=ExamplePerformance(id="perf-1", uri="https://pod.example/perf-1.ttl", audio_uri=None)
+    )
+    meta = _task_meta(result)
+    assert len(dataclass_msgpack_dumps(meta)) < len(dataclass_dumps(meta).encode("utf-8"))
+
+
+def test_msgpack_plain_values():
+    # Values returned by tasks that aren't dataclasses, and exceptions as stored by celery
+    for value in [None, "https://pod.example/container/", {"exc_type": "SolidError", "exc_message": ["failed"]}]:
+        assert dataclass_msgpack_loads(dataclass_msgpack_dumps(_task_meta(value))) == _task_meta(value)
+
+
+def test_msgpack_unregistered_dataclass():
+    with pytest.raises(TypeError):
+        dataclass_msgpack_dumps(UnregisteredResult(id="x"))
+
+
+def test_msgpack_fields_are_decoded_by_name(monkeypatch):
+    data = dataclass_msgpack_dumps(
+        ExamplePerformance(id="perf-1", uri="https://pod.example/perf-1.ttl", audio_uri=None)
+    )
+
+    # A newer version of the dataclass on the other side, with the fields in a different order and a new field
+    @dataclass
+    class NewerExamplePerformance:
+        uri: str
+        audio_uri: str | None
+        id: str
+        timeline_uri: str | None = None
+        tags: list = field(default_factory=list)
+
+    marker = f"{ExamplePerformance.__module__}.{ExamplePerformance.__name__}"
+    monkeypatch.setitem(celery_serializers.RESULT_DATACLASSES, marker, NewerExamplePerformance)
+
+    assert dataclass_msgpack_loads(data) == NewerExamplePerformance(
+        uri="https://pod.example/perf-1.ttl", audio_uri=None, id="perf-1"
+    )
@@ -0,0 +1,78 @@
+import threading
+
+import pytest
+import sentry_sdk
+from sentry_sdk.integrations.threading import ThreadingIntegration
+from sentry_sdk.transport import Transport
+
+from scripts.stage_timing import StageRecorder, StageSpan
+from trompaalign.instrumentation import SentryStageHook
+
+
+class CaptureTransport(Transport):
+    def __init__(self):
+        super().__init__()
+        self.events = []
+
+    def capture_envelope(self, envelope):
+        for item in envelope.items:
+            if item.type == "transaction":
+                self.events.append(item.payload.json)
+
+
+@pytest.fixture
+def transport():
+    transport = CaptureTransport()
+    # Threads don't get a copy of the scope, so the spans can't rely on the scope's current span
+    sentry_sdk.init(
+        dsn="https://key@sentry.example.org/1",
+        traces_sample_rate=1.0,
+        transport=transport,
+        integrations=[ThreadingIntegration(propagate_scope=False)],
+    )
+    yield transport
+    sentry_sdk.init()
+
+
+def test_sentry_spans_of_concurrent_stages(transport):
+    barrier = threading.Barrier(2)
+
+    def upload(recorder, name):
+        with recorder.stage(name):
+            barrier.wait(timeout=5)
+
+    with sentry_sdk.start_transaction(op="celery.task", name="align_recording") as transaction:
+        recorder = StageRecorder([SentryStageHook()])
+        with recorder.stage("prepare"):
+            with recorder.stage("mei_to_midi"):
+                pass
+        threads = [threading.Thread(target=upload, args=(recorder, name)) for name in ["upload_mp3", "upload_timeline"]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sentry_sdk.get_current_span() is transaction
+
+    sentry_sdk.flush()
+    [event] = transport.events
+    spans = {span["description"]: span for span in event["spans"]}
+    root = event["contexts"]["trace"]["span_id"]
+    assert spans["prepare"]["parent_span_id"] == root
+    assert spans["mei_to_midi"]["parent_span_id"] == spans["prepare"]["span_id"]
+    assert spans["upload_mp3"]["parent_span_id"] == root
+    assert spans["upload_timeline"]["parent_span_id"] == root
+
+
+def test_sentry_spans_finishing_out_of_order(transport):
+    with sentry_sdk.start_transaction(op="celery.task", name="align_recording") as transaction:
+        hook = SentryStageHook()
+        mp3, timeline = StageSpan(name="upload_mp3"), StageSpan(name="upload_timeline")
+        hook.stage_started(mp3)
+        hook.stage_started(timeline)
+        hook.stage_finished(mp3)
+        hook.stage_finished(timeline)
+        assert sentry_sdk.get_current_span() is transaction
+
+    sentry_sdk.flush()
+    [event] = transport.events
+    assert sorted(span["description"] for span in event["spans"]) == ["upload_mp3", "upload_timeline"]
@@ -0,0 +1,78 @@
+import datetime
+import threading
+import time
+
+import requests
+from prometheus_client import CollectorRegistry, generate_latest
+
+from trompaalign import metrics
+
+
+def _sample(name, labels):
+    return metrics.REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_update_cache_metrics_counts_new_lookups(monkeypatch):
+    stats = {"hits": 3, "misses": 1}
+    monkeypatch.setitem(metrics.CACHES, "test_cache", lambda: stats)
+
+    metrics.update_cache_metrics()
+    stats["hits"] = 5
+    metrics.update_cache_metrics()
+    metrics.update_cache_metrics()
+
+    assert _sample("clara_cache_requests_total", {"cache": "test_cache", "result": "hit"}) == 5
+    assert _sample("clara_cache_requests_total", {"cache": "test_cache", "result": "miss"}) == 1
+
+
+def test_update_cache_metrics_from_threads(monkeypatch):
+    class SlowDict(dict):
+        """Gives other threads time to run between reading the last reported stats and updating them"""
+
+        def get(self, *args):
+            value = super().get(*args)
+            time.sleep(0.01)
+            return value
+
+    stats = {"hits": 0, "misses": 0}
+    monkeypatch.setitem(metrics.CACHES, "threaded_cache", lambda: stats)
+    monkeypatch.setattr(metrics, "_reported_cache_stats", SlowDict())
+    metrics.update_cache_metrics()
+    before = _sample("clara_cache_requests_total", {"cache": "threaded_cache", "result": "hit"})
+    stats["hits"] = 10
+
+    threads = [threading.Thread(target=metrics.update_cache_metrics) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert _sample("clara_cache_requests_total", {"cache": "threaded_cache", "result": "hit"}) == before + 10
+
+
+def test_observe_pod_response():
+    response = requests.Response()
+    response.url = "https://pod.example.org/alice/at.ac.mdw.trompa/scores/"
+    response.status_code = 412
+    response.elapsed = datetime.timedelta(seconds=0.25)
+    response.request = requests.Request("PUT", response.url).prepare()
+    labels = {"host": "pod.example.org", "method": "PUT"}
+    before = _sample("clara_pod_request_duration_seconds_sum", labels)
+
+    metrics.observe_pod_response(response)
+
+    assert _sample("clara_pod_request_duration_seconds_sum", labels) == before + 0.25
+    assert _sample("clara_pod_responses_total", {**labels, "status": "412"}) >= 1
+
+
+def test_queue_depth_collector():
+    class FakeRedis:
+        def llen(self, key):
+            return {"celery": 4}.get(key, 0)
+
+    registry = CollectorRegistry()
+    registry.register(metrics.QueueDepthCollector(FakeRedis(), ["celery", "other"]))
+
+    output = generate_latest(registry).decode()
+    assert 'clara_queue_depth{queue="celery"} 4.0' in output
+    assert 'clara_queue_depth{queue="other"} 0.0' in output
@@ -0,0 +1,85 @@
+import json
+import logging
+
+import fakeredis
+import pytest
+from celery.signals import task_postrun
+
+# trompaalign.extensions needs solidauth, which is installed from git
+pytest.importorskip("solidauth")
+
+from trompaalign import progress  # noqa: E402
+from trompaalign.progress import progress_events, publish_progress  # noqa: E402
+
+TASK_ID = "6a1c5ee2-3a1e-4c4e-9a59-4f3d1d1e6b52"
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(progress, "redis_client", fakeredis.FakeStrictRedis(server=server))
+    return server
+
+
+def _history(task_id=TASK_ID):
+    return [json.loads(payload) for payload in progress.redis_client.lrange(progress._history_key(task_id), 0, -1)]
+
+
+def _next_event(events):
+    # Skip keepalives
+    return next(event for event in events if event is not None)
+
+
+def test_publish_progress_keeps_a_history(server):
+    publish_progress(TASK_ID, "downloading")
+    publish_progress(TASK_ID, "smat:midi2pr", expansion="A")
+
+    events = _history()
+    assert [(event["stage"], event["seq"]) for event in events] == [("downloading", 1), ("smat:midi2pr", 2)]
+    assert events[1]["task"] == TASK_ID
+    assert events[1]["expansion"] == "A"
+    assert 0 < progress.redis_client.ttl(progress._history_key(TASK_ID)) <= progress.PROGRESS_HISTORY_TTL
+
+
+def test_progress_events_stops_at_finished_history(server):
+    publish_progress(TASK_ID, "downloading")
+    task_postrun.send(sender=None, task_id=TASK_ID, state="SUCCESS")
+
+    events = list(progress_events(TASK_ID))
+
+    assert [event["stage"] for event in events] == ["downloading", progress.STAGE_FINISHED]
+    assert events[-1]["state"] == "SUCCESS"
+
+
+def test_progress_events_streams_new_events(server):
+    publish_progress(TASK_ID, "downloading")
+    events = progress_events(TASK_ID, keepalive_interval=0.1)
+    assert next(events)["stage"] == "downloading"
+
+    # An event from the history that is also seen on the channel is only yielded once
+    [downloading] = progress.redis_client.lrange(progress._history_key(TASK_ID), 0, -1)
+    progress.redis_client.publish(progress._channel_name(TASK_ID), downloading)
+    publish_progress(TASK_ID, "synth")
+    assert _next_event(events)["stage"] == "synth"
+    # No events, a keepalive
+    assert next(events) is None
+
+    publish_progress(TASK_ID, progress.STAGE_FINISHED, state="FAILURE")
+    assert _next_event(events)["state"] == "FAILURE"
+    assert next(events, "done") == "done"
+
+
+def test_publish_progress_survives_redis_errors(server, caplog):
+    server.connected = False
+
+    with caplog.at_level(logging.WARNING, logger="trompaalign.progress"):
+        publish_progress(TASK_ID, "downloading")
+
+    assert "Unable to publish progress" in caplog.text
+
+
+def test_task_progress_reporter_outside_of_a_worker(server):
+    report = progress.task_progress_reporter()
+    report("downloading")
+
+    assert progress.redis_client.keys("*") == []
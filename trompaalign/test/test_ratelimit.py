@@ -0,0 +1,90 @@
+import logging
+import time
+
+import fakeredis
+import pytest
+from flask import Flask
+from flask_redis import FlaskRedis
+
+from trompaalign import ratelimit
+from trompaalign.ratelimit import penalize_pod_host, pod_write_slot
+
+URI = "https://pod.example.org/alice/at.ac.mdw.trompa/scores/score.mei"
+
+
+@pytest.fixture
+def app(monkeypatch):
+    # Scripts are registered per client, by id(client)
+    monkeypatch.setattr(ratelimit, "_scripts", {})
+    app = Flask(__name__)
+    app.config.update(
+        REDIS_URL="redis://localhost:6379/0",
+        POD_WRITE_RATE=20,
+        POD_WRITE_BURST=2,
+        POD_WRITE_CONCURRENCY=1,
+        POD_WRITE_LEASE=300,
+        POD_WRITE_MAX_WAIT=5,
+    )
+    FlaskRedis.from_custom_provider(fakeredis.FakeStrictRedis, app).flushall()
+    with app.app_context():
+        yield app
+
+
+def _timed_write(uri=URI):
+    start = time.monotonic()
+    with pod_write_slot(uri):
+        pass
+    return time.monotonic() - start
+
+
+def _slots(app):
+    _, slots_key = ratelimit._host_keys(URI)
+    return app.extensions["redis"].zcard(slots_key)
+
+
+def test_token_bucket_refills(app):
+    # The first POD_WRITE_BURST writes don't wait, then tokens come at POD_WRITE_RATE per second
+    assert _timed_write() < 0.04
+    assert _timed_write() < 0.04
+    assert _timed_write() >= 0.04
+    time.sleep(0.1)
+    assert _timed_write() < 0.04
+    # Hosts have separate buckets
+    assert _timed_write("https://other.example.org/bob/score.mei") < 0.04
+    assert _slots(app) == 0
+
+
+def test_waits_until_a_slot_lease_expires(app):
+    # A worker that died while writing holds the only slot until its lease expires
+    app.config["POD_WRITE_LEASE"] = 0.3
+    assert ratelimit._acquire(app.extensions["redis"]._redis_client, URI) is not None
+
+    elapsed = _timed_write()
+
+    assert 0.2 <= elapsed < 2
+    assert _slots(app) == 0
+
+
+def test_penalized_host_backs_off(app):
+    penalize_pod_host(URI)
+
+    # The bucket is at -POD_WRITE_BURST tokens, so the next token is (1 + 2) / 20 seconds away
+    assert _timed_write() >= 0.1
+
+
+def test_writes_anyway_after_max_wait(app, caplog):
+    app.config["POD_WRITE_MAX_WAIT"] = 0.2
+    assert ratelimit._acquire(app.extensions["redis"]._redis_client, URI) is not None
+
+    with caplog.at_level(logging.WARNING, logger="trompaalign.ratelimit"):
+        elapsed = _timed_write()
+
+    assert 0.15 <= elapsed < 1
+    assert "Waited too long for a write slot" in caplog.text
+    # The write didn't take a slot, only the dead worker's lease is there
+    assert _slots(app) == 1
+
+
+def test_no_limit_outside_of_an_app():
+    with pod_write_slot(URI):
+        pass
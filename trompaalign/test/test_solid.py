@@ -0,0 +1,193 @@
+import http.server
+import threading
+import time
+from pathlib import Path
+
+import requests
+from rdflib import Graph, URIRef
+from rdflib.namespace import SDO
+
+from trompaalign import solid
+from trompaalign.solid import (
+    ContainerItem,
+    create_and_save_structure,
+    parse_container_ntriples,
+    parse_container_turtle,
+    update_score_list_bulk,
+)
+
+CONTAINER = "https://pod.example.org/alice/at.ac.mdw.trompa/"
+
+LISTING_NTRIPLES = f"""<{CONTAINER}> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/ns/ldp#BasicContainer> .
+<{CONTAINER}> <http://purl.org/dc/terms/modified> "2024-05-01T10:00:00.000Z"^^<http://www.w3.org/2001/XMLSchema#dateTime> .
+<{CONTAINER}> <http://www.w3.org/ns/ldp#contains> <{CONTAINER}scores/> .
+<{CONTAINER}> <http://www.w3.org/ns/ldp#contains> <{CONTAINER}scores-list> .
+<{CONTAINER}> <http://www.w3.org/ns/ldp#contains> <{CONTAINER}midi> .
+<{CONTAINER}scores/> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/ns/ldp#Container> .
+<{CONTAINER}midi> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/ns/ldp#Container> .
+<{CONTAINER}scores-list> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/ns/ldp#Resource> .
+<{CONTAINER}scores-list> <http://www.w3.org/ns/posix/stat#size> "120"^^<http://www.w3.org/2001/XMLSchema#integer> .
+"""
+
+LISTING_TURTLE = """@prefix ldp: <http://www.w3.org/ns/ldp#> .
+<> a ldp:Container, ldp:BasicContainer ;
+    ldp:contains <scores/>, <scores-list>, <midi> .
+<midi> a ldp:BasicContainer .
+<scores-list> a ldp:Resource .
+"""
+
+EXPECTED = [
+    ContainerItem(f"{CONTAINER}scores/", True),
+    ContainerItem(f"{CONTAINER}scores-list", False),
+    ContainerItem(f"{CONTAINER}midi", True),
+]
+
+
+def test_parse_container_ntriples():
+    assert parse_container_ntriples(LISTING_NTRIPLES.splitlines(), CONTAINER) == EXPECTED
+
+
+def test_parse_container_turtle():
+    assert sorted(parse_container_turtle(LISTING_TURTLE, CONTAINER), key=lambda i: i.uri) == sorted(
+        EXPECTED, key=lambda i: i.uri
+    )
+
+
+STORAGE = "https://pod.example.org/alice/"
+SCORES_LIST = f"{CONTAINER}scores-list"
+SCORES_LIST_TURTLE = f"""<{SCORES_LIST}> a <https://schema.org/ItemList> ;
+    <https://schema.org/itemListElement> <https://example.org/score-1.mei> .
+"""
+
+
+class FakeSolidClient:
+    def get_bearer_for_user(self, provider, profile, uri, method):
+        return {"authorization": "DPoP token"}
+
+
+class FakePodSession:
+    def __init__(self, patch_status, delay=0):
+        self.patch_status = patch_status
+        self.delay = delay
+        self.requests = []
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _response(self, method, uri, status, text="", headers=None):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+            self.requests.append((method, uri))
+        response = requests.Response()
+        response.status_code = status
+        response._content = text.encode("utf-8")
+        response.headers.update(headers or {})
+        response.url = uri
+        return response
+
+    def get(self, uri, headers=None, **kwargs):
+        return self._response("GET", uri, 200, SCORES_LIST_TURTLE, {"ETag": '"1"'})
+
+    def head(self, uri, headers=None, **kwargs):
+        return self._response("HEAD", uri, 200, headers={"ETag": '"1"'})
+
+    def patch(self, uri, data=None, headers=None, **kwargs):
+        self.patch_body = data.decode("utf-8")
+        return self._response("PATCH", uri, self.patch_status)
+
+    def put(self, uri, data=None, headers=None, **kwargs):
+        self.put_body = data
+        return self._response("PUT", uri, 201)
+
+
+def test_update_score_list_patches_new_items(monkeypatch):
+    session = FakePodSession(patch_status=205)
+    monkeypatch.setattr(solid, "pod_session", session)
+    urls = {"https://example.org/score-1.mei", "https://example.org/score-2.mei"}
+
+    assert update_score_list_bulk(FakeSolidClient(), None, None, STORAGE, urls) == (1, 2)
+
+    assert session.requests == [("GET", SCORES_LIST), ("PATCH", SCORES_LIST)]
+    assert session.patch_body.startswith("INSERT DATA {")
+    assert "<https://example.org/score-2.mei>" in session.patch_body
+    assert "score-1.mei" not in session.patch_body
+
+
+def test_update_score_list_falls_back_to_put(monkeypatch):
+    session = FakePodSession(patch_status=415)
+    monkeypatch.setattr(solid, "pod_session", session)
+
+    assert update_score_list_bulk(FakeSolidClient(), None, None, STORAGE, {"https://example.org/score-2.mei"}) == (1, 2)
+
+    assert [method for method, _ in session.requests] == ["GET", "PATCH", "HEAD", "PUT"]
+    graph = Graph().parse(data=session.put_body, format="n3")
+    assert set(graph.objects(URIRef(SCORES_LIST), SDO.itemListElement)) == {
+        URIRef("https://example.org/score-1.mei"),
+        URIRef("https://example.org/score-2.mei"),
+    }
+
+
+def test_create_and_save_structure_writes_concurrently(monkeypatch):
+    session = FakePodSession(patch_status=205, delay=0.2)
+    monkeypatch.setattr(solid, "pod_session", session)
+    mei = (Path(__file__).parent / "data" / "Beethoven_Op119_Nr08-Breitkopf.mei").read_text()
+
+    start = time.perf_counter()
+    score = create_and_save_structure(
+        FakeSolidClient(), None, None, STORAGE, "Bagatelle", mei, "https://example.org/score-2.mei", "mei-copy"
+    )
+    elapsed = time.perf_counter() - start
+
+    assert score.startswith(f"{CONTAINER}scores/")
+    assert session.max_in_flight == 4
+    # Two containers, score and segments at once, then the scores list is read and patched
+    assert elapsed < 4 * session.delay
+    assert [method for method, _ in session.requests] == ["PUT", "PUT", "PUT", "PUT", "GET", "PATCH"]
+
+
+def test_pod_session_per_thread():
+    sessions = []
+    thread = threading.Thread(target=lambda: sessions.append(solid.pod_session.session()))
+    thread.start()
+    thread.join()
+    sessions.append(solid.pod_session.session())
+
+    assert sessions[0] is not sessions[1]
+    assert solid.pod_session.session() is sessions[1]
+    for session in sessions:
+        assert isinstance(session, requests.Session)
+        assert session.hooks["response"] == [solid.observe_pod_response]
+
+
+def test_pod_session_does_not_keep_cookies():
+    cookies = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            cookies.append(self.headers.get("Cookie"))
+            self.send_response(200)
+            self.send_header("Set-Cookie", "session=alice; Path=/")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/bob/profile/card"
+        for _ in range(2):
+            solid.pod_session.get(url).raise_for_status()
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+    assert cookies == [None, None]
+    assert len(solid.pod_session.cookies) == 0
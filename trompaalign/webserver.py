@@ -1,3 +1,4 @@
+import json
 import os
 import logging
 from dataclasses import asdict, is_dataclass
@@ -14,14 +15,10 @@ from solidauth import client
 import solidauth
 
 from trompaalign import celery_serializers  # noqa: F401
-from trompaalign import extensions, tasks
-from trompaalign.solid import (
-    SolidError,
-    get_storage_from_profile,
-    lookup_provider_from_profile,
-    upload_midi_to_pod,
-    upload_webmidi_to_pod,
-)
+from trompaalign import extensions, metrics, tasks
+from trompaalign.progress import progress_events
+from trompaalign.solid import SolidError, lookup_provider_from_profile
+from trompaalign.staging import stage_upload
 
 
 logger = logging.getLogger(__name__)
@@ -79,6 +76,7 @@ def create_app():
     extensions.redis_client.init_app(app)
     extensions.backend.init_app(app)
     extensions.cors.init_app(app)
+    metrics.init_app(app)
 
     if app.config["SENTRY_DSN"]:
         sentry_sdk.init(
@@ -114,6 +112,12 @@ def get_client_id_document_url_if_configured():
         return None
 
 
+@webserver_bp.route("/metrics")
+def prometheus_metrics():
+    celery_app = current_app.extensions["celery"]
+    return metrics.metrics_response(extensions.redis_client, [celery_app.conf.task_default_queue])
+
+
 @webserver_bp.route("/clara.jsonld")
 def clara_jsonld():
     # In Solid-OIDC you can register a client by having the "client_id" field be a URL to a json-ld document
@@ -271,30 +275,69 @@ def check_user_perms():
     return jsonify({"has_permission": has_permission})
 
 
-@webserver_bp.route("/api/add/status")
-def add_score_status():
-    task_id = request.args.get("task")
-    if not task_id:
-        return jsonify({"status": "error", "message": "Missing `task` parameter"}), 400
-
-    result = AsyncResult(task_id)
+def add_score_status_payload(result: AsyncResult):
+    """The status of an add_score task, as returned to the frontend"""
     if result.failed():
         if isinstance(result.result, SolidError):
             # This is a known failure mode, one of our custom exceptions
-            return jsonify({"status": "error", "error": str(result.result)})
+            return {"status": "error", "error": str(result.result)}
         else:
             # An unknown failure mode
             print("Unknown failure mode", result.result)
             print(result.traceback)
             sentry_sdk.capture_exception(result.result)
-            return jsonify({"status": "unknown", "error": str(result.result)})
+            return {"status": "unknown", "error": str(result.result)}
     else:
         if result.ready():
             # Finished
-            return jsonify({"status": "ok", "container": result.result})
+            return {"status": "ok", "container": result.result}
         else:
             # Still running
-            return jsonify({"status": "pending"})
+            return {"status": "pending"}
+
+
+def task_event_stream(task_id, status_payload):
+    """Stream progress events for a task to the browser as Server-Sent Events.
+
+    Each stage that the task enters is sent as a `progress` event. When the task finishes, a single `status`
+    event is sent with the same payload as the corresponding /status endpoint, and the stream is closed.
+    """
+
+    def generate():
+        for event in progress_events(task_id):
+            if event is None:
+                # No events for a while. In case the task ended without us seeing its final event
+                # check the result backend, otherwise send a comment to keep the connection open
+                if AsyncResult(task_id).ready():
+                    break
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: progress\ndata: {json.dumps(event)}\n\n"
+        yield f"event: status\ndata: {json.dumps(status_payload(AsyncResult(task_id)))}\n\n"
+
+    return flask.Response(
+        flask.stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@webserver_bp.route("/api/add/status")
+def add_score_status():
+    task_id = request.args.get("task")
+    if not task_id:
+        return jsonify({"status": "error", "message": "Missing `task` parameter"}), 400
+
+    return jsonify(add_score_status_payload(AsyncResult(task_id)))
+
+
+@webserver_bp.route("/api/add/events")
+def add_score_events():
+    task_id = request.args.get("task")
+    if not task_id:
+        return jsonify({"status": "error", "message": "Missing `task` parameter"}), 400
+
+    return task_event_stream(task_id, add_score_status_payload)
 
 
 @webserver_bp.route("/api/add", methods=["POST"])
@@ -314,71 +357,77 @@ def add_score():
 @webserver_bp.route("/api/align", methods=["POST"])
 def align():
     file = request.files.get("file")
-    payload = file.read()
     midi_type = request.form.get("midi_type")
     score_url = request.form.get("score")
     profile = request.form.get("profile")
     label = request.form.get("label")
+    # Optional, the id of the MEI expansion that was performed, or "auto" to find it
+    expansion = request.form.get("expansion") or None
 
-    provider = lookup_provider_from_profile(profile)
-    storage = get_storage_from_profile(profile)
-    use_client_id_document = flask.current_app.config["ALWAYS_USE_CLIENT_URL"]
-    cl = client.SolidClient(extensions.backend.backend, use_client_id_document=use_client_id_document)
-
-    print("Uploading file")
-    if midi_type == "webmidi":
-        webmidi_url = upload_webmidi_to_pod(cl, provider, profile, storage, payload)
-        midi_url = None
-    elif midi_type == "midi":
-        midi_url = upload_midi_to_pod(cl, provider, profile, storage, payload)
-        webmidi_url = None
-    else:
+    if file is None:
+        return jsonify({"status": "error", "message": "Missing `file` parameter"}), 400
+    if midi_type not in ("webmidi", "midi"):
         return jsonify({"status": "error", "message": "Must have midi_type of webmidi or midi"}), 400
     if not label:
         return jsonify({"status": "error", "message": "Missing `label` parameter"}), 400
 
-    task = tasks.align_recording.delay(profile, score_url, webmidi_url, midi_url, label)
+    # Saving the file to the user's pod is the first step of the task, so that this request doesn't wait on the pod
+    staged_key = stage_upload(file.read())
+    task = tasks.align_staged_recording.delay(profile, score_url, staged_key, midi_type, label, expansion)
     print("made task", task.task_id)
     return jsonify({"status": "queued", "task_id": task.task_id})
 
 
-@webserver_bp.route("/api/align/status")
-def align_status():
-    task_id = request.args.get("task")
-    if not task_id:
-        return jsonify({"status": "error", "message": "Missing `task` parameter"}), 400
-
-    result = AsyncResult(task_id)
+def align_status_payload(result: AsyncResult):
+    """The status of an align_recording task, as returned to the frontend"""
     if result.failed():
         if isinstance(result.result, SolidError):
             # This is a known failure mode, one of our custom exceptions
-            return jsonify({"status": "error", "error": str(result.result)})
+            return {"status": "error", "error": str(result.result)}
         if isinstance(result.result, tasks.AlignmentFailed):
-            return jsonify({"status": "error", "error": str(result.result), "midi_url": result.result.midi_url})
+            return {"status": "error", "error": str(result.result), "midi_url": result.result.midi_url}
         else:
             # An unknown failure mode
             print("Unknown failure mode", result.result)
             print(result.traceback)
             sentry_sdk.capture_exception(result.result)
-            return jsonify({"status": "unknown", "error": str(result.result)})
+            return {"status": "unknown", "error": str(result.result)}
     else:
         if result.ready():
             # Finished
             payload = result.result
             response = {"status": "ok"}
             if payload is None:
-                return jsonify(response)
+                return response
             if is_dataclass(payload):
                 response.update(asdict(payload))
-                return jsonify(response)
+                return response
             logger.error(
                 "Unexpected payload type returned from align_recording task: %s",
                 type(payload),
             )
-            return jsonify(response)
+            return response
         else:
             # Still running
-            return jsonify({"status": "pending"})
+            return {"status": "pending"}
+
+
+@webserver_bp.route("/api/align/status")
+def align_status():
+    task_id = request.args.get("task")
+    if not task_id:
+        return jsonify({"status": "error", "message": "Missing `task` parameter"}), 400
+
+    return jsonify(align_status_payload(AsyncResult(task_id)))
+
+
+@webserver_bp.route("/api/align/events")
+def align_events():
+    task_id = request.args.get("task")
+    if not task_id:
+        return jsonify({"status": "error", "message": "Missing `task` parameter"}), 400
+
+    return task_event_stream(task_id, align_status_payload)
 
 
 @webserver_bp.route("/", defaults={"path": "index.html"})